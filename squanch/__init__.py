@@ -3,10 +3,22 @@
 name = "squanch"
 # Load all modules
 from squanch.agent import *
+from squanch.analysis import *
 from squanch.channels import *
+from squanch.codes import *
 from squanch.errors import *
+from squanch.factored import *
+from squanch.frames import *
 from squanch.gates import *
 from squanch.linalg import *
+from squanch.memory import *
+from squanch.mps import *
+from squanch.network import *
+from squanch.noise import *
+from squanch.qkd import *
 from squanch.qstream import *
 from squanch.qubit import *
+from squanch.repeaters import *
+from squanch.rng import *
 from squanch.simulate import *
+from squanch.transport import *
@@ -1,10 +1,112 @@
+import atexit
+import functools
 import multiprocessing
+import os
+import pickle
 import sys
+from multiprocessing import resource_tracker, shared_memory
 
-from squanch import channels
-from squanch.qstream import QStream
+import numpy as np
 
-__all__ = ["Agent"]
+from squanch import channels, rng
+from squanch.memory import QuantumMemory
+from squanch.network import Network, accepts_queue, default_network
+
+__all__ = ["Agent", "SharedOutputArray"]
+
+# Shared memory blocks held open by this process, by block name
+_shared_blocks = {}
+# Names of the blocks created by this process and untracked by the resource tracker, so that they outlive it
+_untracked_blocks = set()
+
+
+@atexit.register
+def _release_shared_blocks():
+    '''
+    Close and remove the shared-memory output arrays held by this process when it exits. Agent processes exit
+    without running exit handlers, so arrays they create outlive them and are removed by the parent which collects them.
+    '''
+    for block in _shared_blocks.values():
+        try:
+            block.close()
+            block.unlink()
+        except (BufferError, FileNotFoundError):
+            pass
+    _shared_blocks.clear()
+
+
+def _using_agent_stream(run):
+    '''
+    Wrap an agent's ``run()`` method so that it first makes the agent's random stream the stream of the running
+    process. The stream then reaches the agent process under any start method, not only when it is forked.
+
+    :param callable run: the ``run()`` method
+    :return: the wrapped method
+    '''
+    @functools.wraps(run)
+    def wrapped(self, *args, **kwargs):
+        rng.set_stream(self.rng)
+        return run(self, *args, **kwargs)
+
+    return wrapped
+
+
+class SharedOutputArray:
+    '''
+    A small, picklable handle to an output array in shared memory, stored in the shared output dictionary in place of
+    the array itself
+    '''
+
+    __slots__ = ("block_name", "shape", "dtype")
+
+    def __init__(self, block_name, shape, dtype):
+        '''
+        Instantiate the handle
+
+        :param str block_name: the name of the shared memory block
+        :param tuple shape: the shape of the array
+        :param str dtype: the dtype of the array, as a string
+        '''
+        self.block_name = block_name
+        self.shape = shape
+        self.dtype = dtype
+
+    def __getstate__(self):
+        return self.block_name, self.shape, self.dtype
+
+    def __setstate__(self, state):
+        self.block_name, self.shape, self.dtype = state
+
+    def attach(self):
+        '''
+        Map the shared array into this process without copying it. The block stays open (and is removed when this
+        process exits), so the returned array remains valid.
+
+        :return: the array
+        '''
+        block = _shared_blocks.get(self.block_name)
+        if block is None:
+            block = shared_memory.SharedMemory(name = self.block_name)
+            _shared_blocks[self.block_name] = block
+        return np.ndarray(self.shape, dtype = self.dtype, buffer = block.buf)
+
+    def unlink(self):
+        '''
+        Remove the shared memory block, so that its memory is freed once no process maps it any more. Arrays already
+        attached stay valid, but the block can no longer be attached.
+        '''
+        try:
+            block = _shared_blocks.get(self.block_name)
+            if block is None:
+                block = shared_memory.SharedMemory(name = self.block_name)
+                _shared_blocks[self.block_name] = block
+            elif self.block_name in _untracked_blocks:
+                # Track the block again, since unlinking it untracks it
+                resource_tracker.register(block._name, "shared_memory")
+                _untracked_blocks.discard(self.block_name)
+            block.unlink()
+        except FileNotFoundError:
+            pass
 
 
 class Agent(multiprocessing.Process):
@@ -14,11 +116,20 @@ class Agent(multiprocessing.Process):
 
     * Incoming and outgoing classical and quantum channels connecting them to other agents
     * Classical memory, implemented simply as a Python dictionary
-    * Quantum memory, implemented as a Python dictionary of qubits stored in keys of agent names
+    * Quantum memory, implemented as a Python dictionary of ``QuantumMemory`` qubit stores in keys of agent names
     * Runtime logic in the form of an Agent.run() method
     '''
 
-    def __init__(self, qstream, out = None, name = None, data = None):
+    def __init_subclass__(cls, **kwargs):
+        '''
+        Agent subclasses which override ``run()`` have it wrapped to install the agent's random stream first
+        '''
+        super().__init_subclass__(**kwargs)
+        if "run" in cls.__dict__:
+            cls.run = _using_agent_stream(cls.__dict__["run"])
+
+    def __init__(self, qstream, out = None, name = None, data = None, memory_model = None, noise_model = None,
+                 network = None):
         '''
         Instantiate an Agent from a unique identifier and a shared memory pool
 
@@ -26,6 +137,15 @@ class Agent(multiprocessing.Process):
         :param dict out: shared output dictionary to pass to Agent processes to allow for "returns". Default: {}
         :param str name: the unique identifier for the Agent. Default: class name
         :param any data: data to pass to the Agent's process, stored in ``self.data``. Default: None
+        :param DecoherenceModel memory_model: model of how qubits held in the agent's quantum memory decohere over
+                                              the agent's clock, e.g. ``DecoherenceModel(t1, t2)``. Default: None
+                                              (ideal memory)
+        :param NoiseModel noise_model: gate-level noise model for gates and measurements performed by this agent.
+                                       Default: the noise model of ``qstream``, if any
+        :param Network|bool network: a network to add the agent to, so that channels connecting it to other agents of
+                                     the network deliver to its mailbox, or False to give each of its channels its own
+                                     queue. Default: the network set with ``Network.as_default()``, if any, else an
+                                     implicit network which is merged with those of the agents it is connected to
         '''
         multiprocessing.Process.__init__(self)
         # Name of the agent, e.g. "Alice". Defaults to the name of the class.
@@ -46,7 +166,9 @@ class Agent(multiprocessing.Process):
         out[self.name] = None
         out[self.name + ":progress"] = 0
         out[self.name + ":progress_max"] = qstream.state.shape[0]
-        self.qstream = QStream.from_array(qstream.state, agent = self)
+        self.qstream = qstream.view(agent = self)
+        if noise_model is not None:
+            self.qstream.noise_model = noise_model
         self.out = out
 
         # Communication channels are dicts; keys: agent objects, values: channel objects
@@ -59,11 +181,27 @@ class Agent(multiprocessing.Process):
         # classicalMemorySize = 2 ** 16
         self.cmem = {}  # np.zeros(classicalMemorySize)
 
-        # Quantum memory is an array of "blocks". Each element in a block holds a qubit
-        # qBlockSize = 256
-        # numQBlocks = 64
-        self.qmem = {}  # ((None,) * qBlockSize,) * numQBlocks
-        # self.qDecayTimescale = 100.0  # Coherence timescale for qubits in quantum memory
+        # Quantum memory maps agents to compact arrays of (system, qubit) references into self.qstream
+        self.qmem = {}
+        # Decoherence model for qubits in quantum memory, applied lazily as stored qubits are accessed
+        self.memory_model = memory_model
+        if memory_model is not None and memory_model.is_mixing and self.qstream.adaptive:
+            self.qstream.promote()
+
+        # Random stream for the agent's protocol and simulation; Simulation gives each agent process its own stream
+        self.rng = rng.current_stream()
+
+        # Coordinator of checkpoints taken while the agent runs, given to the agent by Simulation.run()
+        self._checkpoints = None
+
+        # Network whose mailboxes carry this agent's channels, if any
+        self.network = None
+        if network is None:
+            network = default_network()
+        if network is None:
+            network = Network(implicit = True)
+        if network is not False:
+            network.add(self)
 
     def __hash__(self):
         '''
@@ -92,6 +230,32 @@ class Agent(multiprocessing.Process):
         '''
         return multiprocessing.Manager().dict()
 
+    def _channel_queues(self, other, channel, kind, kwargs):
+        '''
+        Channel arguments for both directions of a link, routing them through the receiving agents' mailboxes if
+        both agents belong to the same network (after merging their implicit networks), the channel model accepts a
+        queue and no queue was given explicitly
+
+        :param Agent other: the other agent
+        :param QChannel|CChannel channel: the channel model
+        :param str kind: "q" for quantum channels, "c" for classical channels
+        :param dict kwargs: the channel arguments
+        :return: tuple of (arguments of the channel to other, arguments of the channel from other)
+        '''
+        if "queue" in kwargs or not accepts_queue(channel):
+            return kwargs, kwargs
+        ours, theirs = self.network, other.network
+        if ours is not theirs and getattr(ours, "implicit", False) and getattr(theirs, "implicit", False) \
+                and not set(ours.mailboxes) & set(theirs.mailboxes):
+            # Merge the smaller implicit network into the larger one
+            larger, smaller = (ours, theirs) if len(ours) >= len(theirs) else (theirs, ours)
+            larger.merge(smaller)
+        network = self.network
+        if network is None or other.network is not network:
+            return kwargs, kwargs
+        return (dict(kwargs, queue = network.queue(self, other, kind)),
+                dict(kwargs, queue = network.queue(other, self, kind)))
+
     def qconnect(self, other, channel = channels.QChannel, **kwargs):
         '''
         Connect Alice and Bob bidirectionally with a specified quantum channel model
@@ -101,15 +265,16 @@ class Agent(multiprocessing.Process):
         :param \**kwargs: optional channel arguments
         '''
         # Instantiate quantum channels between Alice and Bob
-        qchannel_alice_to_bob = channel(self, other, **kwargs)
-        qchannel_bob_to_alice = channel(other, self, **kwargs)
+        to_other, from_other = self._channel_queues(other, channel, "q", kwargs)
+        qchannel_alice_to_bob = channel(self, other, **to_other)
+        qchannel_bob_to_alice = channel(other, self, **from_other)
         self.qchannels_out[other] = qchannel_alice_to_bob
         self.qchannels_in[other] = qchannel_bob_to_alice
         other.qchannels_out[self] = qchannel_bob_to_alice
         other.qchannels_in[self] = qchannel_alice_to_bob
         # Make a section of Alice's/Bob's quantum memory for Bob/Alice
-        self.qmem[other] = []
-        other.qmem[self] = []
+        self.qmem[other] = QuantumMemory(self.qstream, agent = self)
+        other.qmem[self] = QuantumMemory(other.qstream, agent = other)
 
     def qsend(self, target, qubit):
         '''
@@ -143,6 +308,8 @@ class Agent(multiprocessing.Process):
 
         :param Qubit qubit: the qubit to store
         '''
+        if self not in self.qmem:
+            self.qmem[self] = QuantumMemory(self.qstream, agent = self)
         self.qmem[self].append(qubit)
 
     def cconnect(self, other, channel = channels.CChannel, **kwargs):
@@ -154,8 +321,9 @@ class Agent(multiprocessing.Process):
         :param \**kwargs: optional channel arguments
         '''
         # Instantiate classical channels between Alice and Bob
-        cchannel_alice_to_bob = channel(self, other, **kwargs)
-        cchannel_bob_to_alice = channel(other, self, **kwargs)
+        to_other, from_other = self._channel_queues(other, channel, "c", kwargs)
+        cchannel_alice_to_bob = channel(self, other, **to_other)
+        cchannel_bob_to_alice = channel(other, self, **from_other)
         self.cchannels_out[other] = cchannel_alice_to_bob
         self.cchannels_in[other] = cchannel_bob_to_alice
         other.cchannels_out[self] = cchannel_bob_to_alice
@@ -193,6 +361,49 @@ class Agent(multiprocessing.Process):
         '''Runtime logic for the Agent; this method should be overridden in child classes.'''
         pass
 
+    def save_state(self, path):
+        '''
+        Write the agent's classical state (clock, stream head, classical and quantum memories, data and output) to
+        ``<path>/<name>.agent``. ``Simulation.checkpoint()`` calls this for each agent, in the agent's own process if it
+        is running; the state of the shared ``QStream`` itself is written by ``Simulation.checkpoint()``.
+
+        :param str path: the checkpoint directory
+        '''
+        state = {
+            "time": self.time,
+            "stream_index": self.qstream.index,
+            "data": self.data,
+            # Agent keys are saved by name and matched to the connected agents on load; other keys are saved as is
+            "cmem": [(isinstance(key, Agent), getattr(key, "name", key), memory) for key, memory in self.cmem.items()],
+            "qmem": {agent.name: memory.serialize() for agent, memory in self.qmem.items()},
+            "out": {key: self.out[key] for key in (self.name, self.name + ":progress") if key in self.out},
+        }
+        filename = os.path.join(path, self.name + ".agent")
+        with open(filename + ".tmp", "wb") as f:
+            pickle.dump(state, f, protocol = pickle.HIGHEST_PROTOCOL)
+        os.replace(filename + ".tmp", filename)
+
+    def load_state(self, path):
+        '''
+        Restore the agent's classical state from a file written by ``Agent.save_state()``. Memory sections are matched
+        to connected agents by name, so the agents must be connected the same way as when the state was saved.
+
+        :param str path: the checkpoint directory
+        '''
+        with open(os.path.join(path, self.name + ".agent"), "rb") as f:
+            state = pickle.load(f)
+        agents = {agent.name: agent for agent in
+                  list(self.qchannels_in) + list(self.cchannels_in) + list(self.qmem) + list(self.cmem) + [self]
+                  if isinstance(agent, Agent)}
+        self.time = state["time"]
+        self.qstream.index = state["stream_index"]
+        self.data = state["data"]
+        self.cmem = {agents[key] if is_agent else key: memory for is_agent, key, memory in state["cmem"]}
+        self.qmem = {agents[name]: QuantumMemory.from_serialized(self.qstream, memory, agent = self)
+                     for name, memory in state["qmem"].items()}
+        for key, value in state["out"].items():
+            self.out[key] = value
+
     def output(self, thing):
         '''
         Output something to ``self.out[self.name]``
@@ -201,13 +412,53 @@ class Agent(multiprocessing.Process):
         '''
         self.out[self.name] = thing
 
+    def output_array(self, name, shape, dtype = np.float64):
+        '''
+        Allocate an output array in shared memory, to write large results into directly. Only a small handle is stored
+        in the shared output dictionary, at ``self.out[self.name + ":" + name]``, so no data passes through the manager
+        process; after the simulation, the parent maps the same memory with ``Agent.shared_output_arrays(out)``. The
+        handle is stored as soon as the block is created, so ``Simulation.run()`` can remove the block even if the
+        agent fails.
+
+        :param str name: the name of the output array
+        :param tuple shape: the shape of the array
+        :param np.dtype dtype: the dtype of the array; default: np.float64
+        :return: the zero-initialized array, backed by shared memory
+        '''
+        dtype = np.dtype(dtype)
+        size = max(1, int(np.prod(shape)) * dtype.itemsize)
+        block = shared_memory.SharedMemory(create = True, size = size)
+        handle = SharedOutputArray(block.name, tuple(int(n) for n in np.atleast_1d(shape)), dtype.str)
+        self.out[self.name + ":" + name] = handle
+        # The block must outlive this process; the process which collects the handle is responsible for removing it
+        resource_tracker.unregister(block._name, "shared_memory")
+        _untracked_blocks.add(block.name)
+        _shared_blocks[block.name] = block
+        array = handle.attach()
+        array[...] = 0
+        return array
+
+    @staticmethod
+    def shared_output_arrays(out):
+        '''
+        Map the shared-memory output arrays allocated by agents with ``Agent.output_array()`` into this process
+
+        :param dict out: the shared output dictionary of the agents
+        :return: dict mapping each ``"<agent name>:<array name>"`` key of ``out`` to its array
+        '''
+        return {key: value.attach() for key, value in out.items() if isinstance(value, SharedOutputArray)}
+
     def update_progress(self, value):
         '''
         Update the progress of this agent in the shared output dictionary. Used in Simulation.progress_monitor().
+        Iterating over the agent's stream calls this before each system, which is where a running agent pauses for a
+        checkpoint requested with ``Simulation.checkpoint()``.
 
         :param value: the value to update the progress to (out of a max of len(self.qstream))
         '''
         self.out[self.name + ":progress"] = value
+        if self._checkpoints is not None:
+            self._checkpoints.reached(self, value)
 
     def increment_progress(self):
         '''
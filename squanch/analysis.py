@@ -0,0 +1,260 @@
+import functools
+
+import numpy as np
+
+__all__ = ["partial_trace", "probabilities", "fidelity", "purity", "von_neumann_entropy", "concurrence"]
+
+# Approximate working-set size (in bytes) used to pick a chunk size when none is given
+CHUNK_BYTES = 2 ** 26
+
+# Pauli-Y tensor Pauli-Y, used for the spin-flipped state in the concurrence
+_YY = np.kron(np.array([[0, -1j], [1j, 0]]), np.array([[0, -1j], [1j, 0]]))
+
+
+def _state_array(states):
+    '''
+    Get the raw state array from a ``QStream`` or array of states
+
+    :param QStream|np.array states: the stream, or a num_systems x 2^n (x 2^n) array of state vectors (density matrices)
+    :return: the state array
+    '''
+    return states.state if hasattr(states, "state") else np.asarray(states)
+
+
+def _per_size_class(function):
+    '''
+    Let an analysis function accept a ``RaggedQStream``: the function is applied to each size class of the stream and
+    its per-system results are gathered back into stream order
+
+    :param callable function: the analysis function, taking the states as its first argument
+    :return: the wrapped function
+    '''
+    @functools.wraps(function)
+    def wrapper(states, *args, **kwargs):
+        classes = getattr(states, "classes", None)
+        if classes is None:
+            return function(states, *args, **kwargs)
+        result = None
+        for size, stream in classes.items():
+            values = function(stream, *args, **kwargs)
+            if result is None:
+                result = np.empty((states.num_systems,) + values.shape[1:], dtype = values.dtype)
+            result[states.system_sizes == size] = values
+        return result
+    return wrapper
+
+
+def _chunks(array, chunk_size):
+    '''
+    Iterate over an array of states in chunks along the system axis, upcasting each chunk to double precision
+
+    :param np.array array: the num_systems x 2^n (x 2^n) state array
+    :param int chunk_size: number of systems per chunk; if None, picked to keep the working set near ``CHUNK_BYTES``
+    :return: tuples of (slice into the system axis, complex128 chunk)
+    '''
+    if chunk_size is None:
+        per_system = 16 * int(np.prod(array.shape[1:])) * 4
+        chunk_size = max(1, CHUNK_BYTES // per_system)
+    for start in range(0, array.shape[0], chunk_size):
+        window = slice(start, min(start + chunk_size, array.shape[0]))
+        yield window, np.asarray(array[window], dtype = np.complex128)
+
+
+def _reduce(chunk, keep, is_density):
+    '''
+    Compute the reduced density matrices of a chunk of states over a subset of qubits
+
+    :param np.array chunk: a chunk of state vectors or density matrices
+    :param [int] keep: the qubit indices to keep, in the order they should appear in the result
+    :param bool is_density: whether the chunk holds density matrices
+    :return: a len(chunk) x 2^k x 2^k array of reduced density matrices
+    '''
+    num_systems, dim = chunk.shape[0], chunk.shape[1]
+    num_qubits = int(np.log2(dim))
+    keep = list(keep)
+    traced = [i for i in range(num_qubits) if i not in keep]
+    dim_keep, dim_traced = 2 ** len(keep), 2 ** len(traced)
+    if not is_density:
+        psi = chunk.reshape((num_systems,) + (2,) * num_qubits)
+        psi = psi.transpose([0] + [1 + i for i in keep] + [1 + i for i in traced])
+        psi = psi.reshape((num_systems, dim_keep, dim_traced))
+        return np.matmul(psi, psi.conj().transpose(0, 2, 1))
+    rho = chunk.reshape((num_systems,) + (2,) * (2 * num_qubits))
+    rows = [1 + i for i in keep] + [1 + i for i in traced]
+    cols = [1 + num_qubits + i for i in keep] + [1 + num_qubits + i for i in traced]
+    rho = rho.transpose([0] + rows + cols).reshape((num_systems, dim_keep, dim_traced, dim_keep, dim_traced))
+    return np.einsum("aijkj->aik", rho)
+
+
+def _reduced_chunks(states, qubits, chunk_size):
+    '''
+    Iterate over chunks of density matrices, optionally reduced to a subset of qubits
+
+    :param QStream|np.array states: the stream or state array to analyze
+    :param [int] qubits: qubit indices to keep; if None, the full system is used
+    :param int chunk_size: number of systems per chunk
+    :return: tuples of (slice into the system axis, chunk of density matrices)
+    '''
+    array = _state_array(states)
+    is_density = array.ndim == 3
+    for window, chunk in _chunks(array, chunk_size):
+        if qubits is not None:
+            yield window, _reduce(chunk, qubits, is_density)
+        elif is_density:
+            yield window, chunk
+        else:
+            yield window, np.einsum("ai,aj->aij", chunk, chunk.conj())
+
+
+@_per_size_class
+def partial_trace(states, keep, chunk_size = None):
+    '''
+    Compute the reduced density matrix of every system in a stream, tracing out all qubits not in ``keep``
+
+    :param QStream|RaggedQStream|np.array states: the stream, or an array of state vectors or density matrices
+    :param [int] keep: the qubit indices to keep, in the order they should appear in the result
+    :param int chunk_size: number of systems to process at once; bounds the temporary memory used
+    :return: a num_systems x 2^k x 2^k complex array of reduced density matrices
+    '''
+    array = _state_array(states)
+    dim_keep = 2 ** len(keep)
+    result = np.empty((array.shape[0], dim_keep, dim_keep), dtype = array.dtype)
+    for window, rho in _reduced_chunks(array, keep, chunk_size):
+        result[window] = rho
+    return result
+
+
+@_per_size_class
+def probabilities(states, qubits, basis = None, chunk_size = None):
+    '''
+    Compute the computational-basis outcome distribution of a subset of qubits for every system in a stream, without
+    modifying the states. Outcomes are indexed with the first qubit in ``qubits`` as the most significant bit.
+
+    :param QStream|RaggedQStream|np.array states: the stream, or an array of state vectors or density matrices
+    :param [int] qubits: the qubit indices to compute the joint outcome distribution of
+    :param np.array|[np.array] basis: optional basis change applied before reading the distribution; either a
+                                      single 2x2 unitary used for every qubit or a list of one 2x2 unitary (or None)
+                                      per qubit
+    :param int chunk_size: number of systems to process at once; bounds the temporary memory used
+    :return: a num_systems x 2^k array of outcome probabilities
+    '''
+    array = _state_array(states)
+    qubits = list(qubits)
+    num_qubits = int(np.log2(array.shape[1]))
+    result = np.empty((array.shape[0], 2 ** len(qubits)))
+    if basis is not None:
+        # Read the diagonal of U rho U^dagger on the reduced system of the measured qubits
+        if not isinstance(basis, (list, tuple)):
+            basis = [basis] * len(qubits)
+        rotation = np.array([[1.0]])
+        for unitary in basis:
+            rotation = np.kron(rotation, np.eye(2) if unitary is None else unitary)
+        for window, rho in _reduced_chunks(array, qubits, chunk_size):
+            result[window] = np.real(np.einsum("ij,ajk,ik->ai", rotation, rho, rotation.conj()))
+        return result
+    traced = tuple(1 + i for i in range(num_qubits) if i not in qubits)
+    order = [0] + [1 + sorted(qubits).index(i) for i in qubits]
+    for window, chunk in _chunks(array, chunk_size):
+        diagonal = np.abs(chunk) ** 2 if array.ndim == 2 else np.real(np.einsum("aii->ai", chunk))
+        diagonal = diagonal.reshape((diagonal.shape[0],) + (2,) * num_qubits).sum(axis = traced)
+        result[window] = diagonal.transpose(order).reshape((diagonal.shape[0], -1))
+    return result
+
+
+@_per_size_class
+def fidelity(states, target, qubits = None, chunk_size = None):
+    '''
+    Compute the fidelity of every system in a stream with a target state. For a pure target |psi>, this is
+    <psi|rho|psi>; for a mixed target sigma, the Uhlmann fidelity (tr sqrt(sqrt(sigma) rho sqrt(sigma)))^2 is used.
+
+    :param QStream|RaggedQStream|np.array states: the stream, or an array of state vectors or density matrices
+    :param np.array target: the target state vector or density matrix, on the (reduced) system
+    :param [int] qubits: if specified, compare only the reduced state of these qubits against the target
+    :param int chunk_size: number of systems to process at once; bounds the temporary memory used
+    :return: a num_systems array of fidelities
+    '''
+    array = _state_array(states)
+    target = np.asarray(target, dtype = np.complex128)
+    result = np.empty(array.shape[0])
+    if target.ndim == 1:
+        if qubits is None and array.ndim == 2:
+            # Pure states against a pure target: |<psi|phi>|^2
+            for window, chunk in _chunks(array, chunk_size):
+                result[window] = np.abs(np.dot(chunk, target.conj())) ** 2
+        else:
+            for window, rho in _reduced_chunks(array, qubits, chunk_size):
+                result[window] = np.real(np.einsum("i,aij,j->a", target.conj(), rho, target))
+        return result
+    # Mixed target: diagonalize the target once and reuse its square root for every system
+    eigenvalues, eigenvectors = np.linalg.eigh(target)
+    sqrt_target = np.dot(eigenvectors * np.sqrt(np.clip(eigenvalues, 0, None)), eigenvectors.conj().T)
+    for window, rho in _reduced_chunks(array, qubits, chunk_size):
+        product = np.matmul(np.matmul(sqrt_target, rho), sqrt_target)
+        eigenvalues = np.clip(np.linalg.eigvalsh(product), 0, None)
+        result[window] = np.sum(np.sqrt(eigenvalues), axis = 1) ** 2
+    return result
+
+
+@_per_size_class
+def purity(states, qubits = None, chunk_size = None):
+    '''
+    Compute the purity tr(rho^2) of every system (or reduced system) in a stream
+
+    :param QStream|RaggedQStream|np.array states: the stream, or an array of state vectors or density matrices
+    :param [int] qubits: if specified, compute the purity of the reduced state of these qubits
+    :param int chunk_size: number of systems to process at once; bounds the temporary memory used
+    :return: a num_systems array of purities
+    '''
+    array = _state_array(states)
+    result = np.empty(array.shape[0])
+    for window, rho in _reduced_chunks(array, qubits, chunk_size):
+        # tr(rho^2) = sum_ij |rho_ij|^2 for Hermitian rho
+        result[window] = np.sum(np.abs(rho) ** 2, axis = (1, 2))
+    return result
+
+
+@_per_size_class
+def von_neumann_entropy(states, qubits = None, base = 2, chunk_size = None):
+    '''
+    Compute the von Neumann entropy -tr(rho log rho) of every system (or reduced system) in a stream
+
+    :param QStream|RaggedQStream|np.array states: the stream, or an array of state vectors or density matrices
+    :param [int] qubits: if specified, compute the entropy of the reduced state of these qubits (the entanglement
+                         entropy, for pure states)
+    :param float base: the base of the logarithm; default: 2 (entropy in bits)
+    :param int chunk_size: number of systems to process at once; bounds the temporary memory used
+    :return: a num_systems array of entropies
+    '''
+    array = _state_array(states)
+    result = np.empty(array.shape[0])
+    for window, rho in _reduced_chunks(array, qubits, chunk_size):
+        eigenvalues = np.clip(np.linalg.eigvalsh(rho), 0, None)
+        logs = np.log(np.where(eigenvalues > 0, eigenvalues, 1.0)) / np.log(base)
+        result[window] = -np.sum(eigenvalues * logs, axis = 1)
+    return result
+
+
+@_per_size_class
+def concurrence(states, qubits = None, chunk_size = None):
+    '''
+    Compute the Wootters concurrence of every two-qubit system (or two-qubit reduced system) in a stream
+
+    :param QStream|RaggedQStream|np.array states: the stream, or an array of state vectors or density matrices
+    :param [int] qubits: the two qubit indices to compute the concurrence between; required if systems have more
+                         than two qubits
+    :param int chunk_size: number of systems to process at once; bounds the temporary memory used
+    :return: a num_systems array of concurrences
+    '''
+    array = _state_array(states)
+    result = np.empty(array.shape[0])
+    if qubits is None and array.ndim == 2:
+        # Pure two-qubit states: C = |<psi|Y x Y|psi*>|
+        for window, psi in _chunks(array, chunk_size):
+            result[window] = np.abs(np.einsum("ai,ij,aj->a", psi.conj(), _YY, psi.conj()))
+        return result
+    for window, rho in _reduced_chunks(array, qubits, chunk_size):
+        spin_flipped = np.matmul(np.matmul(_YY, rho.conj()), _YY)
+        eigenvalues = np.linalg.eigvals(np.matmul(rho, spin_flipped))
+        roots = np.sort(np.sqrt(np.clip(eigenvalues.real, 0, None)), axis = 1)[:, ::-1]
+        result[window] = np.clip(roots[:, 0] - roots[:, 1] - roots[:, 2] - roots[:, 3], 0, None)
+    return result
@@ -3,8 +3,9 @@ import sys
 
 from squanch import errors
 from squanch.qubit import Qubit
+from squanch.transport import SocketQueue
 
-__all__ = ["QChannel", "CChannel", "FiberOpticQChannel"]
+__all__ = ["QChannel", "CChannel", "FiberOpticQChannel", "SocketQChannel", "SocketCChannel"]
 
 
 class QChannel:
@@ -12,7 +13,7 @@ class QChannel:
     Base class for a quantum channel connecting two agents
     '''
 
-    def __init__(self, from_agent, to_agent, length = 0.0, errors = ()):
+    def __init__(self, from_agent, to_agent, length = 0.0, errors = (), queue = None):
         '''
         Instantiate the quantum channel
 
@@ -20,6 +21,7 @@ class QChannel:
         :param Agent to_agent: receiving agent
         :param float length: length of quantum channel in km; default: 0.0km
         :param QError[] errors: list of error models to apply to qubits in this channel; default: [] (no errors)
+        :param queue: transport with ``put()`` and ``get()`` methods; default: a new ``multiprocessing.Queue``
         '''
         # Register agent connections
         self.from_agent = from_agent
@@ -30,11 +32,14 @@ class QChannel:
         self.signal_speed = 2.998 * 10 ** 5  # Speed of light in km/s
 
         # A queue representing the qubits in transit along the channel
-        self.queue = multiprocessing.Queue()
+        self.queue = queue if queue is not None else multiprocessing.Queue()
 
         # Register error models
         self.errors = errors
 
+        # Random stream for the errors, applied by the receiving agent; assigned by Simulation(..., seed = seed)
+        self.rng = None
+
     def put(self, qubit):
         '''
         Serialize and push qubit into the channel queue
@@ -74,13 +79,14 @@ class CChannel:
     Base class for a classical channel connecting two agents
     '''
 
-    def __init__(self, from_agent, to_agent, length = 0.0):
+    def __init__(self, from_agent, to_agent, length = 0.0, queue = None):
         '''
-        Instantiate the quantum channel
+        Instantiate the classical channel
 
         :param Agent from_agent: sending agent
         :param Agent to_agent: receiving agent
         :param float length: length of fiber optic line in km; default: 0.0km
+        :param queue: transport with ``put()`` and ``get()`` methods; default: a new ``multiprocessing.Queue``
         '''
         # Register agent connections
         self.from_agent = from_agent
@@ -91,7 +97,7 @@ class CChannel:
         self.signal_speed = 2.998 * 10 ** 5  # Speed of light in km/s
 
         # The channel queue
-        self.queue = multiprocessing.Queue()
+        self.queue = queue if queue is not None else multiprocessing.Queue()
 
     def put(self, thing):
         '''
@@ -119,15 +125,16 @@ class FiberOpticQChannel(QChannel):
     Represents a fiber optic line with attenuation errors
     '''
 
-    def __init__(self, from_agent, to_agent, length = 0.0):
+    def __init__(self, from_agent, to_agent, length = 0.0, queue = None):
         '''
         Instantiate the simulated fiber optic quantum channel
 
         :param Agent from_agent: sending agent
         :param Agent to_agent: receiving agent
         :param float length: length of fiber optic channel in km; default: 0.0km
+        :param queue: transport with ``put()`` and ``get()`` methods; default: a new ``multiprocessing.Queue``
         '''
-        QChannel.__init__(self, from_agent, to_agent, length = length)
+        QChannel.__init__(self, from_agent, to_agent, length = length, queue = queue)
 
         # Register attenuation errors
         self.errors = [
@@ -135,3 +142,120 @@ class FiberOpticQChannel(QChannel):
             # errors.RandomUnitaryError(self, 2*np.pi / 100),
             # errors.SystematicUnitaryError(self, 2*np.pi / 10),
         ]
+
+
+def _socket_queue(from_agent, to_agent, address, batch_size, local_agents):
+    '''
+    Create the socket queue for a one-directional socket channel, listening on it if the receiver runs on this host
+
+    :param Agent from_agent: sending agent
+    :param Agent to_agent: receiving agent
+    :param str|tuple|callable address: the address, or a function mapping (from_agent, to_agent) to the address
+    :param int batch_size: number of messages to buffer per socket frame
+    :param set local_agents: names of the agents running on this host, or None if all agents are local
+    :return: the socket queue
+    '''
+    if callable(address):
+        address = address(from_agent, to_agent)
+    queue = SocketQueue(address, batch_size = batch_size)
+    if local_agents is None or to_agent.name in local_agents:
+        queue.listen()
+    return queue
+
+
+class SocketQChannel(QChannel):
+    '''
+    A quantum channel carried over a TCP or Unix domain socket, for agents running in different processes or on
+    different hosts. This spreads the agents' work across hosts, not the stream: every host allocates the whole
+    ``QStream``, and each qubit is sent as its own message along with the state of its whole system, which is written
+    into the receiver's copy of the stream on arrival. Ownership of a system therefore moves with its qubits: after
+    sending, further operations on that system should happen on the receiving host. Streams too large for one host,
+    or protocols sending many qubits per second, are better served by agents sharing a stream on one host.
+    '''
+
+    def __init__(self, from_agent, to_agent, address, length = 0.0, errors = (), batch_size = 1, local_agents = None):
+        '''
+        Instantiate the socket quantum channel
+
+        :param Agent from_agent: sending agent
+        :param Agent to_agent: receiving agent
+        :param str|tuple|callable address: a Unix socket path or a (host, port) tuple on the receiving agent's host,
+                                           or a function mapping (from_agent, to_agent) to one, so that both
+                                           directions of a link made with ``Agent.qconnect()`` get distinct addresses
+        :param float length: length of quantum channel in km; default: 0.0km
+        :param QError[] errors: list of error models to apply to qubits in this channel; default: [] (no errors)
+        :param int batch_size: number of qubits to buffer per socket frame; see ``SocketQueue``
+        :param set local_agents: names of the agents running on this host; default: all agents. If the receiving agent
+                                 is local, the address is bound immediately so that forked agent processes inherit
+                                 the listening socket.
+        '''
+        queue = _socket_queue(from_agent, to_agent, address, batch_size, local_agents)
+        QChannel.__init__(self, from_agent, to_agent, length = length, errors = errors, queue = queue)
+
+    def put(self, qubit):
+        '''
+        Serialize a qubit together with its system state slice and push it into the socket
+
+        :param Qubit qubit: the qubit to send
+        '''
+        time_of_arrival = self.from_agent.time + self.from_agent.pulse_length + (self.length / self.signal_speed)
+        if qubit is not None:
+            self.queue.put((qubit.serialize(), qubit.qsystem.state.copy(), time_of_arrival))
+        else:
+            self.queue.put((None, None, time_of_arrival))
+
+    def get(self):
+        '''
+        Retrieve a qubit from the socket, writing its system state into the receiver's stream and applying errors
+
+        :return: tuple: (the qubit with errors applied (possibly ``None``), receival time)
+        '''
+        indices, state, receive_time = self.queue.get()
+        if indices is not None:
+            system_index, qubit_index = indices
+            self.to_agent.qstream.state[system_index] = state
+            qubit = Qubit.from_stream(self.to_agent.qstream, system_index, qubit_index)
+        else:
+            qubit = None
+
+        for error in self.errors:
+            qubit = error.apply(qubit)
+
+        return qubit, receive_time
+
+    def flush(self):
+        '''
+        Send any qubits buffered in the socket queue
+        '''
+        self.queue.flush()
+
+
+class SocketCChannel(CChannel):
+    '''
+    A classical channel carried over a TCP or Unix domain socket, for agents running in different processes or on
+    different hosts
+    '''
+
+    def __init__(self, from_agent, to_agent, address, length = 0.0, batch_size = 1, local_agents = None):
+        '''
+        Instantiate the socket classical channel
+
+        :param Agent from_agent: sending agent
+        :param Agent to_agent: receiving agent
+        :param str|tuple|callable address: a Unix socket path or a (host, port) tuple on the receiving agent's host,
+                                           or a function mapping (from_agent, to_agent) to one, so that both
+                                           directions of a link made with ``Agent.qconnect()`` get distinct addresses
+        :param float length: length of fiber optic line in km; default: 0.0km
+        :param int batch_size: number of messages to buffer per socket frame; see ``SocketQueue``
+        :param set local_agents: names of the agents running on this host; default: all agents. If the receiving agent
+                                 is local, the address is bound immediately so that forked agent processes inherit
+                                 the listening socket.
+        '''
+        queue = _socket_queue(from_agent, to_agent, address, batch_size, local_agents)
+        CChannel.__init__(self, from_agent, to_agent, length = length, queue = queue)
+
+    def flush(self):
+        '''
+        Send any messages buffered in the socket queue
+        '''
+        self.queue.flush()
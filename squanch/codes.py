@@ -0,0 +1,389 @@
+import itertools
+
+import numpy as np
+
+from squanch import linalg, rng
+from squanch.analysis import CHUNK_BYTES, _state_array
+from squanch.mps import MPSQStream
+
+__all__ = ["StabilizerCode", "BitFlipCode", "PhaseFlipCode", "ShorCode", "SteaneCode"]
+
+# Single-qubit Pauli matrices, indexed by their symplectic (x, z) bits
+_PAULI_MATRICES = {(0, 0): np.eye(2), (1, 0): np.array([[0, 1], [1, 0]]),
+                   (1, 1): np.array([[0, -1j], [1j, 0]]), (0, 1): np.diag([1, -1])}
+
+
+def _symplectic(pauli):
+    '''
+    Convert a Pauli string such as "XZZXI" to its symplectic representation
+
+    :param str pauli: the Pauli string, one character per qubit
+    :return: tuple of (x bits, z bits) as uint8 arrays
+    '''
+    x = np.array([c in "XY" for c in pauli], dtype = np.uint8)
+    z = np.array([c in "ZY" for c in pauli], dtype = np.uint8)
+    return x, z
+
+
+def _apply_pauli(flat, x, z, axes, transpose = False):
+    '''
+    Apply a Pauli operator, qubit by qubit, to a batch of states flattened to vectors. A density matrix flattened
+    to a vector over its row and column qubits is multiplied from the right by acting with the transposed Pauli on
+    its column qubits.
+
+    :param np.array flat: a batch x 2^N array
+    :param np.array x: the x bits of the Pauli operator, one per axis
+    :param np.array z: the z bits of the Pauli operator, one per axis
+    :param [int] axes: the qubits (of the N) that each bit acts on
+    :param bool transpose: whether to apply the transpose of the Pauli operator
+    :return: the new batch x 2^N array
+    '''
+    for xi, zi, axis in zip(x, z, axes):
+        if xi or zi:
+            matrix = _PAULI_MATRICES[(xi, zi)]
+            flat = linalg.apply_operator(flat, matrix.T if transpose else matrix, [axis], False)
+    return flat
+
+
+class StabilizerCode:
+    '''
+    A single-logical-qubit stabilizer code, with encoding, syndrome extraction, correction and decoding that act on
+    many systems of a ``QStream`` at once. Corrections come from a lookup table indexed by the integer value of the
+    syndrome, so decoding a batch of syndromes is a single array indexing operation.
+
+    Encoding maps a data qubit (the first code qubit) and n-1 ancillas in |0> to the logical state, and decoding is
+    its inverse. The encoder is built from the stabilizers as |b>|s> -> E_s|b_L>, where E_s is the correction for
+    syndrome s, so decoding an uncorrected codeword also leaves the syndrome in the ancillas.
+
+    Codes act on dense state arrays, including packed streams and each size class of a ``RaggedQStream``; MPS streams
+    are not supported.
+    '''
+
+    def __init__(self, stabilizers, logical_x, logical_z):
+        '''
+        Instantiate the code from its stabilizer generators and logical operators
+
+        :param [str] stabilizers: the n-1 independent stabilizer generators, as Pauli strings like "ZZI"
+        :param str logical_x: the logical X operator, as a Pauli string
+        :param str logical_z: the logical Z operator, as a Pauli string
+        '''
+        self.stabilizers = list(stabilizers)
+        self.logical_x = logical_x
+        self.logical_z = logical_z
+        self.num_qubits = len(logical_x)
+        self.num_stabilizers = len(self.stabilizers)
+        symplectic = [_symplectic(s) for s in self.stabilizers]
+        self._stabilizer_x = np.array([x for x, _ in symplectic])
+        self._stabilizer_z = np.array([z for _, z in symplectic])
+        self._powers = 2 ** np.arange(self.num_stabilizers - 1, -1, -1)
+        self._correction_x, self._correction_z = self._lookup_table()
+        self._encoder = None
+
+    def syndromes_of(self, x, z):
+        '''
+        Compute the syndromes of Pauli errors from their symplectic representation
+
+        :param np.array x: a batch x n array of the x bits of the errors
+        :param np.array z: a batch x n array of the z bits of the errors
+        :return: a batch x (n-1) uint8 array of syndrome bits; bit j is 1 if the error anticommutes with stabilizer j
+        '''
+        return ((np.dot(x, self._stabilizer_z.T) + np.dot(z, self._stabilizer_x.T)) % 2).astype(np.uint8)
+
+    def lookup(self, syndromes):
+        '''
+        Look up the corrections for a batch of syndromes
+
+        :param np.array syndromes: a batch x (n-1) array of syndrome bits
+        :return: tuple of batch x n arrays (x bits, z bits) of the correcting Pauli operators
+        '''
+        index = np.dot(syndromes, self._powers)
+        return self._correction_x[index], self._correction_z[index]
+
+    def _lookup_table(self):
+        '''
+        Build the decoder table, assigning each syndrome a lowest-weight Pauli error producing it. Errors on the same
+        number of qubits are tried in order of symplectic weight (X and Z before Y), so a syndrome shared by a Z and
+        a Y error (such as a phase flip in the phase-flip code, where the extra X is a logical operator) is assigned
+        the Z correction.
+
+        :return: tuple of 2^(n-1) x n arrays (x bits, z bits) of corrections, indexed by syndrome value
+        '''
+        n = self.num_qubits
+        size = 2 ** self.num_stabilizers
+        table_x = np.zeros((size, n), dtype = np.uint8)
+        table_z = np.zeros((size, n), dtype = np.uint8)
+        found = np.zeros(size, dtype = bool)
+        found[0] = True
+        for weight in range(1, n + 1):
+            candidates = []
+            for support in itertools.combinations(range(n), weight):
+                for paulis in itertools.product(((1, 0), (0, 1), (1, 1)), repeat = weight):
+                    x = np.zeros(n, dtype = np.uint8)
+                    z = np.zeros(n, dtype = np.uint8)
+                    x[list(support)], z[list(support)] = zip(*paulis)
+                    candidates.append((x, z))
+            for x, z in sorted(candidates, key = lambda error: int(np.sum(error[0]) + np.sum(error[1]))):
+                index = int(np.dot(self.syndromes_of(x, z), self._powers))
+                if not found[index]:
+                    found[index] = True
+                    table_x[index], table_z[index] = x, z
+            if np.all(found):
+                break
+        return table_x, table_z
+
+    @property
+    def encoder(self):
+        '''
+        The 2^n x 2^n encoding unitary, acting on the data qubit followed by n-1 ancillas. Built on first use.
+        '''
+        if self._encoder is None:
+            self._encoder = self._build_encoder()
+        return self._encoder
+
+    def _build_encoder(self):
+        '''Construct the encoding unitary from the code space and the lookup table'''
+        n, dim = self.num_qubits, 2 ** self.num_qubits
+        axes = list(range(n))
+        # Project a computational basis state onto the +1 eigenspace of the stabilizers and logical Z to get |0_L>
+        generators = [_symplectic(s) for s in self.stabilizers] + [_symplectic(self.logical_z)]
+        for start in range(dim):
+            zero = np.zeros((1, dim), dtype = np.complex128)
+            zero[0, start] = 1
+            for x, z in generators:
+                zero = (zero + _apply_pauli(zero, x, z, axes)) / 2
+            if np.linalg.norm(zero) > 1e-6:
+                break
+        zero /= np.linalg.norm(zero)
+        one = _apply_pauli(zero, *_symplectic(self.logical_x), axes)
+        encoder = np.zeros((dim, dim), dtype = np.complex128)
+        num_syndromes = 2 ** self.num_stabilizers
+        for syndrome in range(num_syndromes):
+            x, z = self._correction_x[syndrome], self._correction_z[syndrome]
+            encoder[:, syndrome] = _apply_pauli(zero, x, z, axes)[0]
+            encoder[:, num_syndromes + syndrome] = _apply_pauli(one, x, z, axes)[0]
+        return encoder
+
+    @staticmethod
+    def _targets(states, systems, qubits):
+        '''
+        Resolve the selected systems of a stream to the state arrays holding them: the stream's own array, or one
+        array per size class of a ``RaggedQStream``. Packed streams work through their ``HermitianPackedArray``.
+
+        :param QStream|RaggedQStream|np.array states: the stream or state array
+        :param slice|np.array systems: the systems to act on; default: all
+        :param [int] qubits: the code qubits, which every selected system must have
+        :return: tuples of (state array, indices of the selected systems in it, their positions in the selection)
+        '''
+        if isinstance(states, MPSQStream):
+            raise TypeError("Stabilizer codes act on dense states; MPS streams are not supported")
+        classes = getattr(states, "classes", None)
+        if classes is None:
+            array = _state_array(states)
+            selected = np.arange(array.shape[0])[slice(None) if systems is None else systems]
+            yield array, selected, np.arange(len(selected))
+            return
+        selected = np.arange(states.num_systems)[slice(None) if systems is None else systems]
+        sizes = states.system_sizes[selected]
+        for size, stream in classes.items():
+            members = np.flatnonzero(sizes == size)
+            if len(members) == 0:
+                continue
+            if size <= max(qubits):
+                raise ValueError("Selected systems of size " + str(size) + " have no qubit " + str(max(qubits)))
+            yield stream.state, states.positions[selected[members]], members
+
+    @staticmethod
+    def _chunks(array, selected, chunk_size):
+        '''
+        Split the selected systems of a state array into chunks
+
+        :param np.array array: the state array
+        :param np.array selected: the indices of the selected systems in the array
+        :param int chunk_size: the number of systems per chunk; if None, picked to keep the working set near
+                               ``analysis.CHUNK_BYTES``
+        :return: the system indices of each chunk
+        '''
+        if chunk_size is None:
+            chunk_size = max(1, CHUNK_BYTES // (16 * int(np.prod(array.shape[1:])) * 4))
+        for start in range(0, len(selected), chunk_size):
+            yield selected[start:start + chunk_size]
+
+    def _qubits(self, qubits):
+        '''The code qubits within each system, in code order'''
+        return list(range(self.num_qubits)) if qubits is None else list(qubits)
+
+    def encode(self, states, qubits = None, systems = None, chunk_size = None):
+        '''
+        Encode the state of the first code qubit of each selected system into the code, using the other code qubits
+        (which should be in |0>) as ancillas
+
+        :param QStream|RaggedQStream|np.array states: the stream, or an array of state vectors or density matrices
+        :param [int] qubits: the n qubits of each system making up the code block; default: the first n
+        :param slice|np.array systems: the systems to encode; default: all
+        :param int chunk_size: number of systems to process at once
+        '''
+        qubits = self._qubits(qubits)
+        for array, selected, _ in self._targets(states, systems, qubits):
+            for index in self._chunks(array, selected, chunk_size):
+                array[index] = linalg.apply_operator(array[index], self.encoder, qubits, array.ndim == 3)
+
+    def decode(self, states, qubits = None, systems = None, chunk_size = None):
+        '''
+        Decode the selected systems, returning the logical state to the first code qubit. Codewords with no
+        uncorrected error leave the ancillas in |0>.
+
+        :param QStream|RaggedQStream|np.array states: the stream, or an array of state vectors or density matrices
+        :param [int] qubits: the n qubits of each system making up the code block; default: the first n
+        :param slice|np.array systems: the systems to decode; default: all
+        :param int chunk_size: number of systems to process at once
+        '''
+        qubits = self._qubits(qubits)
+        decoder = self.encoder.conj().T
+        for array, selected, _ in self._targets(states, systems, qubits):
+            for index in self._chunks(array, selected, chunk_size):
+                array[index] = linalg.apply_operator(array[index], decoder, qubits, array.ndim == 3)
+
+    def syndrome(self, states, qubits = None, systems = None, chunk_size = None):
+        '''
+        Measure the stabilizer generators on each selected system, projecting the states onto the observed syndrome
+        spaces (this discretizes arbitrary errors into Pauli errors)
+
+        :param QStream|RaggedQStream|np.array states: the stream, or an array of state vectors or density matrices
+        :param [int] qubits: the n qubits of each system making up the code block; default: the first n
+        :param slice|np.array systems: the systems to measure; default: all
+        :param int chunk_size: number of systems to process at once
+        :return: a num_selected x (n-1) uint8 array of syndrome bits
+        '''
+        qubits = self._qubits(qubits)
+        targets = list(self._targets(states, systems, qubits))
+        results = np.empty((sum(len(selected) for _, selected, _ in targets), self.num_stabilizers), dtype = np.uint8)
+        for array, selected, order in targets:
+            bits = [self._measure_stabilizers(array, index, qubits)
+                    for index in self._chunks(array, selected, chunk_size)]
+            if bits:
+                results[order] = np.concatenate(bits)
+        return results
+
+    def _measure_stabilizers(self, array, index, qubits):
+        '''
+        Measure the stabilizer generators on a chunk of systems of a state array, projecting the states in place
+
+        :param np.array array: the state array
+        :param np.array index: the indices of the systems in the chunk
+        :param [int] qubits: the code qubits
+        :return: a len(index) x (n-1) uint8 array of syndrome bits
+        '''
+        chunk = np.asarray(array[index], dtype = np.complex128)
+        is_density = array.ndim == 3
+        num_qubits = int(np.log2(array.shape[1]))
+        flat = chunk.reshape((len(index), -1))
+        bits = np.empty((len(index), self.num_stabilizers), dtype = np.uint8)
+        for j in range(self.num_stabilizers):
+            x, z = self._stabilizer_x[j], self._stabilizer_z[j]
+            # g|psi>, or g rho with the density matrix treated as a vector over row and column qubits
+            applied = _apply_pauli(flat, x, z, qubits)
+            if is_density:
+                expectation = np.real(np.einsum("aii->a", applied.reshape(chunk.shape)))
+            else:
+                expectation = np.real(np.sum(flat.conj() * applied, axis = 1))
+            probability_one = np.clip((1 - expectation) / 2, 0, 1)
+            outcome = rng.current_stream().random(len(index)) < probability_one
+            sign = np.where(outcome, -1.0, 1.0)[:, np.newaxis]
+            probability = np.where(outcome, probability_one, 1 - probability_one)[:, np.newaxis]
+            if is_density:
+                # P rho P = (rho + s g rho + s rho g + g rho g) / 4, with rho g applied to the column qubits
+                columns = [num_qubits + q for q in qubits]
+                right = _apply_pauli(flat, x, z, columns, transpose = True)
+                both = _apply_pauli(applied, x, z, columns, transpose = True)
+                flat = (flat + sign * (applied + right) + both) / (4 * probability)
+            else:
+                flat = (flat + sign * applied) / (2 * np.sqrt(probability))
+            bits[:, j] = outcome
+        array[index] = flat.reshape(chunk.shape)
+        return bits
+
+    def correct(self, states, syndromes, qubits = None, systems = None, chunk_size = None):
+        '''
+        Apply the lookup-table correction for each selected system's syndrome. Systems are grouped by correction,
+        so each distinct correction is applied once to all of the systems that need it.
+
+        :param QStream|RaggedQStream|np.array states: the stream, or an array of state vectors or density matrices
+        :param np.array syndromes: a num_selected x (n-1) array of syndrome bits, as returned by ``syndrome()``
+        :param [int] qubits: the n qubits of each system making up the code block; default: the first n
+        :param slice|np.array systems: the systems to correct; default: all
+        :param int chunk_size: number of systems to process at once
+        '''
+        qubits = self._qubits(qubits)
+        syndromes = np.asarray(syndromes)
+        for array, selected, order in self._targets(states, systems, qubits):
+            values = np.dot(syndromes[order], self._powers)
+            num_qubits = int(np.log2(array.shape[1]))
+            for value in np.unique(values):
+                if value == 0:
+                    continue
+                x, z = self._correction_x[value], self._correction_z[value]
+                for index in self._chunks(array, selected[values == value], chunk_size):
+                    chunk = array[index]
+                    flat = _apply_pauli(chunk.reshape((len(index), -1)), x, z, qubits)
+                    if array.ndim == 3:
+                        # C rho C^dagger, with C^dagger = C for Pauli corrections
+                        flat = _apply_pauli(flat, x, z, [num_qubits + q for q in qubits], transpose = True)
+                    array[index] = flat.reshape(chunk.shape)
+
+    def logical_error_rate(self, error_rate, trials, chunk_size = 2 ** 20):
+        '''
+        Estimate the logical error rate of the lookup-table decoder under independent single-qubit depolarizing
+        noise, by sampling Pauli errors directly in the symplectic representation. No states are simulated, so
+        millions of trials take seconds.
+
+        :param float error_rate: the probability that each physical qubit suffers an X, Y or Z error (equally likely)
+        :param int trials: the number of codewords to sample
+        :param int chunk_size: the number of trials to sample at once
+        :return: the fraction of trials ending in a logical error
+        '''
+        logical_x, logical_z = _symplectic(self.logical_x), _symplectic(self.logical_z)
+        failures = 0
+        for start in range(0, trials, chunk_size):
+            count = min(chunk_size, trials - start)
+            draws = rng.current_stream().random((count, self.num_qubits))
+            kind = np.floor(3 * draws / error_rate).astype(np.int64) if error_rate > 0 else np.full(draws.shape, 3)
+            x = ((kind == 0) | (kind == 1)).astype(np.uint8)
+            z = ((kind == 1) | (kind == 2)).astype(np.uint8)
+            correction_x, correction_z = self.lookup(self.syndromes_of(x, z))
+            residual_x, residual_z = x ^ correction_x, z ^ correction_z
+            # The residual is a stabilizer (no error) unless it anticommutes with a logical operator
+            flips_z = (np.dot(residual_x, logical_z[1]) + np.dot(residual_z, logical_z[0])) % 2
+            flips_x = (np.dot(residual_x, logical_x[1]) + np.dot(residual_z, logical_x[0])) % 2
+            failures += int(np.count_nonzero(flips_z | flips_x))
+        return failures / trials
+
+
+class BitFlipCode(StabilizerCode):
+    '''The three-qubit bit-flip repetition code, correcting a single X error'''
+
+    def __init__(self):
+        StabilizerCode.__init__(self, ["ZZI", "IZZ"], logical_x = "XXX", logical_z = "ZII")
+
+
+class PhaseFlipCode(StabilizerCode):
+    '''The three-qubit phase-flip repetition code, correcting a single Z error'''
+
+    def __init__(self):
+        StabilizerCode.__init__(self, ["XXI", "IXX"], logical_x = "ZZZ", logical_z = "XII")
+
+
+class ShorCode(StabilizerCode):
+    '''Shor's nine-qubit code, correcting an arbitrary single-qubit error'''
+
+    def __init__(self):
+        stabilizers = ["ZZIIIIIII", "IZZIIIIII", "IIIZZIIII", "IIIIZZIII", "IIIIIIZZI", "IIIIIIIZZ",
+                       "XXXXXXIII", "IIIXXXXXX"]
+        StabilizerCode.__init__(self, stabilizers, logical_x = "ZZZZZZZZZ", logical_z = "XXXXXXXXX")
+
+
+class SteaneCode(StabilizerCode):
+    '''Steane's seven-qubit CSS code, correcting an arbitrary single-qubit error'''
+
+    def __init__(self):
+        stabilizers = ["IIIXXXX", "IXXIIXX", "XIXIXIX", "IIIZZZZ", "IZZIIZZ", "ZIZIZIZ"]
+        StabilizerCode.__init__(self, stabilizers, logical_x = "XXXXXXX", logical_z = "ZZZZZZZ")
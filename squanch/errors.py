@@ -1,6 +1,6 @@
 import numpy as np
 
-from squanch import gates
+from squanch import gates, rng
 
 __all__ = ["QError", "AttenuationError", "RandomUnitaryError", "SystematicUnitaryError"]
 
@@ -16,6 +16,16 @@ class QError:
         '''
         self.qchannel = qchannel
 
+    @property
+    def rng(self):
+        '''
+        The random stream of the channel, or of the running process if the channel has none
+
+        :return: the ``RandomStream``
+        '''
+        stream = self.qchannel.rng
+        return stream if stream is not None else rng.current_stream()
+
     def apply(self, qubit):
         '''
         Applies the error to the transmitted qubit. Overwrite this method in child classes while maintaining the
@@ -51,7 +61,7 @@ class AttenuationError(QError):
         :param Qubit qubit: qubit from quantum channel
         :return: either unchanged qubit or None
         '''
-        if np.random.rand() > self.attenuation and qubit is not None:
+        if self.rng.rand() > self.attenuation and qubit is not None:
             # Photon was lost due to attenuation effects; collapse state and return nothing
             qubit.measure()
             qubit = None
@@ -79,7 +89,7 @@ class RandomUnitaryError(QError):
         :return: rotated qubit
         '''
         if qubit is not None:
-            x_angle, z_angle = np.random.normal(0, self.variance, 2)
+            x_angle, z_angle = self.rng.normal(0, self.variance, 2)
             gates.RX(qubit, x_angle)
             gates.RZ(qubit, z_angle)
         return qubit
@@ -103,7 +113,7 @@ class SystematicUnitaryError(QError):
         if operator is not None:
             self.operator = operator
         elif variance is not None:
-            x_angle, z_angle = np.random.normal(0, variance, 2)
+            x_angle, z_angle = self.rng.normal(0, variance, 2)
             Rx = np.cos(x_angle / 2.0) * gates._I - 1j * np.sin(x_angle / 2.0) * gates._X
             Rz = np.cos(z_angle / 2.0) * gates._I - 1j * np.sin(z_angle / 2.0) * gates._Z
             self.operator = np.dot(Rz, Rx)
@@ -116,5 +126,5 @@ class SystematicUnitaryError(QError):
         :return: rotated qubit
         '''
         if qubit is not None:
-            qubit.qsystem.apply(self.operator)
+            qubit.apply(self.operator)
         return qubit
@@ -0,0 +1,229 @@
+import numpy as np
+
+from squanch import linalg, rng
+from squanch.qubit import Qubit
+
+__all__ = ["FactoredQSystem"]
+
+# Tolerance below which a control qubit is treated as being deterministically in |0> or |1>
+_TOLERANCE = 1e-12
+
+
+class _Block:
+    '''
+    An independent factor of a ``FactoredQSystem``: a dense state over an ordered subset of the system's qubits
+    '''
+
+    __slots__ = ("qubits", "state")
+
+    def __init__(self, qubits, state):
+        self.qubits = qubits
+        self.state = state
+
+
+class FactoredQSystem:
+    '''
+    Represents a multi-qubit quantum system as a tensor product of independent blocks, starting from one block per
+    qubit. Blocks are merged only when a multi-qubit gate links them and measured qubits are split back into their
+    own blocks, so memory and gate costs follow the actual entanglement structure rather than 2^num_qubits.
+
+    ``FactoredQSystem`` mirrors the ``QSystem`` interface used by ``Qubit`` and ``squanch.gates``, so the same gate
+    calls work on it. It is not backed by a ``QStream``, so it is only visible to the process that created it; the
+    dense ``state`` property can be copied into a stream slot when needed.
+    '''
+
+    __slots__ = ("num_qubits", "index", "use_density_matrix", "_block_of", "__weakref__")
+
+    def __init__(self, num_qubits, index = None, use_density_matrix = True):
+        '''
+        Instantiate the factored system in the product state |000...0>
+
+        :param int num_qubits: number of qubits in the system
+        :param int index: optional index of the system, used when serializing its qubits
+        :param bool use_density_matrix: whether blocks are stored as density matrices or state vectors
+        '''
+        self.num_qubits = num_qubits
+        self.index = index
+        self.use_density_matrix = use_density_matrix
+        zero = np.array([1, 0], dtype = np.complex64)
+        initial = np.outer(zero, zero) if use_density_matrix else zero
+        self._block_of = [_Block([i], initial.copy()) for i in range(num_qubits)]
+
+    @property
+    def blocks(self):
+        '''
+        The distinct blocks of the system, ordered by their lowest qubit index
+
+        :return: a list of (qubit indices, block state) tuples
+        '''
+        seen, blocks = set(), []
+        for block in self._block_of:
+            if id(block) not in seen:
+                seen.add(id(block))
+                blocks.append((tuple(block.qubits), block.state))
+        return blocks
+
+    @property
+    def state(self):
+        '''
+        The dense state of the whole system, built by tensoring the blocks together in qubit order. This allocates
+        the full 2^n (or 4^n) representation and is intended for inspection and analysis.
+
+        :return: the state vector or density matrix of the system
+        '''
+        order, state = [], np.array([], dtype = np.complex64)
+        for qubits, block_state in self.blocks:
+            order.extend(qubits)
+            state = linalg.tensor_product(state, block_state)
+        permutation = list(np.argsort(order))
+        dim = 2 ** self.num_qubits
+        if self.use_density_matrix:
+            tensor = state.reshape((2,) * (2 * self.num_qubits))
+            tensor = tensor.transpose(permutation + [self.num_qubits + i for i in permutation])
+            return tensor.reshape((dim, dim))
+        return state.reshape((2,) * self.num_qubits).transpose(permutation).reshape(dim)
+
+    @property
+    def qubits(self):
+        '''
+        A generator over the constituent qubits of this system
+
+        :return: a generator of ``Qubit`` instances, one per qubit index
+        '''
+        return (Qubit(self, i) for i in range(self.num_qubits))
+
+    def qubit(self, index):
+        '''
+        Access a qubit by index
+
+        :param int index: qubit index to generate a qubit instance for
+        :return: the qubit instance
+        '''
+        return Qubit(self, index)
+
+    def _merge(self, qubit_indices):
+        '''
+        Merge the blocks containing the given qubits into a single block
+
+        :param [int] qubit_indices: the qubits which must share a block
+        :return: the merged block
+        '''
+        blocks = []
+        for i in qubit_indices:
+            if not any(block is self._block_of[i] for block in blocks):
+                blocks.append(self._block_of[i])
+        if len(blocks) == 1:
+            return blocks[0]
+        qubits, state = [], np.array([], dtype = np.complex64)
+        for block in blocks:
+            qubits.extend(block.qubits)
+            state = linalg.tensor_product(state, block.state)
+        merged = _Block(qubits, state)
+        for i in qubits:
+            self._block_of[i] = merged
+        return merged
+
+    def _probability_one(self, index):
+        '''
+        Compute the probability of measuring a qubit as |1>
+
+        :param int index: the qubit index
+        :return: the probability
+        '''
+        block = self._block_of[index]
+        position = block.qubits.index(index)
+        size = len(block.qubits)
+        if self.use_density_matrix:
+            diagonal = np.real(np.diagonal(block.state))
+        else:
+            diagonal = np.abs(block.state) ** 2
+        return float(np.sum(np.take(diagonal.reshape((2,) * size), 1, axis = position)))
+
+    def apply(self, operator):
+        '''
+        Apply an N-qubit operator to the whole system. This merges every block into one, so prefer the
+        ``apply_local`` and ``apply_controlled`` methods used by ``squanch.gates``.
+
+        :param np.array operator: the unitary N-qubit operator to apply
+        '''
+        self.apply_local(operator, tuple(range(self.num_qubits)))
+
+    def apply_local(self, operator, qubit_indices, cache_id = None):
+        '''
+        Apply a k-qubit operator to a subset of qubits, merging their blocks first if they are not already joined
+
+        :param np.array operator: the 2^k x 2^k operator, acting on the qubits in the order given
+        :param [int] qubit_indices: the k qubit indices to act on
+        :param str cache_id: unused; accepted for compatibility with ``QSystem.apply_local``
+        '''
+        block = self._merge(qubit_indices)
+        positions = [block.qubits.index(i) for i in qubit_indices]
+        block.state = linalg.apply_operator(block.state, operator, positions, self.use_density_matrix)
+
+    def apply_controlled(self, unitary, controls, target, cache_id = None, control_states = None):
+        '''
+        Apply a unitary to one or more target qubits, conditioned on the control qubits being |1> (or the states given
+        by ``control_states``). Controls which are unentangled and deterministically in or out of their required
+        state are resolved without merging blocks.
+
+        :param np.array unitary: the 2^k x 2^k unitary to apply to the targets
+        :param [int] controls: the indices of the control qubits
+        :param int|[int] target: the index of the target qubit, or a list of k target indices
+        :param str cache_id: unused; accepted for compatibility with ``QSystem.apply_controlled``
+        :param [int] control_states: the value (0 or 1) each control must have; default: all 1
+        '''
+        targets = [target] if np.ndim(target) == 0 else list(target)
+        control_states = [1] * len(controls) if control_states is None else list(control_states)
+        active, active_states = [], []
+        for control, value in zip(controls, control_states):
+            if len(self._block_of[control].qubits) == 1:
+                p1 = self._probability_one(control)
+                required = p1 if value == 1 else 1 - p1
+                if required < _TOLERANCE:
+                    return  # control is never in its required state, the gate acts as the identity
+                elif required > 1 - _TOLERANCE:
+                    continue  # control is always in its required state, so it does not need to be linked
+            active.append(control)
+            active_states.append(value)
+        if not active:
+            self.apply_local(unitary, targets)
+            return
+        block = self._merge(active + targets)
+        block.state = np.ascontiguousarray(block.state)
+        linalg.apply_controlled_operator(block.state, unitary, [block.qubits.index(i) for i in active],
+                                         [block.qubits.index(i) for i in targets], self.use_density_matrix,
+                                         active_states)
+
+    def measure_qubit(self, index):
+        '''
+        Measure the qubit at a given index, collapsing its block and splitting the measured qubit off into its own
+        block in the observed computational basis state
+
+        :param int index: the qubit to measure
+        :return: the measured qubit value
+        '''
+        block = self._block_of[index]
+        position = block.qubits.index(index)
+        size = len(block.qubits)
+        p1 = self._probability_one(index)
+        outcome = 0 if rng.current_stream().rand() <= 1.0 - p1 else 1
+        probability = p1 if outcome == 1 else 1.0 - p1
+        # Split off the remaining qubits of the block, conditioned on the outcome
+        rest = [i for i in block.qubits if i != index]
+        if rest:
+            if self.use_density_matrix:
+                tensor = block.state.reshape((2,) * (2 * size))
+                tensor = np.take(np.take(tensor, outcome, axis = size + position), outcome, axis = position)
+                rest_state = tensor.reshape((2 ** (size - 1), 2 ** (size - 1))) / probability
+            else:
+                tensor = np.take(block.state.reshape((2,) * size), outcome, axis = position)
+                rest_state = tensor.reshape(2 ** (size - 1)) / np.sqrt(probability)
+            rest_block = _Block(rest, rest_state.astype(block.state.dtype))
+            for i in rest:
+                self._block_of[i] = rest_block
+        basis_state = np.zeros(2, dtype = np.complex64)
+        basis_state[outcome] = 1
+        if self.use_density_matrix:
+            basis_state = np.outer(basis_state, basis_state)
+        self._block_of[index] = _Block([index], basis_state)
+        return outcome
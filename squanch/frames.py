@@ -0,0 +1,302 @@
+import numpy as np
+
+from squanch import rng
+from squanch.qubit import QSystem, Qubit
+
+__all__ = ["PauliFrameSampler"]
+
+# Clifford single-qubit gates recognized by the sampler, up to a global phase
+_SINGLE_QUBIT_GATES = {
+    "I": np.eye(2),
+    "X": np.array([[0, 1], [1, 0]]),
+    "Y": np.array([[0, -1j], [1j, 0]]),
+    "Z": np.array([[1, 0], [0, -1]]),
+    "H": np.array([[1, 1], [1, -1]]) / np.sqrt(2),
+    "S": np.array([[1, 0], [0, 1j]]),
+    "S_DAG": np.array([[1, 0], [0, -1j]]),
+}
+
+# Clifford two-qubit gates recognized by the sampler when applied with apply_local(), up to a global phase
+_TWO_QUBIT_GATES = {
+    "CNOT": np.array([[1, 0, 0, 0], [0, 1, 0, 0], [0, 0, 0, 1], [0, 0, 1, 0]]),
+    "CZ": np.diag([1, 1, 1, -1]),
+    "SWAP": np.array([[1, 0, 0, 0], [0, 0, 1, 0], [0, 1, 0, 0], [0, 0, 0, 1]]),
+}
+
+
+def _identify(operator, gates):
+    '''
+    Find which of a set of gates an operator equals, up to a global phase
+
+    :param np.array operator: the operator
+    :param dict gates: the candidate gates by name
+    :return: the name of the matching gate, or None
+    '''
+    operator = np.asarray(operator, dtype = np.complex128)
+    for name, gate in gates.items():
+        if gate.shape != operator.shape:
+            continue
+        overlap = np.vdot(gate, operator) / gate.shape[0]
+        if np.isclose(abs(overlap), 1) and np.allclose(operator, overlap * gate):
+            return name
+    return None
+
+
+def _bernoulli_words(stream, shots, p):
+    '''
+    Draw one bit per shot which is set with probability p, packed into uint64 words. Only the set bits are sampled,
+    by drawing the geometric gaps between them, so rare errors cost O(p shots) rather than one random number per shot.
+
+    :param RandomStream stream: the random stream to draw from
+    :param int shots: the number of shots
+    :param float p: the probability of each bit being set
+    :return: tuple of (ceil(shots / 64) uint64 word array, positions of the set bits)
+    '''
+    words = np.zeros((shots + 63) // 64, dtype = np.uint64)
+    positions = np.zeros(0, dtype = np.int64)
+    if p > 0:
+        p = min(p, 1.0)
+        # The set bits are at the running sums of the gaps, drawn in batches until they pass the last shot
+        count = int(shots * p + 4 * np.sqrt(shots * p)) + 16
+        sums = [np.zeros(1, dtype = np.int64)]
+        while sums[-1][-1] < shots:
+            sums.append(sums[-1][-1] + np.cumsum(stream.geometric(p, size = count)))
+        positions = np.concatenate(sums[1:]) - 1
+        positions = positions[positions < shots]
+    np.bitwise_or.at(words, positions >> 6, np.left_shift(np.uint64(1), (positions & 63).astype(np.uint64)))
+    return words, positions
+
+
+def _positions_words(positions, bits, num_words):
+    '''Pack the shots at given positions whose bit is set into uint64 words'''
+    words = np.zeros(num_words, dtype = np.uint64)
+    positions = positions[bits.astype(bool)]
+    np.bitwise_or.at(words, positions >> 6, np.left_shift(np.uint64(1), (positions & 63).astype(np.uint64)))
+    return words
+
+
+class PauliFrameSampler:
+    '''
+    Samples many shots of a Clifford circuit under Pauli noise by Pauli-frame simulation. The circuit is built by
+    calling the usual ``squanch.gates`` functions on the sampler's qubits, which runs it once on a state vector to get
+    a reference measurement record and records the gate sequence. ``sample()`` then propagates random Pauli errors
+    through the recorded gates for all shots at once: each qubit's X and Z error bits are stored packed, 64 shots
+    per uint64 word, and every gate is a few vectorized XOR or swap updates of those bit rows. A shot's measurement
+    outcome is the reference outcome flipped by the X error on the measured qubit.
+
+    Supported gates are the Paulis, H, S (``PHASE(q, pi / 2)``) and its inverse, CNOT, CZ (``CPHASE(c, t, pi)``),
+    CY and SWAP, and measurements in the computational basis. Noise comes from the ``depolarize()``, ``x_error()``
+    and ``z_error()`` methods, and from an optional ``NoiseModel`` whose depolarizing and readout errors are applied
+    after each gate and measurement as in ``QSystem``. Measurements return the reference outcome, so circuits must
+    not branch on them.
+    '''
+
+    def __init__(self, num_qubits, noise_model = None):
+        '''
+        Instantiate the sampler for a circuit on qubits starting in |000...0>
+
+        :param int num_qubits: number of qubits in the circuit
+        :param NoiseModel noise_model: optional noise model; only depolarizing and readout errors are supported
+        '''
+        if noise_model is not None and noise_model.damping > 0:
+            raise ValueError("Amplitude damping is not a Pauli channel and cannot be sampled with Pauli frames")
+        self.num_qubits = num_qubits
+        self.index = None
+        self.use_density_matrix = False
+        self.noise_model = noise_model
+        self.reference = QSystem(num_qubits, use_density_matrix = False)
+        self.operations = []  # recorded (name, qubit indices, parameter) tuples
+        self.reference_outcomes = []  # reference measurement record
+
+    @property
+    def qubits(self):
+        '''
+        A generator over the qubits of the circuit
+
+        :return: a generator of ``Qubit`` instances, one per qubit index
+        '''
+        return (Qubit(self, i) for i in range(self.num_qubits))
+
+    def qubit(self, index):
+        '''
+        Access a qubit by index
+
+        :param int index: qubit index to generate a qubit instance for
+        :return: the qubit instance
+        '''
+        return Qubit(self, index)
+
+    @property
+    def num_measurements(self):
+        '''
+        The number of measurements recorded so far, i.e. the length of each shot's measurement record
+        '''
+        return len(self.reference_outcomes)
+
+    def _record(self, name, qubit_indices, p = 0.0):
+        '''Append an operation to the recorded circuit'''
+        self.operations.append((name, tuple(int(i) for i in qubit_indices), p))
+
+    def _gate_noise(self, qubit_indices):
+        '''Record the noise model's depolarizing channel after a gate on the given qubits'''
+        if self.noise_model is None:
+            return
+        p = self.noise_model.one_qubit if len(qubit_indices) == 1 else self.noise_model.two_qubit
+        if p > 0:
+            self.depolarize(qubit_indices, p)
+
+    def apply(self, operator):
+        '''
+        Full-system operators cannot be recorded; use the gates in ``squanch.gates`` instead
+        '''
+        raise ValueError("PauliFrameSampler only records gates applied with apply_local() or apply_controlled()")
+
+    def apply_local(self, operator, qubit_indices, cache_id = None):
+        '''
+        Record a Clifford gate on one or two qubits and apply it to the reference state
+
+        :param np.array operator: the 2x2 or 4x4 operator
+        :param [int] qubit_indices: the qubits to act on
+        :param str cache_id: unused; accepted for compatibility with ``QSystem.apply_local``
+        '''
+        qubit_indices = list(qubit_indices)
+        gates = _SINGLE_QUBIT_GATES if len(qubit_indices) == 1 else _TWO_QUBIT_GATES
+        name = _identify(operator, gates) if len(qubit_indices) <= 2 else None
+        if name is None:
+            raise ValueError("Only Clifford gates (Paulis, H, S, CNOT, CZ, SWAP) can be sampled with Pauli frames")
+        self.reference.apply_local(operator, qubit_indices)
+        self._record(name, qubit_indices)
+        self._gate_noise(qubit_indices)
+
+    def apply_controlled(self, unitary, controls, target, cache_id = None, control_states = None):
+        '''
+        Record a singly-controlled Pauli gate (CNOT, CY or CZ) and apply it to the reference state. Controls may
+        require |0> instead of |1>, which conjugates the gate by Paulis and so does not change how frames propagate.
+
+        :param np.array unitary: the single-qubit Pauli applied to the target
+        :param [int] controls: the index of the control qubit
+        :param int target: the index of the target qubit
+        :param str cache_id: unused; accepted for compatibility with ``QSystem.apply_controlled``
+        :param [int] control_states: the value (0 or 1) the control must have; default: 1
+        '''
+        name = _identify(unitary, _SINGLE_QUBIT_GATES) if len(controls) == 1 and np.ndim(target) == 0 else None
+        if name not in ("X", "Y", "Z"):
+            raise ValueError("Only CNOT, CY and CZ controlled gates can be sampled with Pauli frames")
+        self.reference.apply_controlled(unitary, controls, target, control_states = control_states)
+        self._record("C" + ("NOT" if name == "X" else name), [controls[0], target])
+        self._gate_noise([controls[0], target])
+
+    def measure_qubit(self, index):
+        '''
+        Record a computational basis measurement, measuring the reference state to extend the reference record
+
+        :param int index: the qubit to measure
+        :return: the reference outcome
+        '''
+        outcome = self.reference.measure_qubit(index)
+        self.reference_outcomes.append(outcome)
+        readout = self.noise_model.readout if self.noise_model is not None else 0.0
+        self._record("M", [index], readout)
+        return outcome
+
+    def depolarize(self, qubit_indices, p):
+        '''
+        Record a depolarizing channel: with probability p, a uniformly random Pauli on the given qubits (including
+        the identity), as in ``NoiseModel``
+
+        :param [int] qubit_indices: the one or two qubits to depolarize
+        :param float p: the depolarizing probability
+        '''
+        assert len(qubit_indices) in (1, 2), "Only one- and two-qubit depolarizing channels are supported"
+        self._record("DEPOLARIZE", qubit_indices, p)
+
+    def x_error(self, index, p):
+        '''
+        Record a bit flip (Pauli X) with probability p
+
+        :param int index: the qubit to act on
+        :param float p: the flip probability
+        '''
+        self._record("X_ERROR", [index], p)
+
+    def z_error(self, index, p):
+        '''
+        Record a phase flip (Pauli Z) with probability p
+
+        :param int index: the qubit to act on
+        :param float p: the flip probability
+        '''
+        self._record("Z_ERROR", [index], p)
+
+    def sample(self, shots, stream = None, packed = False):
+        '''
+        Sample measurement records of the recorded circuit
+
+        :param int shots: the number of shots
+        :param RandomStream stream: the random stream to draw from; default: ``rng.current_stream()``, so a seeded
+                                    ``Simulation`` or ``rng.set_stream()`` makes the samples reproducible
+        :param bool packed: whether to return the records bit-packed along the shot axis, as produced by
+                            ``np.packbits(..., bitorder = "little")``
+        :return: a shots x num_measurements uint8 array of outcomes, or a num_measurements x ceil(shots / 8) packed
+                 array if ``packed``
+        '''
+        stream = rng.current_stream() if stream is None else stream
+        num_words = (shots + 63) // 64
+        x = np.zeros((self.num_qubits, num_words), dtype = np.uint64)
+        # Random Z frames leave |0> unchanged and make non-deterministic measurements random across shots
+        z = stream.integers(0, 2 ** 64, size = (self.num_qubits, num_words), dtype = np.uint64)
+        ones = np.full(num_words, np.iinfo(np.uint64).max, dtype = np.uint64)
+        records = np.empty((self.num_measurements, num_words), dtype = np.uint64)
+        m = 0
+        for name, qubits, p in self.operations:
+            a = qubits[0]
+            if name in ("I", "X", "Y", "Z"):
+                continue  # Paulis commute with Pauli frames up to a sign
+            elif name == "H":
+                x[a], z[a] = z[a].copy(), x[a].copy()
+            elif name in ("S", "S_DAG"):
+                z[a] ^= x[a]
+            elif name == "CNOT":
+                b = qubits[1]
+                x[b] ^= x[a]
+                z[a] ^= z[b]
+            elif name == "CZ":
+                b = qubits[1]
+                z[a] ^= x[b]
+                z[b] ^= x[a]
+            elif name == "CY":
+                # CY = S_t CNOT S_t^dag
+                b = qubits[1]
+                z[b] ^= x[b]
+                x[b] ^= x[a]
+                z[a] ^= z[b]
+                z[b] ^= x[b]
+            elif name == "SWAP":
+                b = qubits[1]
+                x[[a, b]] = x[[b, a]]
+                z[[a, b]] = z[[b, a]]
+            elif name == "M":
+                records[m] = x[a] ^ (ones if self.reference_outcomes[m] else 0)
+                if p > 0:
+                    records[m] ^= _bernoulli_words(stream, shots, p)[0]
+                z[a] = stream.integers(0, 2 ** 64, size = num_words, dtype = np.uint64)
+                m += 1
+            elif name == "X_ERROR":
+                x[a] ^= _bernoulli_words(stream, shots, p)[0]
+            elif name == "Z_ERROR":
+                z[a] ^= _bernoulli_words(stream, shots, p)[0]
+            elif name == "DEPOLARIZE":
+                # Pick a uniformly random Pauli (2 bits per qubit: x, z) for each shot that is hit
+                _, positions = _bernoulli_words(stream, shots, p)
+                paulis = stream.integers(0, 4 ** len(qubits), size = len(positions))
+                for i, q in enumerate(qubits):
+                    shift = 2 * (len(qubits) - 1 - i)
+                    x[q] ^= _positions_words(positions, (paulis >> (shift + 1)) & 1, num_words)
+                    z[q] ^= _positions_words(positions, (paulis >> shift) & 1, num_words)
+        data = records.astype("<u8", copy = False).view(np.uint8)
+        if packed:
+            data = data[:, :(shots + 7) // 8].copy()
+            if shots % 8:
+                data[:, -1] &= (1 << (shots % 8)) - 1
+            return data
+        return np.ascontiguousarray(np.unpackbits(data, axis = 1, bitorder = "little")[:, :shots].T)
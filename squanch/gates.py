@@ -2,7 +2,8 @@ import numpy as np
 
 from squanch import linalg
 
-__all__ = ["H", "X", "Y", "Z", "RX", "RY", "RZ", "PHASE", "CNOT", "TOFFOLI", "CU", "CPHASE", "SWAP", "expand"]
+__all__ = ["H", "X", "Y", "Z", "RX", "RY", "RZ", "PHASE", "CNOT", "TOFFOLI", "CU", "CPHASE", "SWAP", "controlled",
+           "apply_k", "expand", "use_sparse_operators"]
 
 # Single qubit operators that can be applied with qubit.apply()
 
@@ -33,96 +34,120 @@ _Z = np.array([[1, 0],
                [0, -1]])
 
 
+def _where(where):
+    '''
+    Keyword arguments passing a classical-control mask on to a stream-level qubit's ``QStream``; empty when there is
+    no mask, so single-system backends are called as before
+    '''
+    return {} if where is None else {"where": where}
+
+
 # Single qubit gates
-def H(qubit):
+def H(qubit, where = None):
     '''
     Applies the Hadamard transform to the specified qubit, updating the qsystem state.
     ``cache_id``: ``H``
 
     :param Qubit qubit: the qubit to apply the operator to
+    :param np.array where: for stream-level qubits (see ``QStream.qubit()``), a num_systems boolean mask or integer
+                           outcome array selecting the systems to apply the gate to; default: every system
     '''
-    qubit.apply(_H, id = "H")
+    qubit.apply(_H, id = "H", where = where)
 
 
-def X(qubit):
+def X(qubit, where = None):
     '''
     Applies the Pauli-X (NOT) operation to the specified qubit, updating the qsystem state.
     ``cache_id``: ``X``
 
     :param Qubit qubit: the qubit to apply the operator to
+    :param np.array where: for stream-level qubits (see ``QStream.qubit()``), a num_systems boolean mask or integer
+                           outcome array selecting the systems to apply the gate to; default: every system
     '''
-    qubit.apply(_X, id = "X")
+    qubit.apply(_X, id = "X", where = where)
 
 
-def Y(qubit):
+def Y(qubit, where = None):
     '''
     Applies the Pauli-Y operation to the specified qubit, updating the qsystem state.
     ``cache_id``: ``Y``
 
     :param Qubit qubit: the qubit to apply the operator to
+    :param np.array where: for stream-level qubits (see ``QStream.qubit()``), a num_systems boolean mask or integer
+                           outcome array selecting the systems to apply the gate to; default: every system
     '''
-    qubit.apply(_Y, id = "Y")
+    qubit.apply(_Y, id = "Y", where = where)
 
 
-def Z(qubit):
+def Z(qubit, where = None):
     '''
     Applies the Pauli-Z operation to the specified qubit, updating the qsystem state.
     ``cache_id``: ``Z``
 
     :param Qubit qubit: the qubit to apply the operator to
+    :param np.array where: for stream-level qubits (see ``QStream.qubit()``), a num_systems boolean mask or integer
+                           outcome array selecting the systems to apply the gate to; default: every system
     '''
-    qubit.apply(_Z, id = "Z")
+    qubit.apply(_Z, id = "Z", where = where)
 
 
-def RX(qubit, angle):
+def RX(qubit, angle, where = None):
     '''
     Applies the single qubit X-rotation operator to the specified qubit, updating the qsystem state.
     ``cache_id``: ``Rx*``, where * is angle/pi
 
     :param Qubit qubit: the qubit to apply the operator to
     :param float angle: the angle by which to rotate
+    :param np.array where: for stream-level qubits (see ``QStream.qubit()``), a num_systems boolean mask or integer
+                           outcome array selecting the systems to apply the gate to; default: every system
     '''
     gate = np.cos(angle / 2.0) * _I - 1j * np.sin(angle / 2.0) * _X
-    qubit.apply(gate, id = "Rx" + str(angle / np.pi))
+    qubit.apply(gate, id = "Rx" + str(angle / np.pi), where = where)
 
 
-def RY(qubit, angle):
+def RY(qubit, angle, where = None):
     '''
     Applies the single qubit Y-rotation operator to the specified qubit, updating the qsystem state.
     ``cache_id``: ``Ry*``, where * is angle/pi
 
     :param Qubit qubit: the qubit to apply the operator to
     :param float angle: the angle by which to rotate
+    :param np.array where: for stream-level qubits (see ``QStream.qubit()``), a num_systems boolean mask or integer
+                           outcome array selecting the systems to apply the gate to; default: every system
     '''
     gate = np.cos(angle / 2.0) * _I - 1j * np.sin(angle / 2.0) * _Y
-    qubit.apply(gate, id = "Ry" + str(angle / np.pi))
+    qubit.apply(gate, id = "Ry" + str(angle / np.pi), where = where)
 
 
-def RZ(qubit, angle):
+def RZ(qubit, angle, where = None):
     '''
     Applies the single qubit Z-rotation operator to the specified qubit, updating the qsystem state.
     ``cache_id``: ``Rz*``, where * is angle/pi
 
     :param Qubit qubit: the qubit to apply the operator to
     :param float angle: the angle by which to rotate
+    :param np.array where: for stream-level qubits (see ``QStream.qubit()``), a num_systems boolean mask or integer
+                           outcome array selecting the systems to apply the gate to; default: every system
     '''
     gate = np.cos(angle / 2.0) * _I - 1j * np.sin(angle / 2.0) * _Z
-    qubit.apply(gate, id = "Rz" + str(angle / np.pi))
+    qubit.apply(gate, id = "Rz" + str(angle / np.pi), where = where)
 
 
-def PHASE(qubit, angle):
+def PHASE(qubit, angle, where = None):
     '''
     Applies the phase operation from control on target, mapping |1> to e^(i*angle)|1>.
     ``cache_id``: ``PHASE*``, where * is angle/pi
 
     :param Qubit qubit: the qubit to apply the operator to
     :param float angle: the phase angle to apply
+    :param np.array where: for stream-level qubits (see ``QStream.qubit()``), a num_systems boolean mask or integer
+                           outcome array selecting the systems to apply the gate to; default: every system
     '''
     gate = np.array([[1, 0], [0, np.exp(1j * angle)]])
-    qubit.apply(gate, id = "PHASE" + str(angle / np.pi))
+    qubit.apply(gate, id = "PHASE" + str(angle / np.pi), where = where)
 
 
-def CNOT(control, target):
+def CNOT(control, target, where = None):
     '''
     Applies the controlled-NOT operation from control on target. This gate takes two qubit arguments to
     construct an arbitrary CNOT matrix.
@@ -130,25 +155,15 @@ def CNOT(control, target):
 
     :param Qubit control: the control qubit
     :param Qubit target: the target qubit, with Pauli-X applied according to the control qubit
+    :param np.array where: for stream-level qubits (see ``QStream.qubit()``), a num_systems boolean mask or integer
+                           outcome array selecting the systems to apply the gate to; default: every system
     '''
     num_qubits = target.qsystem.num_qubits
     key = "CNOT" + str(control.index) + "," + str(target.index) + "," + str(num_qubits)
-    # Generate the gate if needed
-    if key not in _expandedGateCache:
-        # Represent CNOT(i,j) as |0i><0i| x I x ... x I + |1i><1i| x I x ... x Xtarg x I x ...
-        proj0 = linalg.tensor_fill_identity(_M0, control.qsystem.num_qubits, control.index)
-        proj1gates = [_I for _ in range(control.qsystem.num_qubits)]
-        proj1gates[control.index] = _M1
-        proj1gates[target.index] = _X
-        proj1 = linalg.tensors(proj1gates)
-        CNOTij = proj0 + proj1
-        # Cache the gate
-        _expandedGateCache[key] = CNOTij
-    # Apply the gate
-    target.qsystem.apply(_expandedGateCache[key])
-
-
-def CU(control, target, unitary):
+    target.qsystem.apply_controlled(_X, (control.index,), target.index, cache_id = key, **_where(where))
+
+
+def CU(control, target, unitary, where = None):
     '''
     Applies the controlled-unitary operation from control on target. This gate takes control and target qubit arguments
     and a unitary operator to apply
@@ -157,25 +172,15 @@ def CU(control, target, unitary):
     :param Qubit control: the control qubit
     :param Qubit target: the target qubit
     :param np.array unitary: the unitary single-qubit gate to apply to the target qubit
+    :param np.array where: for stream-level qubits (see ``QStream.qubit()``), a num_systems boolean mask or integer
+                           outcome array selecting the systems to apply the gate to; default: every system
     '''
     num_qubits = target.qsystem.num_qubits
     key = "CU" + str(control.index) + "," + str(target.index) + "," + str(unitary) + "," + str(num_qubits)
-    # Generate the gate if needed
-    if key not in _expandedGateCache:
-        # Represent CNOT(i,j) as |0i><0i| x I x ... x I + |1i><1i| x I x ... x Xtarg x I x ...
-        proj0 = linalg.tensor_fill_identity(_M0, control.qsystem.num_qubits, control.index)
-        proj1gates = [_I for _ in range(control.qsystem.num_qubits)]
-        proj1gates[control.index] = _M1
-        proj1gates[target.index] = unitary
-        proj1 = linalg.tensors(proj1gates)
-        CUij = proj0 + proj1
-        # Cache the gate
-        _expandedGateCache[key] = CUij
-    # Apply the gate
-    target.qsystem.apply(_expandedGateCache[key])
-
-
-def CPHASE(control, target, angle):
+    target.qsystem.apply_controlled(unitary, (control.index,), target.index, cache_id = key, **_where(where))
+
+
+def CPHASE(control, target, angle, where = None):
     '''
     Applies the controlled-phase operation from control on target. This gate takes control and target qubit arguments
     and a rotation angle, and calls CU(control, target, np.array([[1, 0], [0, np.exp(1j * angle)]])).
@@ -183,12 +188,14 @@ def CPHASE(control, target, angle):
     :param Qubit control: the control qubit
     :param Qubit target: the target qubit
     :param float angle: the phase angle to apply
+    :param np.array where: for stream-level qubits (see ``QStream.qubit()``), a num_systems boolean mask or integer
+                           outcome array selecting the systems to apply the gate to; default: every system
     '''
     matrix = np.array([[1, 0], [0, np.exp(1j * angle)]])
-    CU(control, target, matrix)
+    CU(control, target, matrix, where = where)
 
 
-def TOFFOLI(control1, control2, target):
+def TOFFOLI(control1, control2, target, where = None):
     '''
     Applies the Toffoli (or controlled-controlled-NOT) operation from control on target. This gate takes three qubit
     arguments to construct an arbitrary CCNOT matrix.
@@ -197,43 +204,83 @@ def TOFFOLI(control1, control2, target):
     :param Qubit control1: the first control qubit
     :param Qubit control2: the second control qubit
     :param Qubit target: the target qubit, with Pauli-X applied according to the control qubit
+    :param np.array where: for stream-level qubits (see ``QStream.qubit()``), a num_systems boolean mask or integer
+                           outcome array selecting the systems to apply the gate to; default: every system
     '''
     c1, c2 = sorted([control1.index, control2.index])
     num_qubits = target.qsystem.num_qubits
     key = "CCNOT" + str(c1) + "," + str(c2) + "," + str(target.index) + "," + str(num_qubits)
-    # Generate the gate if needed
-    if key not in _expandedGateCache:
-        gates_list = [[_M0, _M0, _I], [_M0, _M1, _I], [_M1, _M0, _I], [_M1, _M1, _X]]
-        CNOTijk = 0
-        for gates in gates_list:
-            ops = [_I for _ in range(num_qubits)]
-            ops[c1] = gates[0]
-            ops[c2] = gates[1]
-            ops[target.index] = gates[2]
-            operator = linalg.tensors(ops)
-            CNOTijk += operator
-        # Cache the gate
-        _expandedGateCache[key] = CNOTijk
-    # Apply the gate
-    target.qsystem.apply(_expandedGateCache[key])
-
-
-def SWAP(q1, q2):
+    target.qsystem.apply_controlled(_X, (c1, c2), target.index, cache_id = key, **_where(where))
+
+
+def SWAP(q1, q2, where = None):
     '''
     Applies the SWAP operator to two qubits, switching the states. This gate is implemented by three CNOT operations 
     and thus has no ``cache_id``.
     :param q1: the first qubit
     :param q2: the second qubit
+    :param np.array where: for stream-level qubits (see ``QStream.qubit()``), a num_systems boolean mask or integer
+                           outcome array selecting the systems to apply the gate to; default: every system
+    '''
+    CNOT(q2, q1, where = where)
+    CNOT(q1, q2, where = where)
+    CNOT(q2, q1, where = where)
+
+
+def controlled(unitary, controls, targets, control_states = None, where = None):
     '''
-    CNOT(q2, q1)
-    CNOT(q1, q2)
-    CNOT(q2, q1)
+    Applies a unitary to one or more target qubits, conditioned on any number of control qubits being in given
+    computational basis states. Only the slice of the state where the controls match is updated, so no expanded
+    operator is built and this gate has no ``cache_id``.
+
+    :param np.array unitary: the 2^k x 2^k unitary to apply to the targets, acting on them in the order given
+    :param [Qubit] controls: the control qubits
+    :param [Qubit] targets: the k target qubits, in the same system as the controls
+    :param [int] control_states: the value (0 or 1) each control must have for the unitary to act; default: all 1
+    :param np.array where: for stream-level qubits (see ``QStream.qubit()``), a num_systems boolean mask or integer
+                           outcome array selecting the systems to apply the gate to; default: every system
+    '''
+    targets = list(targets)
+    qsystem = targets[0].qsystem
+    qsystem.apply_controlled(unitary, [c.index for c in controls], [t.index for t in targets],
+                             control_states = control_states, **_where(where))
+
+
+def apply_k(operator, qubits, where = None):
+    '''
+    Applies an arbitrary k-qubit operator to the given qubits of a system, contracting it with just those qubits'
+    axes of the state. This gate has no ``cache_id``.
+
+    :param np.array operator: the 2^k x 2^k operator, acting on the qubits in the order given
+    :param [Qubit] qubits: the k qubits to apply the operator to, all in the same system
+    :param np.array where: for stream-level qubits (see ``QStream.qubit()``), a num_systems boolean mask or integer
+                           outcome array selecting the systems to apply the gate to; default: every system
+    '''
+    qubits = list(qubits)
+    qubits[0].qsystem.apply_local(operator, [q.index for q in qubits], **_where(where))
 
 
 _expandedGateCache = {}
 
+# Whether expanded operators are built as linalg.SparseOperator instances by default; see use_sparse_operators()
+_use_sparse = False
+
 
-def expand(operator, index, num_qubits, cache_id = None):
+def use_sparse_operators(enabled = True):
+    '''
+    Choose whether ``expand`` builds and caches expanded single-qubit operators as ``linalg.SparseOperator``
+    instances instead of dense 2^n x 2^n matrices. Sparse operators need O(2^n) memory per cached gate instead of
+    O(4^n), and are applied with sparse-dense products. This only affects single-qubit gates with a ``cache_id``
+    applied to a ``QSystem`` without a noise model; controlled gates, k-qubit gates, measurements and stream-level
+    gates act on slices of the state and never build expanded operators.
+
+    :param bool enabled: whether to use sparse operators
+    '''
+    global _use_sparse
+    _use_sparse = enabled
+
+
+def expand(operator, index, num_qubits, cache_id = None, sparse = None):
     '''
     Apply a k-qubit quantum gate to act on n-qubits by filling the rest of the spaces with identity operators
 
@@ -241,14 +288,20 @@ def expand(operator, index, num_qubits, cache_id = None):
     :param int index: if specified, the index of the qubit to perform the operation on
     :param int num_qubits: the number of qubits in the system
     :param str ``cache_id``: a character identifier to cache gates and their expansions in memory
+    :param bool sparse: whether to build a ``linalg.SparseOperator`` (single-qubit operators only); default: the
+                        setting of ``use_sparse_operators()``
     :return: the expanded n-qubit operator
     '''
+    sparse = _use_sparse if sparse is None else sparse
+    if sparse:
+        build = lambda: linalg.SparseOperator.expand(operator, index, num_qubits)
+    else:
+        build = lambda: linalg.tensor_fill_identity(operator, num_qubits, index)
 
     if cache_id is not None:
-        key = "I" * index + cache_id + "I" * (num_qubits - 1 - index)
+        key = ("sparse:" if sparse else "") + "I" * index + cache_id + "I" * (num_qubits - 1 - index)
         if key not in _expandedGateCache:  # cache the expanded gate
-            expandedOperator = linalg.tensor_fill_identity(operator, num_qubits, index)
-            _expandedGateCache[key] = expandedOperator
+            _expandedGateCache[key] = build()
         return _expandedGateCache[key]
     else:
-        return linalg.tensor_fill_identity(operator, num_qubits, index)
+        return build()
@@ -1,6 +1,8 @@
 import numpy as np
 
-__all__ = ["is_hermitian", "tensor_product", "tensors", "tensor_fill_identity"]
+__all__ = ["is_hermitian", "tensor_product", "tensors", "tensor_fill_identity", "apply_operator",
+           "apply_controlled_operator", "controlled_operator", "SparseOperator",
+           "pack_hermitian", "unpack_hermitian", "HermitianPackedArray"]
 
 
 def is_hermitian(matrix):
@@ -58,3 +60,266 @@ def tensor_fill_identity(single_qubit_operator, n_qubits, qubit_index):
         tensors([np.eye(2)] * (n_qubits - (qubit_index + 1)))
     ])
     return operator
+
+
+def _apply_to_axes(tensor, operator, axes):
+    '''
+    Contract a k-qubit operator with k axes (each of dimension 2) of a tensor
+
+    :param np.array tensor: the tensor to act on
+    :param np.array operator: the 2^k x 2^k operator
+    :param [int] axes: the k axes of the tensor that the operator acts on
+    :return: the resulting tensor, with the same shape as the input
+    '''
+    k = len(axes)
+    end = list(range(tensor.ndim - k, tensor.ndim))
+    moved = np.moveaxis(tensor, axes, end)
+    result = np.matmul(moved.reshape(-1, 2 ** k), operator.T).reshape(moved.shape)
+    return np.moveaxis(result, end, axes)
+
+
+def apply_operator(state, operator, qubit_indices, is_density):
+    '''
+    Apply a k-qubit operator to chosen qubits of a state vector or density matrix without expanding it to act on the
+    full Hilbert space. Any leading axes of the state (e.g. the system axis of a stream) are treated as batch axes.
+
+    :param np.array state: a (...) x 2^n state vector or (...) x 2^n x 2^n density matrix array
+    :param np.array operator: the 2^k x 2^k operator, acting on the qubits in the order given
+    :param [int] qubit_indices: the k qubits to act on
+    :param bool is_density: whether the state is a density matrix
+    :return: the new state array
+    '''
+    dim = state.shape[-1]
+    num_qubits = int(np.log2(dim))
+    qubit_indices = list(qubit_indices)
+    if not is_density:
+        batch = state.shape[:-1]
+        tensor = state.reshape((-1,) + (2,) * num_qubits)
+        tensor = _apply_to_axes(tensor, operator, [1 + i for i in qubit_indices])
+        return tensor.reshape(batch + (dim,))
+    batch = state.shape[:-2]
+    tensor = state.reshape((-1,) + (2,) * (2 * num_qubits))
+    tensor = _apply_to_axes(tensor, operator, [1 + i for i in qubit_indices])
+    tensor = _apply_to_axes(tensor, operator.conj(), [1 + num_qubits + i for i in qubit_indices])
+    return tensor.reshape(batch + (dim, dim))
+
+
+def _control_index(num_axes, offset, controls, control_states):
+    '''
+    Build the index selecting the slice of a state tensor where the control qubits are in the given basis states
+
+    :param int num_axes: the number of axes of the tensor after the leading batch axis
+    :param int offset: the position of qubit 0's axis among those axes (0 for rows, n for columns of a density matrix)
+    :param [int] controls: the control qubits
+    :param [int] control_states: the required value of each control qubit
+    :return: the index tuple, including the leading batch axis
+    '''
+    index = [slice(None)] * (1 + num_axes)
+    for control, value in zip(controls, control_states):
+        index[1 + offset + control] = value
+    return tuple(index)
+
+
+def apply_controlled_operator(state, operator, controls, targets, is_density, control_states = None):
+    '''
+    Apply a k-qubit operator to target qubits, conditioned on the control qubits being in given computational basis
+    states, in place. Only the slice of the state where the controls match is read and written, so no 2^n x 2^n
+    operator is built and the cost falls by a factor of two per control. Any leading axes of the state are treated
+    as batch axes, as in ``apply_operator()``.
+
+    :param np.array state: a C-contiguous (...) x 2^n state vector or (...) x 2^n x 2^n density matrix array, which
+                           is modified in place
+    :param np.array operator: the 2^k x 2^k operator, acting on the target qubits in the order given
+    :param [int] controls: the control qubits
+    :param [int] targets: the k target qubits, distinct from the controls
+    :param bool is_density: whether the state is a density matrix
+    :param [int] control_states: the value (0 or 1) each control must have for the operator to act; default: all 1
+    :return: the state array
+    '''
+    controls, targets = list(controls), list(targets)
+    control_states = [1] * len(controls) if control_states is None else list(control_states)
+    assert not set(controls) & set(targets), "Control and target qubits must be distinct"
+    assert state.flags.c_contiguous, "The state must be C-contiguous to be updated in place"
+    num_qubits = int(np.log2(state.shape[-1]))
+    # Fixing the control axes removes them, so target axes shift down by the number of controls before them
+    axes = [1 + t - sum(c < t for c in controls) for t in targets]
+    if not is_density:
+        tensor = state.reshape((-1,) + (2,) * num_qubits)
+        index = _control_index(num_qubits, 0, controls, control_states)
+        tensor[index] = _apply_to_axes(tensor[index], operator, axes)
+        return state
+    # U rho U^dag: act on the rows where the controls match, then on the columns where they match
+    tensor = state.reshape((-1,) + (2,) * (2 * num_qubits))
+    index = _control_index(2 * num_qubits, 0, controls, control_states)
+    tensor[index] = _apply_to_axes(tensor[index], operator, axes)
+    index = _control_index(2 * num_qubits, num_qubits, controls, control_states)
+    tensor[index] = _apply_to_axes(tensor[index], operator.conj(), [num_qubits + a for a in axes])
+    return state
+
+
+def controlled_operator(operator, num_controls, control_states = None):
+    '''
+    Build the dense operator of a controlled gate on just the qubits it involves, with the controls first followed by
+    the targets. This is a (2^c 2^k) x (2^c 2^k) matrix, for backends that act on small local operators.
+
+    :param np.array operator: the 2^k x 2^k operator applied to the targets
+    :param int num_controls: the number c of control qubits
+    :param [int] control_states: the value (0 or 1) each control must have for the operator to act; default: all 1
+    :return: the local controlled operator
+    '''
+    control_states = [1] * num_controls if control_states is None else list(control_states)
+    dim = operator.shape[0]
+    block = int("".join(str(int(v)) for v in control_states) or "0", 2)
+    result = np.eye(dim * 2 ** num_controls, dtype = np.result_type(operator, np.complex64))
+    result[block * dim:(block + 1) * dim, block * dim:(block + 1) * dim] = operator
+    return result
+
+
+class SparseOperator:
+    '''
+    An n-qubit operator with a fixed number k of nonzero entries per row, stored as num_rows x k arrays of column
+    indices and values. Expanded single-qubit gates have k <= 2, and permutation-with-phase operators such as
+    expanded Pauli gates have k = 1, so storage and application cost O(k 2^n) rather than O(4^n).
+    '''
+
+    __slots__ = ("columns", "values")
+
+    def __init__(self, columns, values):
+        '''
+        Instantiate the sparse operator from its column indices and values
+
+        :param np.array columns: dim x k integer array; row i has entries at columns[i, :]
+        :param np.array values: dim x k complex array of the corresponding entries
+        '''
+        # Drop slots which are zero for every row, e.g. the diagonal slot of an expanded Pauli-X
+        nonzero = np.any(values != 0, axis = 0)
+        if not np.any(nonzero):
+            nonzero[0] = True
+        self.columns = np.ascontiguousarray(columns[:, nonzero])
+        self.values = np.ascontiguousarray(values[:, nonzero])
+
+    @classmethod
+    def expand(cls, operator, index, num_qubits):
+        '''
+        Build the sparse n-qubit operator for a single-qubit operator acting on one qubit
+
+        :param np.array operator: the single-qubit (2x2) operator
+        :param int index: the qubit the operator acts on
+        :param int num_qubits: the number of qubits in the system
+        :return: the sparse operator
+        '''
+        rows = np.arange(2 ** num_qubits)
+        mask = 1 << (num_qubits - 1 - index)
+        bit = ((rows & mask) != 0).astype(int)
+        # Slot 0 holds the entry in the row's own column, slot 1 the entry in the column with the target bit flipped
+        columns = np.stack([rows, rows ^ mask], axis = 1)
+        operator = np.asarray(operator, dtype = np.complex128)
+        values = np.stack([operator[bit, bit], operator[bit, 1 - bit]], axis = 1)
+        return cls(columns, values)
+
+    def to_dense(self):
+        '''
+        Convert to a dense matrix
+
+        :return: the dim x dim operator
+        '''
+        dim = self.columns.shape[0]
+        dense = np.zeros((dim, dim), dtype = self.values.dtype)
+        np.add.at(dense, (np.arange(dim)[:, np.newaxis], self.columns), self.values)
+        return dense
+
+    def apply(self, state, is_density):
+        '''
+        Apply the operator to a state vector (O|psi>) or density matrix (O rho O^dagger)
+
+        :param np.array state: the 2^n state vector or 2^n x 2^n density matrix
+        :param bool is_density: whether the state is a density matrix
+        :return: the new state
+        '''
+        if not is_density:
+            return np.sum(self.values * state[self.columns], axis = 1)
+        # (O rho)[i, :] = sum_k values[i, k] rho[columns[i, k], :]
+        left = np.sum(self.values[:, :, np.newaxis] * state[self.columns], axis = 1)
+        # (A O^dagger)[:, j] = sum_k conj(values[j, k]) A[:, columns[j, k]]
+        return np.sum(left[:, self.columns] * self.values.conj()[np.newaxis], axis = 2)
+
+
+def pack_hermitian(matrices):
+    '''
+    Pack Hermitian matrices into real matrices of the same shape holding only the upper triangle: the real parts of
+    the diagonal and upper off-diagonal entries in place, and the imaginary parts of the upper off-diagonal entries in
+    the (otherwise redundant) lower triangle. This halves the storage of complex matrices.
+
+    :param np.array matrices: a (...) x d x d array of Hermitian matrices
+    :return: the (...) x d x d real array of packed matrices
+    '''
+    matrices = np.asarray(matrices)
+    return np.triu(matrices.real) + np.tril(np.swapaxes(matrices.imag, -1, -2), -1)
+
+
+def unpack_hermitian(packed, dtype = np.complex64):
+    '''
+    Unpack matrices packed with ``pack_hermitian()``
+
+    :param np.array packed: a (...) x d x d real array of packed matrices
+    :param np.dtype dtype: the complex dtype of the result
+    :return: the (...) x d x d array of Hermitian matrices
+    '''
+    upper, lower = np.triu(packed, 1), np.tril(packed, -1)
+    real = np.triu(packed) + np.swapaxes(upper, -1, -2)
+    imag = np.swapaxes(lower, -1, -2) - lower
+    result = np.empty(packed.shape, dtype = dtype)
+    result.real, result.imag = real, imag
+    return result
+
+
+class HermitianPackedArray:
+    '''
+    A num_systems x d x d array of density matrices stored in Hermitian-packed form (see ``pack_hermitian()``), taking
+    half the memory of the complex array. Indexing along the system axis unpacks the selected matrices into a complex
+    copy, and assigning to it packs the new values, so chunked code written for complex state arrays works unchanged
+    while only a chunk is ever held unpacked.
+    '''
+
+    __slots__ = ("packed",)
+
+    def __init__(self, packed):
+        '''
+        Wrap a packed array
+
+        :param np.array packed: the num_systems x d x d real array of packed matrices
+        '''
+        self.packed = packed
+
+    @property
+    def shape(self):
+        return self.packed.shape
+
+    @property
+    def ndim(self):
+        return self.packed.ndim
+
+    @property
+    def dtype(self):
+        return np.dtype(np.complex64) if self.packed.dtype == np.float32 else np.dtype(np.complex128)
+
+    def __len__(self):
+        return len(self.packed)
+
+    def __getitem__(self, item):
+        if isinstance(item, tuple):
+            # Unpack the selected systems, then index within the unpacked matrices
+            matrices = self[item[0]]
+            return matrices[(slice(None),) * (matrices.ndim - 2) + item[1:]]
+        return unpack_hermitian(self.packed[item], dtype = self.dtype)
+
+    def __setitem__(self, item, value):
+        self.packed[item] = pack_hermitian(value)
+
+    def unpack(self):
+        '''
+        Unpack the whole array, e.g. for debugging. This allocates the full complex array.
+
+        :return: the num_systems x d x d complex array
+        '''
+        return self[...]
@@ -0,0 +1,296 @@
+import numpy as np
+
+from squanch import rng
+
+__all__ = ["DecoherenceModel", "QuantumMemory"]
+
+
+class DecoherenceModel:
+    '''
+    Models T1 (amplitude damping) and T2 (dephasing) decoherence of qubits idling in an agent's quantum memory. The
+    effect of an idle interval t is applied in closed form as a single combined channel: populations relax towards
+    |0> with probability gamma = 1 - exp(-t/T1), and coherences decay by exp(-t/T2).
+    '''
+
+    def __init__(self, t1 = np.inf, t2 = None):
+        '''
+        Instantiate the decoherence model
+
+        :param float t1: energy relaxation time in seconds; default: infinite (no amplitude damping)
+        :param float t2: coherence time in seconds, at most 2 * t1; default: 2 * t1 (no pure dephasing)
+        '''
+        self.t1 = t1
+        self.t2 = 2 * t1 if t2 is None else t2
+        assert self.t2 <= 2 * self.t1, "T2 cannot exceed 2 * T1"
+
+    @property
+    def is_mixing(self):
+        '''
+        Whether the model decoheres stored qubits at all, so that an adaptive ``QStream`` must be promoted to density
+        matrices
+        '''
+        return bool(np.isfinite(self.t1) or np.isfinite(self.t2))
+
+    def parameters(self, elapsed):
+        '''
+        Compute the damping probability and coherence factor for idle intervals
+
+        :param np.array elapsed: idle times in seconds
+        :return: tuple of arrays (gamma, coherence), where gamma = 1 - exp(-t/T1) and coherence = exp(-t/T2)
+        '''
+        elapsed = np.asarray(elapsed, dtype = np.float64)
+        return -np.expm1(-elapsed / self.t1), np.exp(-elapsed / self.t2)
+
+    def apply(self, states, qubit_index, elapsed, is_density):
+        '''
+        Apply the idle-interval channel to one qubit of each of a batch of system states. Density matrices are
+        updated exactly; state vectors are updated by sampling a quantum trajectory (a jump to |0> with probability
+        gamma * P(|1>), otherwise the no-jump evolution, followed by a random phase flip reproducing the dephasing).
+
+        :param np.array states: a batch x 2^n (x 2^n) array of state vectors (density matrices)
+        :param int qubit_index: the qubit of each system to decohere
+        :param np.array elapsed: the batch of idle times in seconds
+        :param bool is_density: whether the states are density matrices
+        :return: the new batch of states
+        '''
+        batch, dim = states.shape[0], states.shape[1]
+        left, right = 2 ** qubit_index, dim // 2 ** (qubit_index + 1)
+        gamma, coherence = self.parameters(elapsed)
+        if is_density:
+            rho = states.reshape((batch, left, 2, right, left, 2, right)).copy()
+            shape = (batch, 1, 1, 1, 1)
+            rho11 = rho[:, :, 1, :, :, 1, :]
+            rho[:, :, 0, :, :, 0, :] += gamma.reshape(shape) * rho11
+            rho[:, :, 1, :, :, 1, :] = (1 - gamma).reshape(shape) * rho11
+            rho[:, :, 0, :, :, 1, :] *= coherence.reshape(shape)
+            rho[:, :, 1, :, :, 0, :] *= coherence.reshape(shape)
+            return rho.reshape(states.shape)
+        psi = states.reshape((batch, left, 2, right)).copy()
+        prob1 = np.sum(np.abs(psi[:, :, 1, :]) ** 2, axis = (1, 2))
+        jump = rng.current_stream().random(batch) < gamma * prob1
+        # Jump: the qubit decays to |0>, carrying the amplitudes of its |1> branch
+        psi[jump, :, 0, :] = psi[jump, :, 1, :]
+        psi[jump, :, 1, :] = 0
+        # No jump: the |1> branch is attenuated by sqrt(1 - gamma)
+        psi[~jump, :, 1, :] *= np.sqrt(1 - gamma[~jump]).reshape((-1, 1, 1))
+        norms = np.sqrt(np.sum(np.abs(psi) ** 2, axis = (1, 2, 3)))
+        psi /= norms.reshape((batch, 1, 1, 1))
+        # Pure dephasing beyond that caused by amplitude damping, as a random phase flip
+        dephasing = np.clip(coherence / np.sqrt(np.clip(1 - gamma, 1e-300, None)), 0, 1)
+        flip = rng.current_stream().random(batch) < (1 - dephasing) / 2
+        psi[flip, :, 1, :] *= -1
+        return psi.reshape(states.shape).astype(states.dtype)
+
+
+class QuantumMemory:
+    '''
+    Compact, list-like quantum memory for an agent. Rather than holding one ``Qubit`` object per stored qubit, the
+    memory keeps a growable integer array of serialized ``(system_index, qubit_index)`` references into the parent
+    ``QStream`` and instantiates lightweight ``Qubit`` views only when an element is accessed.
+
+    If the owning agent has a ``memory_model``, stored qubits decohere according to the agent's clock. The decay is
+    applied lazily, in closed form for the whole idle interval, when a qubit is next accessed; qubits which are never
+    read again cost nothing.
+    '''
+
+    # Reference value used to represent a lost qubit (``None``) in the reference array
+    _NONE = -1
+    # Reference value used to represent a qubit whose system does not live in the parent stream
+    _DETACHED = -2
+
+    def __init__(self, qstream, capacity = 64, agent = None):
+        '''
+        Instantiate an empty quantum memory
+
+        :param QStream qstream: the stream that stored qubit references point into
+        :param int capacity: initial number of references to allocate space for; the memory grows as needed
+        :param Agent agent: the agent owning the memory, whose clock and ``memory_model`` drive decoherence
+        '''
+        self.qstream = qstream
+        self.agent = agent
+        self._refs = np.empty((max(capacity, 1), 2), dtype = np.int64)
+        self._times = np.zeros(max(capacity, 1))  # agent time at which each stored qubit was last brought up to date
+        self._size = 0
+        self._detached = {}  # position -> Qubit, for qubits which cannot be serialized into the stream
+
+    def __len__(self):
+        '''
+        Number of qubits (including lost ``None`` qubits) held in the memory
+        '''
+        return self._size
+
+    def __iter__(self):
+        '''
+        Iterates over the stored qubits, instantiating each ``Qubit`` view lazily
+
+        :return: each stored qubit (or ``None`` for lost qubits)
+        '''
+        self.decohere()
+        for i in range(self._size):
+            yield self._view(i)
+
+    def __getitem__(self, item):
+        '''
+        Retrieve a qubit (or list of qubits, for slices) from the memory
+
+        :param int|slice item: the position(s) to retrieve
+        :return: the qubit view(s)
+        '''
+        if isinstance(item, slice):
+            positions = np.arange(*item.indices(self._size))
+            self.decohere(positions)
+            return [self._view(i) for i in positions]
+        position = self._position(item)
+        self.decohere([position])
+        return self._view(position)
+
+    def __repr__(self):
+        return "QuantumMemory(" + repr(list(map(tuple, self.references))) + ")"
+
+    @property
+    def references(self):
+        '''
+        A read-only ``(len(self), 2)`` array of the stored ``(system_index, qubit_index)`` references. Lost qubits are
+        stored as ``(-1, -1)``. Useful for vectorized operations over everything held in memory.
+        '''
+        refs = self._refs[:self._size]
+        refs.flags.writeable = False
+        return refs
+
+    def append(self, qubit):
+        '''
+        Store a qubit reference at the end of the memory
+
+        :param Qubit qubit: the qubit to store; may be ``None``
+        '''
+        if self._size == self._refs.shape[0]:
+            self._grow()
+        self._times[self._size] = self._now()
+        if qubit is None:
+            self._refs[self._size] = (self._NONE, self._NONE)
+        elif not self._in_stream(qubit.qsystem):
+            self._refs[self._size] = (self._DETACHED, qubit.index)
+            self._detached[self._size] = qubit
+        else:
+            self._refs[self._size] = qubit.serialize()
+        self._size += 1
+
+    def serialize(self):
+        '''
+        Generate a picklable snapshot of the memory contents, without a reference to the parent stream
+
+        :return: tuple of (copy of the reference array, copy of the storage times, dict of detached qubits)
+        '''
+        return self.references.copy(), self._times[:self._size].copy(), dict(self._detached)
+
+    @classmethod
+    def from_serialized(cls, qstream, serialized, agent = None):
+        '''
+        Reconstruct a quantum memory from a snapshot produced by ``QuantumMemory.serialize()``
+
+        :param QStream qstream: the stream that the stored references point into
+        :param tuple serialized: the (reference array, storage times, detached qubits) snapshot
+        :param Agent agent: the agent owning the memory
+        :return: the restored quantum memory
+        '''
+        references, times, detached = serialized
+        memory = cls(qstream, capacity = len(references), agent = agent)
+        memory._refs[:len(references)] = references
+        memory._times[:len(references)] = times
+        memory._size = len(references)
+        memory._detached = dict(detached)
+        return memory
+
+    def pop(self, index = -1):
+        '''
+        Remove and return the qubit at a given position (default: last)
+
+        :param int index: the position to remove
+        :return: the removed qubit view
+        '''
+        position = self._position(index)
+        self.decohere([position])
+        qubit = self._view(position)
+        self._refs[position:self._size - 1] = self._refs[position + 1:self._size]
+        self._times[position:self._size - 1] = self._times[position + 1:self._size]
+        self._size -= 1
+        if self._detached:
+            self._detached = {(p - 1 if p > position else p): q for p, q in self._detached.items() if p != position}
+        return qubit
+
+    def clear(self):
+        '''
+        Remove all references from the memory, keeping the allocated buffer
+        '''
+        self._size = 0
+        self._detached.clear()
+
+    def decohere(self, positions = None):
+        '''
+        Bring stored qubits up to date with the owning agent's clock by applying the decoherence accumulated since
+        they were stored or last accessed. Qubits are grouped by their index within their systems, and each group is
+        updated with one vectorized application of the agent's ``memory_model``. This does nothing if the agent has
+        no memory model.
+
+        :param [int] positions: the memory positions to update; default: every stored qubit
+        '''
+        model = getattr(self.agent, "memory_model", None)
+        if model is None or self._size == 0:
+            return
+        now = self._now()
+        positions = np.arange(self._size) if positions is None else np.asarray(positions, dtype = np.int64)
+        refs = self._refs[positions]
+        active = (refs[:, 0] >= 0) & (self._times[positions] < now)
+        positions, refs = positions[active], refs[active]
+        is_density = self.qstream.use_density_matrix
+        # Systems of a ragged stream are decohered in batches of one size
+        sizes = getattr(self.qstream, "system_sizes", None)
+        sizes = np.zeros(len(refs), dtype = np.int64) if sizes is None else sizes[refs[:, 0]]
+        for qubit_index, size in np.unique(np.stack([refs[:, 1], sizes], axis = 1), axis = 0):
+            group = (refs[:, 1] == qubit_index) & (sizes == size)
+            systems = refs[group, 0]
+            elapsed = now - self._times[positions[group]]
+            self.qstream.state[systems] = model.apply(self.qstream.state[systems], int(qubit_index), elapsed,
+                                                      is_density)
+        self._times[positions] = now
+
+    def _now(self):
+        '''The current time of the owning agent's clock, or 0 if the memory has no agent'''
+        return self.agent.time if self.agent is not None else 0.0
+
+    def _position(self, index):
+        '''Normalize a (possibly negative) integer position and check that it is in range'''
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError("quantum memory index out of range")
+        return index
+
+    def _in_stream(self, qsystem):
+        '''Whether a system's state lives in the parent stream, so that it can be stored as a reference into it'''
+        if qsystem.index is None or self.qstream is None:
+            return False
+        system_state = getattr(qsystem, "packed", None)
+        if not isinstance(system_state, np.ndarray):
+            system_state = getattr(qsystem, "state", None)
+        stream_state = self.qstream.state
+        stream_buffer = getattr(stream_state, "buffer", getattr(stream_state, "packed", stream_state))
+        return isinstance(system_state, np.ndarray) and np.may_share_memory(system_state, stream_buffer)
+
+    def _view(self, position):
+        '''Instantiate the qubit view for a stored reference'''
+        system_index, qubit_index = self._refs[position]
+        if system_index == self._NONE:
+            return None
+        elif system_index == self._DETACHED:
+            return self._detached[position]
+        return self.qstream.system(int(system_index)).qubit(int(qubit_index))
+
+    def _grow(self):
+        '''Double the capacity of the reference buffer'''
+        refs = np.empty((2 * self._refs.shape[0], 2), dtype = np.int64)
+        refs[:self._size] = self._refs[:self._size]
+        self._refs = refs
+        times = np.zeros(2 * self._times.shape[0])
+        times[:self._size] = self._times[:self._size]
+        self._times = times
@@ -0,0 +1,596 @@
+import ctypes
+import numpy as np
+from multiprocessing import sharedctypes
+
+from squanch import linalg, rng
+from squanch.qstream import QStream, _BELL_CIRCUIT, _BELL_STATES
+from squanch.qubit import Qubit
+
+__all__ = ["MPSQSystem", "MPSQStream"]
+
+# Two-qubit SWAP operator, used to route non-adjacent qubits next to each other
+_SWAP = np.array([[1, 0, 0, 0],
+                  [0, 0, 1, 0],
+                  [0, 1, 0, 0],
+                  [0, 0, 0, 1]])
+
+
+def _site_size(max_bond_dimension):
+    '''
+    Number of complex entries used to store one site of an MPS: a padded chi x 2 x chi tensor plus its right bond
+    dimension
+
+    :param int max_bond_dimension: the maximum bond dimension chi
+    :return: the number of entries per site
+    '''
+    return 2 * max_bond_dimension ** 2 + 1
+
+
+def _bond_dimension(site_size):
+    '''
+    Recover the maximum bond dimension from the number of entries per site
+
+    :param int site_size: the number of entries per site
+    :return: the maximum bond dimension chi
+    '''
+    return int(round(np.sqrt((site_size - 1) / 2)))
+
+
+class MPSQSystem:
+    '''
+    Represents an n-qubit pure state as a matrix product state (MPS) with a bounded bond dimension, allowing systems
+    of tens to hundreds of qubits with limited entanglement between neighbors. ``MPSQSystem`` mirrors the ``QSystem``
+    interface used by ``Qubit`` and ``squanch.gates``, so existing gate and measurement calls work unchanged.
+
+    The MPS is stored in a flat num_qubits x (2 chi^2 + 1) complex array: each row holds one site tensor, zero-padded
+    to chi x 2 x chi, followed by its right bond dimension. This fixed layout lets MPS systems live in a shared
+    ``MPSQStream`` buffer like dense systems do. The MPS is kept in mixed-canonical form: sites left of the
+    orthogonality center are left-isometries and sites right of it are right-isometries, so singular values taken
+    at the center measure the true truncation error. The center is recorded in the (otherwise unused) imaginary part
+    of site 0's bond dimension entry.
+    '''
+
+    __slots__ = ("num_qubits", "index", "state", "max_bond_dimension", "cutoff", "use_density_matrix",
+                 "truncation_error", "__weakref__")
+
+    def __init__(self, num_qubits, index = None, state = None, max_bond_dimension = 16, cutoff = 1e-10):
+        '''
+        Instantiate the MPS for an n-qubit system
+
+        :param int num_qubits: number of qubits in the system
+        :param int index: index of the system within the parent stream
+        :param np.array state: num_qubits x (2 chi^2 + 1) array holding the MPS; by default, |000...0> is allocated
+        :param int max_bond_dimension: maximum bond dimension chi kept when truncating after multi-qubit gates
+        :param float cutoff: maximum fraction of the state's weight discarded when truncating singular values
+        '''
+        self.num_qubits = num_qubits
+        self.index = index
+        self.cutoff = cutoff
+        self.use_density_matrix = False
+        self.truncation_error = 0.0
+        if state is not None:
+            self.state = state
+            self.max_bond_dimension = _bond_dimension(state.shape[1])
+        else:
+            self.max_bond_dimension = max_bond_dimension
+            self.state = np.zeros((num_qubits, _site_size(max_bond_dimension)), dtype = np.complex64)
+            MPSQSystem.reformat(self.state)
+
+    @staticmethod
+    def reformat(array):
+        '''
+        Reformats MPS storage in-place to the all-zero product state
+
+        :param np.array array: a (...) x num_qubits x (2 chi^2 + 1) array of MPS storage
+        '''
+        array[...] = 0
+        array[..., 0] = 1  # site tensor A[0, |0>, 0] = 1
+        array[..., -1] = 1  # right bond dimension of 1
+
+    @classmethod
+    def from_stream(cls, qstream, index):
+        '''
+        Instantiate an MPSQSystem from a given index in a parent MPSQStream
+
+        :param MPSQStream qstream: the parent stream
+        :param int index: the index in the parent stream corresponding to this system
+        :return: the MPSQSystem object
+        '''
+        return cls(qstream.system_size, index = index, state = qstream.state[index], cutoff = qstream.cutoff)
+
+    @property
+    def qubits(self):
+        '''
+        A generator over the constituent qubits of this system
+
+        :return: a generator of ``Qubit`` instances, one per qubit index
+        '''
+        return (Qubit(self, i) for i in range(self.num_qubits))
+
+    @property
+    def bond_dimensions(self):
+        '''
+        The current bond dimensions between neighboring sites
+
+        :return: a list of num_qubits - 1 bond dimensions
+        '''
+        return [int(self.state[i, -1].real) for i in range(self.num_qubits - 1)]
+
+    def qubit(self, index):
+        '''
+        Access a qubit by index
+
+        :param int index: qubit index to generate a qubit instance for
+        :return: the qubit instance
+        '''
+        return Qubit(self, index)
+
+    def _get(self, site):
+        '''
+        Read a site tensor, trimmed to its actual bond dimensions
+
+        :param int site: the site index
+        :return: the chi_left x 2 x chi_right site tensor, in double precision
+        '''
+        chi = self.max_bond_dimension
+        left = 1 if site == 0 else int(self.state[site - 1, -1].real)
+        right = int(self.state[site, -1].real)
+        tensor = self.state[site, :-1].reshape((chi, 2, chi))
+        return tensor[:left, :, :right].astype(np.complex128)
+
+    def _set(self, site, tensor):
+        '''
+        Write a site tensor into the padded storage
+
+        :param int site: the site index
+        :param np.array tensor: the chi_left x 2 x chi_right site tensor
+        '''
+        chi = self.max_bond_dimension
+        padded = np.zeros((chi, 2, chi), dtype = self.state.dtype)
+        padded[:tensor.shape[0], :, :tensor.shape[2]] = tensor
+        self.state[site, :-1] = padded.ravel()
+        self.state[site, -1] = complex(tensor.shape[2], self.state[site, -1].imag)
+
+    @property
+    def _center(self):
+        '''The site of the orthogonality center'''
+        return int(self.state[0, -1].imag)
+
+    @_center.setter
+    def _center(self, site):
+        self.state[0, -1] = complex(self.state[0, -1].real, site)
+
+    def _move_center(self, site):
+        '''
+        Move the orthogonality center to a site with a sweep of QR decompositions, which leaves the state unchanged
+
+        :param int site: the site to move the center to
+        '''
+        center = self._center
+        while center < site:
+            tensor = self._get(center)
+            left, right = tensor.shape[0], tensor.shape[2]
+            q, r = np.linalg.qr(tensor.reshape((left * 2, right)))
+            self._set(center, q.reshape((left, 2, -1)))
+            self._set(center + 1, np.tensordot(r, self._get(center + 1), axes = (1, 0)))
+            center += 1
+        while center > site:
+            tensor = self._get(center)
+            left, right = tensor.shape[0], tensor.shape[2]
+            q, r = np.linalg.qr(tensor.reshape((left, 2 * right)).T)
+            self._set(center, q.T.reshape((-1, 2, right)))
+            self._set(center - 1, np.tensordot(self._get(center - 1), r.T, axes = (-1, 0)))
+            center -= 1
+        self._center = center
+
+    def _apply_contiguous(self, operator, start, k):
+        '''
+        Apply a k-qubit operator to the contiguous sites start, ..., start + k - 1 and split the result back into
+        site tensors with truncated singular value decompositions. The orthogonality center is moved to ``start``
+        first, so the discarded singular values are the true truncation error, and the kept ones are rescaled to
+        preserve the norm. The center ends up on the last site.
+
+        :param np.array operator: the 2^k x 2^k operator, with site ``start`` as its most significant qubit
+        :param int start: the first site
+        :param int k: the number of sites
+        '''
+        self._move_center(start)
+        theta = self._get(start)
+        for site in range(start + 1, start + k):
+            theta = np.tensordot(theta, self._get(site), axes = (-1, 0))
+        left, right = theta.shape[0], theta.shape[-1]
+        theta = theta.reshape((left, 2 ** k, right))
+        theta = np.einsum("pq,aqb->apb", operator, theta)
+        for site in range(start, start + k - 1):
+            matrix = theta.reshape((left * 2, -1))
+            u, s, vh = np.linalg.svd(matrix, full_matrices = False)
+            weights = s ** 2
+            total = np.sum(weights)
+            # Keep the fewest singular values whose discarded weight is within the cutoff, up to chi of them
+            discarded = np.cumsum(weights[::-1])[::-1]
+            keep = int(np.sum(discarded > self.cutoff * total)) if total > 0 else 1
+            keep = max(1, min(keep, self.max_bond_dimension))
+            self.truncation_error += float(np.sum(weights[keep:]) / total) if total > 0 else 0.0
+            self._set(site, u[:, :keep].reshape((left, 2, keep)))
+            kept = s[:keep] * np.sqrt(total / np.sum(weights[:keep])) if total > 0 else s[:keep]
+            theta = kept[:, np.newaxis] * vh[:keep]
+            left = keep
+        self._set(start + k - 1, theta.reshape((left, 2, right)))
+        self._center = start + k - 1
+
+    def apply(self, operator):
+        '''
+        Apply an N-qubit operator to the whole system. This contracts every site together and is only practical
+        for small systems; prefer the ``apply_local`` and ``apply_controlled`` methods used by ``squanch.gates``.
+
+        :param np.array operator: the unitary N-qubit operator to apply
+        '''
+        self._apply_contiguous(operator, 0, self.num_qubits)
+
+    def apply_local(self, operator, qubit_indices, cache_id = None):
+        '''
+        Apply a k-qubit operator to a subset of qubits. Non-adjacent qubits are routed next to each other with SWAP
+        operations, which are undone afterwards.
+
+        :param np.array operator: the 2^k x 2^k operator, acting on the qubits in the order given
+        :param [int] qubit_indices: the k qubit indices to act on
+        :param str cache_id: unused; accepted for compatibility with ``QSystem.apply_local``
+        '''
+        qubit_indices = list(qubit_indices)
+        k = len(qubit_indices)
+        if k == 1:
+            site = qubit_indices[0]
+            self._set(site, np.einsum("pq,aqb->apb", operator, self._get(site)))
+            return
+        # Move the qubits onto consecutive sites, in the order given, starting at the lowest of them
+        start = min(qubit_indices)
+        layout = list(range(self.num_qubits))
+        swaps = []
+        for offset, qubit in enumerate(qubit_indices):
+            site = layout.index(qubit)
+            while site > start + offset:
+                self._apply_contiguous(_SWAP, site - 1, 2)
+                layout[site - 1], layout[site] = layout[site], layout[site - 1]
+                swaps.append(site - 1)
+                site -= 1
+        self._apply_contiguous(operator, start, k)
+        for site in reversed(swaps):
+            self._apply_contiguous(_SWAP, site, 2)
+
+    def apply_controlled(self, unitary, controls, target, cache_id = None, control_states = None):
+        '''
+        Apply a unitary to one or more target qubits, conditioned on the control qubits being |1> (or the states given
+        by ``control_states``)
+
+        :param np.array unitary: the 2^k x 2^k unitary to apply to the targets
+        :param [int] controls: the indices of the control qubits
+        :param int|[int] target: the index of the target qubit, or a list of k target indices
+        :param str cache_id: unused; accepted for compatibility with ``QSystem.apply_controlled``
+        :param [int] control_states: the value (0 or 1) each control must have; default: all 1
+        '''
+        targets = [target] if np.ndim(target) == 0 else list(target)
+        operator = linalg.controlled_operator(unitary, len(controls), control_states)
+        self.apply_local(operator, list(controls) + targets)
+
+    def _weights(self, index):
+        '''
+        Compute the unnormalized weights <psi|P0|psi> and <psi|P1|psi> of the outcomes of measuring a qubit. The
+        orthogonality center is moved to the qubit, so the weights are read from its site tensor alone.
+
+        :param int index: the qubit to measure
+        :return: array of the two outcome weights
+        '''
+        self._move_center(index)
+        tensor = self._get(index)
+        return np.sum(np.abs(tensor) ** 2, axis = (0, 2))
+
+    def probabilities(self, qubit_indices, basis = None):
+        '''
+        Compute the computational-basis outcome distribution of a subset of qubits without modifying the state, by
+        contracting the MPS with itself while keeping an outcome axis for each measured site
+
+        :param [int] qubit_indices: the qubits to read; outcomes use the first index as the most significant bit
+        :param np.array|[np.array] basis: optional basis change applied before reading the distribution; either a
+                                          single 2x2 unitary used for every qubit or a list of one per qubit
+        :return: an array of the 2^k outcome probabilities
+        '''
+        qubit_indices = list(qubit_indices)
+        if basis is not None and not isinstance(basis, (list, tuple)):
+            basis = [basis] * len(qubit_indices)
+        measured = sorted(qubit_indices)
+        environments = np.ones((1, 1, 1), dtype = np.complex128)
+        for site in range(self.num_qubits):
+            tensor = self._get(site)
+            if site not in measured:
+                environments = np.einsum("xab,asc,bsd->xcd", environments, tensor, tensor.conj())
+                continue
+            unitary = None if basis is None else basis[qubit_indices.index(site)]
+            if unitary is not None:
+                tensor = np.einsum("pq,aqb->apb", unitary, tensor)
+            environments = np.einsum("xab,asc,bsd->xscd", environments, tensor, tensor.conj())
+            environments = environments.reshape((-1,) + environments.shape[2:])
+        weights = np.clip(np.real(environments[:, 0, 0]), 0, None).reshape((2,) * len(measured))
+        weights = weights.transpose([measured.index(q) for q in qubit_indices]).ravel()
+        return weights / np.sum(weights)
+
+    def measure_qubit(self, index):
+        '''
+        Measure the qubit at a given index, collapsing the MPS based on the observed qubit value
+
+        :param int index: the qubit to measure
+        :return: the measured qubit value
+        '''
+        weights = np.clip(self._weights(index), 0, None)
+        prob0 = weights[0] / np.sum(weights)
+        outcome = 0 if rng.current_stream().rand() <= prob0 else 1
+        tensor = self._get(index)
+        tensor[:, 1 - outcome, :] = 0
+        self._set(index, tensor / np.sqrt(weights[outcome]))
+        return outcome
+
+    def to_statevector(self):
+        '''
+        Contract the MPS into a dense state vector. This allocates 2^num_qubits entries and is intended for
+        inspecting small systems.
+
+        :return: the dense state vector
+        '''
+        psi = self._get(0)
+        for site in range(1, self.num_qubits):
+            psi = np.tensordot(psi, self._get(site), axes = (-1, 0))
+        return psi.reshape(2 ** self.num_qubits)
+
+
+class MPSQStream(QStream):
+    '''
+    A ``QStream`` of matrix product state systems, stored in a contiguous block of shared memory so that agents in
+    separate processes can operate on them exactly as they do on dense streams.
+    '''
+
+    def __init__(self, system_size, num_systems, max_bond_dimension = 16, cutoff = 1e-10, array = None, agent = None):
+        '''
+        Instantiate the MPS datastream object
+
+        :param int system_size: number of qubits in each quantum system
+        :param int num_systems: number of quantum systems in the data stream
+        :param int max_bond_dimension: maximum bond dimension chi of each system's MPS
+        :param float cutoff: maximum fraction of a state's weight discarded when truncating singular values
+        :param np.array array: pre-allocated MPS storage for purposes of sharing streams in multiprocessing
+        :param Agent agent: optional reference to the Agent owning the qstream
+        '''
+        self.cutoff = cutoff
+        if array is None:
+            array = MPSQStream.shared_mps_space(system_size, num_systems, max_bond_dimension)
+        self.max_bond_dimension = _bond_dimension(array.shape[2])
+        QStream.__init__(self, system_size, num_systems, array = array, agent = agent, use_density_matrix = False)
+
+    @classmethod
+    def from_array(cls, array, reformat = False, agent = None, use_density_matrix = False, cutoff = 1e-10):
+        '''
+        Instantiates an MPS datastream object from existing MPS storage
+
+        :param np.array array: the num_systems x system_size x (2 chi^2 + 1) storage array
+        :param bool reformat: whether to reformat the storage to the all-zero state
+        :param Agent agent: optional reference to the Agent owning the qstream
+        :param bool use_density_matrix: unused; MPS streams always hold pure states
+        :param float cutoff: maximum fraction of a state's weight discarded when truncating singular values
+        :return: the MPS stream
+        '''
+        qstream = cls(array.shape[1], array.shape[0], cutoff = cutoff, array = array, agent = agent)
+        if reformat:
+            MPSQStream.reformat(qstream.state)
+        return qstream
+
+    @staticmethod
+    def reformat(array, use_density_matrix = False):
+        '''
+        Reformats MPS storage in-place to the all-zero state
+
+        :param np.array array: the num_systems x system_size x (2 chi^2 + 1) storage array
+        :param bool use_density_matrix: unused; MPS streams always hold pure states
+        '''
+        MPSQSystem.reformat(array)
+
+    @staticmethod
+    def shared_mps_space(system_size, num_systems, max_bond_dimension):
+        '''
+        Allocate shareable c-type memory for the MPS storage of a stream
+
+        :param int system_size: number of qubits in each quantum system
+        :param int num_systems: number of quantum systems in the data stream
+        :param int max_bond_dimension: maximum bond dimension chi of each system's MPS
+        :return: a num_systems x system_size x (2 chi^2 + 1) array of np.complex64 values in the all-zero state
+        '''
+        site_size = _site_size(max_bond_dimension)
+        mallocced = sharedctypes.RawArray(ctypes.c_double, num_systems * system_size * site_size)
+        array = np.frombuffer(mallocced, dtype = np.complex64).reshape((num_systems, system_size, site_size))
+        MPSQStream.reformat(array)
+        return array
+
+    def allocate_like(self):
+        '''
+        Allocate a new MPS stream with its own shared storage and the same layout as this one, in the all-zero state
+
+        :return: the new stream
+        '''
+        return MPSQStream(self.system_size, self.num_systems, max_bond_dimension = self.max_bond_dimension,
+                          cutoff = self.cutoff)
+
+    def view(self, agent = None):
+        '''
+        Instantiate another MPS stream object sharing this stream's storage
+
+        :param Agent agent: optional reference to the Agent owning the new stream object
+        :return: the new stream object
+        '''
+        return MPSQStream.from_array(self.state, agent = agent, cutoff = self.cutoff)
+
+    def system(self, index):
+        '''
+        Access the nth MPS system in the stream. Views are cached per index like ``QStream.system``.
+
+        :param int index: zero-index of the quantum system to access
+        :return: the MPS system
+        '''
+        qsystem = self._systems.get(index)
+        if qsystem is None:
+            qsystem = MPSQSystem.from_stream(self, index)
+            self._systems[index] = qsystem
+        return qsystem
+
+    def promote(self, chunk_size = None):
+        '''
+        MPS streams always hold pure states and cannot be converted to density matrices, so adaptive
+        (``use_density_matrix = "auto"``) storage is not supported for them
+
+        :raises TypeError: always
+        '''
+        raise TypeError("MPS streams hold pure states and cannot be promoted to density matrices")
+
+    def _selected(self, where):
+        '''
+        The indices of the systems selected by a classical-control mask; see ``QStream._selections()``
+
+        :param np.array where: a num_systems boolean mask or integer outcome array, or None to select every system
+        :return: the selected system indices
+        '''
+        if where is None:
+            return range(self.num_systems)
+        return np.flatnonzero(np.broadcast_to(np.asarray(where), (self.num_systems,)))
+
+    def apply_local(self, operator, qubit_indices, cache_id = None, where = None, chunk_size = None):
+        '''
+        Apply a k-qubit operator to a subset of the qubits of every system, or of the systems selected by ``where``,
+        one MPS at a time
+
+        :param np.array operator: the 2^k x 2^k operator, acting on the qubits in the order given
+        :param [int] qubit_indices: the k qubit indices to act on
+        :param str cache_id: unused; accepted for compatibility with ``QStream.apply_local``
+        :param np.array where: a num_systems boolean mask or integer outcome array; the operator is applied only to
+                               the systems where it is nonzero. Default: every system
+        :param int chunk_size: unused; MPS systems are updated one at a time
+        '''
+        qubit_indices = list(qubit_indices)
+        for index in self._selected(where):
+            self.system(index).apply_local(operator, qubit_indices)
+
+    def apply_controlled(self, unitary, controls, target, cache_id = None, control_states = None, where = None,
+                         chunk_size = None):
+        '''
+        Apply a controlled unitary to every system, or to the systems selected by ``where``, one MPS at a time; see
+        ``MPSQSystem.apply_controlled()``
+
+        :param np.array unitary: the 2^k x 2^k unitary to apply to the targets
+        :param [int] controls: the indices of the control qubits
+        :param int|[int] target: the index of the target qubit, or a list of k target indices
+        :param str cache_id: unused; accepted for compatibility with ``QStream.apply_controlled``
+        :param [int] control_states: the value (0 or 1) each control must have; default: all 1
+        :param np.array where: a num_systems boolean mask or integer outcome array; the gate is applied only to the
+                               systems where it is nonzero. Default: every system
+        :param int chunk_size: unused; MPS systems are updated one at a time
+        '''
+        for index in self._selected(where):
+            self.system(index).apply_controlled(unitary, controls, target, control_states = control_states)
+
+    def sample(self, qubit_indices, shots, basis = None, chunk_size = None):
+        '''
+        Sample repeated measurements of a subset of qubits for every system in the stream without collapsing any
+        states; see ``QStream.sample()``. Each system's distribution is read with ``MPSQSystem.probabilities()``.
+
+        :param [int] qubit_indices: the qubits to sample; outcomes use the first index as the most significant bit
+        :param int shots: the number of measurement shots to draw per system
+        :param np.array|[np.array] basis: optional 2x2 basis-change unitary (or list of one per qubit) applied before
+                                          measuring
+        :param int chunk_size: unused; MPS systems are read one at a time
+        :return: a num_systems x 2^k array of outcome counts
+        '''
+        probs = np.array([self.system(index).probabilities(qubit_indices, basis = basis)
+                          for index in range(self.num_systems)])
+        return rng.current_stream().multinomial(shots, probs)
+
+    def _collapse(self, qubit_indices, chunk_size = None):
+        '''
+        Measure a set of qubits of every system in the computational basis, one qubit at a time, collapsing the MPS.
+        ``QStream._measure()`` reports these outcomes with the noise model's readout error.
+
+        :param [int] qubit_indices: the qubits to measure
+        :param int chunk_size: unused; MPS systems are measured one at a time
+        :return: a num_systems x k uint8 array of outcomes, in the order of ``qubit_indices``
+        '''
+        qubit_indices = list(qubit_indices)
+        outcomes = np.zeros((self.num_systems, len(qubit_indices)), dtype = np.uint8)
+        for index in range(self.num_systems):
+            qsystem = self.system(index)
+            outcomes[index] = [qsystem.measure_qubit(q) for q in qubit_indices]
+        return outcomes
+
+    def _apply_per_system(self, qubit_index, operators, chunk_size = None):
+        '''
+        Apply a different single-qubit operator to one qubit of each system
+
+        :param int qubit_index: the qubit to act on
+        :param np.array operators: a num_systems x 2 x 2 array of operators
+        :param int chunk_size: unused; MPS systems are updated one at a time
+        '''
+        for index in range(self.num_systems):
+            self.system(index).apply_local(operators[index], [qubit_index])
+
+    def _apply_paulis(self, qubit_index, x, z, chunk_size = None):
+        '''
+        Apply Z^z X^x to one qubit of every system, with the exponents chosen per system
+
+        :param int qubit_index: the qubit to act on
+        :param np.array x: a num_systems array of X exponents (0 or 1)
+        :param np.array z: a num_systems array of Z exponents (0 or 1)
+        :param int chunk_size: unused; MPS systems are updated one at a time
+        '''
+        flips = np.array([[[1, 0], [0, 1]], [[0, 1], [1, 0]]])[np.asarray(x, dtype = np.int64)]
+        phases = np.array([[[1, 0], [0, 1]], [[1, 0], [0, -1]]])[np.asarray(z, dtype = np.int64)]
+        self._apply_per_system(qubit_index, np.matmul(phases, flips))
+
+    def measure_in_basis(self, qubit_index, bases, chunk_size = None):
+        '''
+        Measure one qubit of every system, each in its own basis; see ``QStream.measure_in_basis()``. Each qubit is
+        rotated into the computational basis, measured and rotated back, leaving it in the observed basis state.
+
+        :param int qubit_index: the qubit to measure
+        :param str|int|np.array bases: a basis name ("Z", "X" or "Y") or code (0, 1 or 2) for every system, a
+                                       num_systems array of codes, or a 2x2 or num_systems x 2 x 2 array of
+                                       basis-change unitaries applied before measuring, as for ``sample()``
+        :param int chunk_size: unused; MPS systems are measured one at a time
+        :return: a num_systems uint8 array of outcomes
+        '''
+        changes = self._basis_changes(bases)
+        self._apply_per_system(qubit_index, changes)
+        outcomes = self._measure([qubit_index])[:, 0]
+        self._apply_per_system(qubit_index, np.conj(np.swapaxes(changes, 1, 2)))
+        return outcomes
+
+    def prepare_bell(self, i, j, which = "phi+", chunk_size = None):
+        '''
+        Apply the Bell-pair preparation circuit CNOT(i, j) H(i) to qubits i and j of every system, preparing a Bell
+        state from |00>; see ``QStream.prepare_bell()``
+
+        :param int i: the first qubit of the pair (the control)
+        :param int j: the second qubit of the pair (the target)
+        :param str|int|np.array which: the Bell state to prepare: "phi+", "psi+", "phi-" or "psi-", or the codes
+                                       0-3, or a num_systems array of codes
+        :param int chunk_size: unused; MPS systems are updated one at a time
+        '''
+        codes = _BELL_STATES.get(which, which) if isinstance(which, str) else which
+        self.apply_local(_BELL_CIRCUIT, [i, j])
+        codes = np.broadcast_to(np.asarray(codes), (self.num_systems,))
+        if np.any(codes != 0):
+            self._apply_paulis(j, codes & 1, codes >> 1)
+
+    def bell_measure(self, i, j, chunk_size = None):
+        '''
+        Measure qubits i and j of every system in the Bell basis; see ``QStream.bell_measure()``
+
+        :param int i: the first qubit
+        :param int j: the second qubit
+        :param int chunk_size: unused; MPS systems are measured one at a time
+        :return: a num_systems x 2 uint8 array of outcomes (m1, m2)
+        '''
+        self.apply_local(_BELL_CIRCUIT.conj().T, [i, j])
+        return self._measure([i, j])
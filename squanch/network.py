@@ -0,0 +1,142 @@
+import contextlib
+import inspect
+
+from squanch import channels
+from squanch.transport import Mailbox
+
+__all__ = ["Network", "default_network"]
+
+# The network joined by agents instantiated without an explicit network, set with Network.as_default()
+_default = None
+
+
+def default_network():
+    '''
+    The network joined by agents instantiated without an explicit ``network`` argument
+
+    :return: the ``Network``, or None if no default network is set
+    '''
+    return _default
+
+
+def accepts_queue(channel):
+    '''
+    Whether a channel model takes a ``queue`` argument, and so can be routed through a network's mailboxes
+
+    :param QChannel|CChannel channel: the channel model
+    :return: True if the channel accepts a queue
+    '''
+    parameters = inspect.signature(channel).parameters.values()
+    return any(p.name == "queue" or p.kind == inspect.Parameter.VAR_KEYWORD for p in parameters)
+
+
+class Network:
+    '''
+    A network topology in which every agent has a single inbound ``Mailbox``. Channels connecting agents of the same
+    network deliver to the receiving agent's mailbox, with each message tagged by its channel kind and source agent,
+    so the number of queues (and their file descriptors and feeder threads) grows with the number of agents rather
+    than the number of links. Channel models are unchanged: each link is still a ``QChannel`` or ``CChannel`` whose
+    length sets the arrival time, and whose errors are applied by the receiving agent when it calls ``qrecv()``.
+
+    Agents join a network with ``Agent(..., network = network)`` or ``network.add(agent)`` before they are connected;
+    links are then made as usual with ``Agent.qconnect()`` and ``Agent.cconnect()``, or all at once with
+    ``connect_all()``. Agents given no network join an implicit network of their own, and implicit networks are
+    merged as their agents are connected, so every protocol uses mailboxes unless ``Agent(..., network = False)``
+    asks for a queue per channel. Channel models must accept a ``queue`` argument, so socket channels are not routed
+    through mailboxes.
+    '''
+
+    def __init__(self, agents = (), mailboxes = None, tag = None, implicit = False):
+        '''
+        Instantiate the network
+
+        :param [Agent] agents: agents to add to the network
+        :param dict mailboxes: existing mailboxes to reuse, keyed by agent name; agents without one get a new mailbox
+        :param tag: a value added to the key of every channel, to keep apart the messages of successive networks
+                    built over the same mailboxes. Default: None (no tag)
+        :param bool implicit: whether the network was made for an agent given no network, and so may be merged into
+                              the network of an agent it is connected to. Default: False
+        '''
+        self.agents = []
+        self.mailboxes = {} if mailboxes is None else mailboxes
+        self.tag = tag
+        self.implicit = implicit
+        for agent in agents:
+            self.add(agent)
+
+    def __len__(self):
+        '''
+        The number of agents in the network
+        '''
+        return len(self.agents)
+
+    def add(self, agent):
+        '''
+        Add an agent to the network, creating its mailbox. The agent should not yet be connected to other agents.
+
+        :param Agent agent: the agent to add
+        '''
+        if any(other.name == agent.name for other in self.agents):
+            raise ValueError("The network already has an agent named " + agent.name)
+        self.agents.append(agent)
+        if agent.name not in self.mailboxes:
+            self.mailboxes[agent.name] = Mailbox()
+        agent.network = self
+
+    def merge(self, other):
+        '''
+        Move the agents of another network into this one, along with their mailboxes, so that links between the two
+        groups are routed through mailboxes too. Channels already made in either network are unchanged.
+
+        :param Network other: the network to merge; none of its agents may share a name with an agent of this network
+        '''
+        names = set(agent.name for agent in self.agents)
+        if any(agent.name in names for agent in other.agents):
+            raise ValueError("Networks with agents of the same name cannot be merged")
+        for agent in other.agents:
+            self.agents.append(agent)
+            self.mailboxes[agent.name] = other.mailboxes[agent.name]
+            agent.network = self
+        other.agents = []
+
+    @contextlib.contextmanager
+    def as_default(self):
+        '''
+        Context manager which adds every agent instantiated inside the block without an explicit ``network`` argument
+        to this network
+        '''
+        global _default
+        previous = _default
+        _default = self
+        try:
+            yield self
+        finally:
+            _default = previous
+
+    def queue(self, from_agent, to_agent, kind):
+        '''
+        The transport for one direction of a link: a view of the receiving agent's mailbox, tagged by channel kind
+        and sending agent
+
+        :param Agent from_agent: the sending agent
+        :param Agent to_agent: the receiving agent
+        :param str kind: "q" for quantum channels, "c" for classical channels
+        :return: the ``MailboxQueue``
+        '''
+        key = (kind, from_agent.name) if self.tag is None else (kind, from_agent.name, self.tag)
+        return self.mailboxes[to_agent.name].endpoint(key)
+
+    def connect_all(self, qchannel = channels.QChannel, cchannel = channels.CChannel, **kwargs):
+        '''
+        Connect every pair of agents in the network with a quantum and a classical channel
+
+        :param QChannel qchannel: the quantum channel model to use, or None to make no quantum channels
+        :param CChannel cchannel: the classical channel model to use, or None to make no classical channels
+        :param \**kwargs: optional arguments for both channel models, e.g. ``length``
+        '''
+        for i, agent in enumerate(self.agents):
+            for other in self.agents[i + 1:]:
+                if qchannel is not None:
+                    agent.qconnect(other, qchannel, **kwargs)
+                if cchannel is not None:
+                    agent.cconnect(other, cchannel, **kwargs)
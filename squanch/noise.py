@@ -0,0 +1,203 @@
+import itertools
+
+import numpy as np
+
+from squanch import linalg, rng
+
+__all__ = ["NoiseModel"]
+
+# Single-qubit Pauli operators, used to build depolarizing channels
+_PAULIS = [np.eye(2), np.array([[0, 1], [1, 0]]), np.array([[0, -1j], [1j, 0]]), np.diag([1, -1])]
+
+# Relative eigenvalue cutoff below which Kraus operators of a fused channel are discarded
+_KRAUS_CUTOFF = 1e-12
+
+# Maximum number of fused channels cached per model; gates without a cache_id (e.g. rotations by arbitrary angles) are
+# cached by their operators, so the oldest channels are evicted beyond this
+_MAX_CACHED = 1024
+
+
+def _superoperator(kraus):
+    '''
+    Build the superoperator of a channel from its Kraus operators, acting on the vectorized (row bits, column bits)
+    representation of a density matrix
+
+    :param [np.array] kraus: the 2^k x 2^k Kraus operators
+    :return: the 4^k x 4^k superoperator
+    '''
+    return sum(np.kron(k, k.conj()) for k in kraus)
+
+
+def _canonical_kraus(superoperator):
+    '''
+    Recover a minimal set of Kraus operators from a superoperator via its Choi matrix
+
+    :param np.array superoperator: the 4^k x 4^k superoperator
+    :return: a list of at most 4^k Kraus operators
+    '''
+    dim = int(np.sqrt(superoperator.shape[0]))
+    # S[(r, c), (r', c')] = sum K[r, r'] K*[c, c']; regroup into the Choi matrix C[(r, r'), (c, c')]
+    choi = superoperator.reshape((dim, dim, dim, dim)).transpose(0, 2, 1, 3).reshape((dim * dim, dim * dim))
+    eigenvalues, eigenvectors = np.linalg.eigh(choi)
+    keep = eigenvalues > _KRAUS_CUTOFF * np.max(eigenvalues)
+    return [np.sqrt(value) * vector.reshape((dim, dim))
+            for value, vector in zip(eigenvalues[keep], eigenvectors.T[keep])]
+
+
+def _cache_key(operator, cache_id):
+    '''
+    The key to cache a gate's fused channel by: its ``cache_id`` if given, else its qubit count and operator bytes
+
+    :param np.array operator: the 2^k x 2^k ideal gate
+    :param str cache_id: the gate's cache identifier, or None
+    :return: the cache key
+    '''
+    if cache_id is not None:
+        return cache_id
+    operator = np.ascontiguousarray(operator, dtype = np.complex128)
+    return int(np.log2(operator.shape[0])), operator.tobytes()
+
+
+def _store(cache, key, value):
+    '''
+    Store a fused channel in a cache, evicting the oldest channel once the cache is full
+
+    :param dict cache: the cache
+    :param key: the cache key, from ``_cache_key()``
+    :param value: the fused channel
+    :return: the fused channel
+    '''
+    if len(cache) >= _MAX_CACHED:
+        del cache[next(iter(cache))]
+    cache[key] = value
+    return value
+
+
+class NoiseModel:
+    '''
+    Gate-level noise model. Each gate applied to a ``QSystem`` using this model is followed by a depolarizing channel
+    on the qubits it acts on (with separate single- and multi-qubit error rates) and amplitude damping on each of
+    those qubits, and measurement outcomes are flipped with a readout error probability.
+
+    The ideal gate and its noise channel are fused into a single channel and cached by the gate's ``cache_id`` (or
+    by the operator itself, for gates without one), so a noisy gate costs one contraction with the state. Density
+    matrices are updated with the fused superoperator; state vectors sample a quantum trajectory from the fused
+    channel's (minimal) set of Kraus operators.
+
+    A noise model is enabled by setting ``qstream.noise_model`` on a stream before its systems are accessed, or per
+    agent with ``Agent(..., noise_model = model)``.
+    '''
+
+    def __init__(self, one_qubit = 0.0, two_qubit = 0.0, damping = 0.0, readout = 0.0):
+        '''
+        Instantiate the noise model
+
+        :param float one_qubit: depolarizing probability after each single-qubit gate
+        :param float two_qubit: depolarizing probability (over all qubits involved) after each multi-qubit gate
+        :param float damping: amplitude damping probability applied to each qubit involved in a gate
+        :param float readout: probability that a measurement result is reported flipped
+        '''
+        self.one_qubit = one_qubit
+        self.two_qubit = two_qubit
+        self.damping = damping
+        self.readout = readout
+        self._superoperators = {}
+        self._kraus = {}
+
+    @property
+    def is_mixing(self):
+        '''
+        Whether the model's gate noise can turn pure states into mixed states, so that an adaptive ``QStream`` must
+        be promoted to density matrices. Readout errors are classical and do not count.
+        '''
+        return self.one_qubit > 0 or self.two_qubit > 0 or self.damping > 0
+
+    def kraus(self, num_qubits):
+        '''
+        Kraus operators of the noise channel which follows a gate on a given number of qubits
+
+        :param int num_qubits: the number of qubits the gate acts on
+        :return: a list of 2^k x 2^k Kraus operators
+        '''
+        p = self.one_qubit if num_qubits == 1 else self.two_qubit
+        dim = 2 ** num_qubits
+        depolarizing = []
+        for paulis in itertools.product(_PAULIS, repeat = num_qubits):
+            pauli = linalg.tensors(list(paulis))
+            depolarizing.append(np.sqrt(p / dim ** 2) * pauli)
+        depolarizing[0] = np.sqrt(1 - p + p / dim ** 2) * np.eye(dim)
+        gamma = self.damping
+        damping = [np.array([[1, 0], [0, np.sqrt(1 - gamma)]]), np.array([[0, np.sqrt(gamma)], [0, 0]])]
+        damping = [linalg.tensors(list(ops)) for ops in itertools.product(damping, repeat = num_qubits)]
+        return [np.dot(a, d) for a in damping for d in depolarizing]
+
+    def superoperator(self, operator, cache_id = None):
+        '''
+        The superoperator of an ideal gate followed by its noise channel
+
+        :param np.array operator: the 2^k x 2^k ideal gate
+        :param str cache_id: an identifier to cache the fused superoperator by; default: the operator's contents
+        :return: the 4^k x 4^k superoperator
+        '''
+        key = _cache_key(operator, cache_id)
+        if key in self._superoperators:
+            return self._superoperators[key]
+        num_qubits = int(np.log2(operator.shape[0]))
+        return _store(self._superoperators, key, _superoperator([np.dot(k, operator) for k in self.kraus(num_qubits)]))
+
+    def fused_kraus(self, operator, cache_id = None):
+        '''
+        A minimal set of Kraus operators for an ideal gate followed by its noise channel
+
+        :param np.array operator: the 2^k x 2^k ideal gate
+        :param str cache_id: an identifier to cache the fused Kraus operators by; default: the operator's contents
+        :return: a list of 2^k x 2^k Kraus operators
+        '''
+        key = _cache_key(operator, cache_id)
+        if key in self._kraus:
+            return self._kraus[key]
+        return _store(self._kraus, key, _canonical_kraus(self.superoperator(operator, cache_id)))
+
+    def apply(self, state, operator, qubit_indices, is_density, cache_id = None):
+        '''
+        Apply a gate and its noise channel to chosen qubits of a state. Any leading axes of the state are treated as
+        batch axes, as in ``linalg.apply_operator``.
+
+        :param np.array state: a (...) x 2^n state vector or (...) x 2^n x 2^n density matrix array
+        :param np.array operator: the 2^k x 2^k ideal gate, acting on the qubits in the order given
+        :param [int] qubit_indices: the k qubits to act on
+        :param bool is_density: whether the state is a density matrix
+        :param str cache_id: an identifier to cache the fused channel by
+        :return: the new state array
+        '''
+        dim = state.shape[-1]
+        num_qubits = int(np.log2(dim))
+        qubit_indices = list(qubit_indices)
+        if is_density:
+            batch = state.shape[:-2]
+            tensor = state.reshape((-1,) + (2,) * (2 * num_qubits))
+            axes = [1 + i for i in qubit_indices] + [1 + num_qubits + i for i in qubit_indices]
+            tensor = linalg._apply_to_axes(tensor, self.superoperator(operator, cache_id), axes)
+            return tensor.reshape(batch + (dim, dim)).astype(state.dtype, copy = False)
+        # Quantum trajectory: pick a Kraus branch with probability ||K psi||^2 and renormalize
+        batch = state.shape[:-1]
+        flat = state.reshape((-1, dim))
+        branches = np.array([linalg.apply_operator(flat, k, qubit_indices, False)
+                             for k in self.fused_kraus(operator, cache_id)])
+        weights = np.sum(np.abs(branches) ** 2, axis = 2)
+        thresholds = rng.current_stream().random(flat.shape[0]) * np.sum(weights, axis = 0)
+        choice = np.minimum(np.sum(np.cumsum(weights, axis = 0) < thresholds, axis = 0), len(branches) - 1)
+        chosen = branches[choice, np.arange(flat.shape[0])]
+        chosen /= np.sqrt(weights[choice, np.arange(flat.shape[0])])[:, np.newaxis]
+        return chosen.reshape(batch + (dim,)).astype(state.dtype, copy = False)
+
+    def readout_error(self, outcome):
+        '''
+        Apply the readout error to a measurement result
+
+        :param int outcome: the measured value
+        :return: the reported value
+        '''
+        if self.readout > 0 and rng.current_stream().rand() < self.readout:
+            return 1 - outcome
+        return outcome
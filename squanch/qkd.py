@@ -0,0 +1,231 @@
+import numpy as np
+
+__all__ = ["sift", "sample_positions", "reveal", "estimate_qber", "discard", "cascade", "binary_entropy",
+           "secure_key_length", "privacy_amplification"]
+
+# Block size of the first Cascade pass is about this constant divided by the QBER
+_CASCADE_BLOCK_CONSTANT = 0.73
+
+
+def _unpack(packed, num_bits):
+    '''
+    Unpack a packed bit array into a uint8 array of 0/1 values
+
+    :param np.array packed: the packed uint8 bit array, as produced by ``np.packbits``
+    :param int num_bits: the number of valid bits
+    :return: the num_bits array of bits
+    '''
+    return np.unpackbits(np.asarray(packed, dtype = np.uint8), count = num_bits)
+
+
+def sift(bits, bases, other_bases, num_bits):
+    '''
+    Sift a raw key, keeping only the bits measured (or prepared) in the same basis as the other party. All arguments
+    are packed bit arrays; the publicly compared bases are one bit per key bit (e.g. 0 for Z, 1 for X).
+
+    :param np.array bits: this party's packed raw key
+    :param np.array bases: this party's packed basis choices
+    :param np.array other_bases: the other party's packed basis choices
+    :param int num_bits: the number of raw key bits
+    :return: tuple of (packed sifted key, number of sifted bits)
+    '''
+    match = np.unpackbits(np.bitwise_xor(bases, other_bases), count = num_bits) == 0
+    sifted = _unpack(bits, num_bits)[match]
+    return np.packbits(sifted), len(sifted)
+
+
+def sample_positions(num_bits, sample_size, seed = None):
+    '''
+    Choose the random key positions which are disclosed to estimate the QBER. Both parties get the same positions by
+    using the same (public) seed.
+
+    :param int num_bits: the number of key bits
+    :param int sample_size: the number of positions to sample
+    :param int seed: seed shared by both parties
+    :return: a sorted array of key positions
+    '''
+    return np.sort(np.random.default_rng(seed).choice(num_bits, size = min(sample_size, num_bits), replace = False))
+
+
+def reveal(key, num_bits, positions):
+    '''
+    Extract the key bits at given positions, to disclose to the other party
+
+    :param np.array key: the packed key
+    :param int num_bits: the number of key bits
+    :param np.array positions: the positions to extract
+    :return: the packed extracted bits
+    '''
+    return np.packbits(_unpack(key, num_bits)[positions])
+
+
+def estimate_qber(key, num_bits, positions, revealed):
+    '''
+    Estimate the quantum bit error rate by comparing this party's key with bits disclosed by the other party
+
+    :param np.array key: this party's packed key
+    :param int num_bits: the number of key bits
+    :param np.array positions: the sampled positions, from ``sample_positions()``
+    :param np.array revealed: the other party's packed bits at those positions, from ``reveal()``
+    :return: the fraction of sampled bits which differ
+    '''
+    if len(positions) == 0:
+        return 0.0
+    ours = _unpack(key, num_bits)[positions]
+    theirs = np.unpackbits(np.asarray(revealed, dtype = np.uint8), count = len(positions))
+    return np.count_nonzero(ours != theirs) / len(positions)
+
+
+def discard(key, num_bits, positions):
+    '''
+    Remove disclosed bits from a key
+
+    :param np.array key: the packed key
+    :param int num_bits: the number of key bits
+    :param np.array positions: the positions to remove
+    :return: tuple of (packed remaining key, number of remaining bits)
+    '''
+    keep = np.ones(num_bits, dtype = bool)
+    keep[positions] = False
+    remaining = _unpack(key, num_bits)[keep]
+    return np.packbits(remaining), len(remaining)
+
+
+def _parities(prefixes, queries):
+    '''
+    Compute the parities of blocks of permuted key bits from prefix parities
+
+    :param np.array prefixes: a num_passes x (num_bits + 1) array of prefix parities of each pass's permuted key
+    :param np.array queries: a k x 3 array of (pass, start, end) block descriptors
+    :return: a length k uint8 array of block parities
+    '''
+    return prefixes[queries[:, 0], queries[:, 2]] ^ prefixes[queries[:, 0], queries[:, 1]]
+
+
+def _prefix_parities(bits, permutations):
+    '''Prefix parities of the key under each pass's permutation, with a leading zero column'''
+    prefixes = np.zeros((len(permutations), len(bits) + 1), dtype = np.uint8)
+    for i, permutation in enumerate(permutations):
+        prefixes[i, 1:] = np.bitwise_xor.accumulate(bits[permutation])
+    return prefixes
+
+
+def cascade(agent, peer, key, num_bits, qber, reference, passes = 4, seed = 0):
+    '''
+    Reconcile two nearly-equal keys with the Cascade protocol over the classical channel between two agents. The
+    ``reference`` party keeps its key and answers parity queries; the other party corrects its key to match.
+
+    Parity exchange is batched: each round sends the (pass, start, end) descriptors of every block currently being
+    examined in one message, and the reference party answers with one packed array of parities. All mismatched
+    blocks (including blocks of earlier passes affected by corrections) are binary-searched concurrently, so a pass
+    takes O(log block size) round trips instead of one per parity.
+
+    :param Agent agent: the agent running this side of the protocol
+    :param Agent peer: the other agent, connected with ``agent.cconnect(peer)``
+    :param np.array key: this party's packed key
+    :param int num_bits: the number of key bits
+    :param float qber: the estimated QBER, used to choose the initial block size
+    :param bool reference: whether this party holds the reference key and answers queries
+    :param int passes: the number of Cascade passes
+    :param int seed: seed for the block permutations, shared by both parties
+    :return: tuple of (packed reconciled key, number of parity bits disclosed)
+    '''
+    bits = _unpack(key, num_bits).copy()
+    rng = np.random.default_rng(seed)
+    permutations = [np.arange(num_bits)] + [rng.permutation(num_bits) for _ in range(passes - 1)]
+    leaked = 0
+    if reference:
+        prefixes = _prefix_parities(bits, permutations)
+        while True:
+            queries = agent.crecv(peer)
+            if queries is None:
+                return np.packbits(bits), leaked
+            agent.csend(peer, np.packbits(_parities(prefixes, queries)))
+            leaked += len(queries)
+
+    def ask(queries):
+        agent.csend(peer, queries)
+        return np.unpackbits(agent.crecv(peer), count = len(queries))
+
+    block_size = max(1, int(np.ceil(_CASCADE_BLOCK_CONSTANT / max(qber, 1e-6))))
+    blocks, reference_parities = [], []
+    for current in range(passes):
+        size = min(block_size * 2 ** current, num_bits)
+        starts = np.arange(0, num_bits, size)
+        top = np.stack([np.full(len(starts), current), starts, np.minimum(starts + size, num_bits)], axis = 1)
+        blocks.append(top)
+        reference_parities.append(ask(top))
+        leaked += len(top)
+        while True:
+            # Find every top-level block, in this and earlier passes, whose parity disagrees with the reference
+            prefixes = _prefix_parities(bits, permutations[:current + 1])
+            examined = np.concatenate(blocks)
+            mismatched = examined[_parities(prefixes, examined) != np.concatenate(reference_parities)]
+            if len(mismatched) == 0:
+                break
+            # Binary-search all mismatched blocks concurrently for an erroneous bit
+            active = mismatched.copy()
+            while True:
+                open_blocks = active[:, 2] - active[:, 1] > 1
+                if not np.any(open_blocks):
+                    break
+                halves = active[open_blocks].copy()
+                halves[:, 2] = (halves[:, 1] + halves[:, 2]) // 2
+                differs = ask(halves) != _parities(prefixes, halves)
+                leaked += len(halves)
+                searching = active[open_blocks]
+                searching[differs, 2] = halves[differs, 2]
+                searching[~differs, 1] = halves[~differs, 2]
+                active[open_blocks] = searching
+            errors = np.unique([permutations[p][start] for p, start, _ in active])
+            bits[errors] ^= 1
+    agent.csend(peer, None)
+    return np.packbits(bits), leaked
+
+
+def binary_entropy(p):
+    '''
+    The binary entropy function h(p) = -p log2(p) - (1-p) log2(1-p)
+
+    :param float p: the probability
+    :return: the entropy in bits
+    '''
+    if p <= 0 or p >= 1:
+        return 0.0
+    return -p * np.log2(p) - (1 - p) * np.log2(1 - p)
+
+
+def secure_key_length(num_bits, qber, leaked, security = 64):
+    '''
+    Estimate the length of secret key which can be distilled by privacy amplification, from the asymptotic BB84
+    bound n (1 - h(qber)) minus the bits disclosed during reconciliation and a security margin
+
+    :param int num_bits: the number of reconciled key bits
+    :param float qber: the estimated QBER
+    :param int leaked: the number of bits disclosed during reconciliation
+    :param int security: additional bits to remove as a security margin
+    :return: the number of secret bits, at least 0
+    '''
+    return max(0, int(np.floor(num_bits * (1 - binary_entropy(qber)) - leaked - security)))
+
+
+def privacy_amplification(key, num_bits, output_bits, seed):
+    '''
+    Compress a reconciled key with a random Toeplitz hash, computed as a convolution with FFTs in O(n log n) time.
+    Both parties must use the same (public) seed to get the same hash.
+
+    :param np.array key: the packed reconciled key
+    :param int num_bits: the number of key bits
+    :param int output_bits: the length of the final key
+    :param int seed: seed for the random Toeplitz matrix, shared by both parties
+    :return: the packed final key
+    '''
+    if output_bits <= 0:
+        return np.packbits(np.zeros(0, dtype = np.uint8))
+    bits = _unpack(key, num_bits).astype(np.float64)
+    # The Toeplitz matrix T[i, j] = t[i - j + n - 1] is defined by its n + m - 1 diagonals
+    diagonals = np.random.default_rng(seed).integers(0, 2, num_bits + output_bits - 1).astype(np.float64)
+    size = 1 << int(np.ceil(np.log2(len(diagonals) + num_bits)))
+    convolution = np.fft.irfft(np.fft.rfft(diagonals, size) * np.fft.rfft(bits, size), size)
+    hashed = np.rint(convolution[num_bits - 1:num_bits - 1 + output_bits]).astype(np.int64) % 2
+    return np.packbits(hashed.astype(np.uint8))
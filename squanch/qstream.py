@@ -1,10 +1,31 @@
 import ctypes
+import os
+import weakref
+
 import numpy as np
 from multiprocessing import sharedctypes
 
-from squanch import qubit, linalg
+from squanch import analysis, qubit, linalg, rng
+
+__all__ = ["QStream", "RaggedQStream"]
+
+# Bell states by name, as codes 2x + y for |beta_xy> = CNOT (H x I) |x y>
+_BELL_STATES = {"phi+": 0, "psi+": 1, "phi-": 2, "psi-": 3}
+
+# CNOT (H x I), mapping |x y> to the Bell state |beta_xy>
+_BELL_CIRCUIT = np.array([[1, 0, 1, 0],
+                          [0, 1, 0, 1],
+                          [0, 1, 0, -1],
+                          [1, 0, -1, 0]]) / np.sqrt(2)
 
-__all__ = ["QStream"]
+# Measurement bases by name, as codes indexing _BASIS_CHANGES
+_BASES = {"Z": 0, "X": 1, "Y": 2}
+
+# Basis changes U applied before a computational basis measurement to measure in the Z, X and Y bases, as for the
+# ``basis`` argument of ``sample()``; outcome b reads the basis state U^dagger|b>
+_BASIS_CHANGES = np.array([[[1, 0], [0, 1]],
+                           [[1 / np.sqrt(2), 1 / np.sqrt(2)], [1 / np.sqrt(2), -1 / np.sqrt(2)]],
+                           [[1 / np.sqrt(2), -1j / np.sqrt(2)], [1 / np.sqrt(2), 1j / np.sqrt(2)]]])
 
 
 def zero_state(system_size, num_systems, use_density_matrix = True):
@@ -35,7 +56,8 @@ class QStream:
     ``QSystem``s and ``Qubit``s can be instantiated from the ``state`` of this class.
     '''
 
-    def __init__(self, system_size, num_systems, array = None, agent = None, use_density_matrix = True):
+    def __init__(self, system_size, num_systems, array = None, agent = None, use_density_matrix = True,
+                 packed = False):
         '''
         Instantiate the quantum datastream object
 
@@ -44,29 +66,68 @@ class QStream:
         :param np.array array: pre-allocated array in memory for purposes of sharing QStreams in multiprocessing
         :param Agent agent: optional reference to the Agent owning the qstream; useful for progress monitoring across
                             separate processes
+        :param bool|str use_density_matrix: whether systems are density matrices or state vectors, or "auto" to start
+                                            with state vectors and ``promote()`` the stream to density matrices only
+                                            once a mixing noise or memory model is set on it
+        :param bool packed: whether to store density matrices in Hermitian-packed form, using half the memory; the
+                            ``state`` is then a ``linalg.HermitianPackedArray``. Requires density matrices (or "auto").
         '''
         self.system_size = system_size  # number of qubits per system
         self.num_systems = num_systems  # number of disjoint quantum subsystems
         self.agent = agent
+        self.adaptive = use_density_matrix == "auto"
+        if self.adaptive:
+            use_density_matrix = array is not None and array.ndim == 3
         self.use_density_matrix = use_density_matrix
+        self.packed = packed or isinstance(array, linalg.HermitianPackedArray)
+        assert use_density_matrix or self.adaptive or not self.packed, "Packed storage requires density matrices"
+        # Streams sharing this stream's state array (including itself), which are promoted together
+        self._views = weakref.WeakSet([self])
+        # The process which allocated the state array; only it can promote the stream in place of a shared array
+        self._owner = os.getpid()
+        self._noise_model = None
         # Generate the matrix representation of the overall state of the quantum stream
         if array is not None:
+            if self.packed and use_density_matrix and not isinstance(array, linalg.HermitianPackedArray):
+                array = linalg.HermitianPackedArray(array)
             self.state = array
         else:
-            self.state = QStream.shared_hilbert_space(system_size, num_systems)
+            self.state = QStream.shared_hilbert_space(system_size, num_systems, use_density_matrix = use_density_matrix,
+                                                      packed = packed)
 
         # The "head" of the stream; what qsystem is being processed at the moment
         self.index = 0
 
+        # Cache of QSystem views by stream index; views are dropped once nothing references them
+        self._systems = weakref.WeakValueDictionary()
+
+    def __getstate__(self):
+        '''
+        Streams are pickled (e.g. when agent processes are spawned rather than forked) without their caches of views
+        and systems
+        '''
+        state = self.__dict__.copy()
+        state.update(_views = None, _systems = None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._views = weakref.WeakSet([self])
+        self._systems = weakref.WeakValueDictionary()
+
     def __iter__(self):
         '''
-        Iterates over the ``QSystem``s in this class instance
+        Iterates over the ``QSystem``s in this class instance, starting from the stream head ``self.index`` (e.g. as
+        restored from a checkpoint) and advancing it. A loop which runs to completion rewinds the head to 0.
 
         :return: each system in the stream
         '''
-        for i in range(self.num_systems):
+        while self.index < self.num_systems:
+            i = self.index
             if self.agent: self.agent.update_progress(i)
+            self.index = i + 1
             yield self.system(i)
+        self.index = 0
 
     def __len__(self):
         '''
@@ -77,59 +138,528 @@ class QStream:
         return self.num_systems
 
     @classmethod
-    def from_array(cls, array, reformat = False, agent = None, use_density_matrix = True):
+    def from_array(cls, array, reformat = False, agent = None, use_density_matrix = True, packed = False):
         '''
         Instantiates a quantum datastream object from an existing state array
 
-        :param np.array array: the pre-allocated np.complex64 array representing the shared Hilbert space
+        :param np.array array: the pre-allocated np.complex64 array representing the shared Hilbert space, or a
+                               ``linalg.HermitianPackedArray``
         :param bool reformat: if providing a pre-allocated array, whether to reformat it to the all-zero state
+        :param bool packed: whether a raw real array holds Hermitian-packed density matrices
         :return: the child QStream
         '''
         num_systems = array.shape[0]
         system_size = int(np.log2(array.shape[1]))
-        qstream = cls(system_size, num_systems, array = array, agent = agent, use_density_matrix = use_density_matrix)
+        qstream = cls(system_size, num_systems, array = array, agent = agent, use_density_matrix = use_density_matrix,
+                      packed = packed)
         if reformat:
-            qstream.reformat(qstream.state, use_density_matrix = use_density_matrix)
+            qstream.reformat(qstream.state, use_density_matrix = qstream.use_density_matrix)
         return qstream
 
+    @property
+    def noise_model(self):
+        '''
+        Gate-level noise model passed on to the QSystems of this stream; see ``squanch.noise.NoiseModel``. Setting a
+        mixing model on an adaptive stream promotes it to density matrices.
+        '''
+        return self._noise_model
+
+    @noise_model.setter
+    def noise_model(self, model):
+        self._noise_model = model
+        if self.adaptive and model is not None and model.is_mixing:
+            self.promote()
+
+    def view(self, agent = None):
+        '''
+        Instantiate another stream object sharing this stream's state array, e.g. for an agent's own copy
+
+        :param Agent agent: optional reference to the Agent owning the new stream object
+        :return: the new stream object
+        '''
+        stream = QStream.from_array(self.state, agent = agent, packed = self.packed,
+                                    use_density_matrix = "auto" if self.adaptive else self.use_density_matrix)
+        stream._views = self._views
+        stream._owner = self._owner
+        self._views.add(stream)
+        stream.noise_model = self.noise_model
+        return stream
+
+    def promote(self, chunk_size = None):
+        '''
+        Convert an adaptive stream from state vectors to density matrices, e.g. before a mixing operation. A new
+        shared array is allocated and filled with the outer products of the state vectors in chunks, and every view
+        of the stream is pointed at it. This does nothing if the stream already holds density matrices.
+
+        Promotion replaces the shared array, so it must happen in the process which allocated the stream, before
+        agent processes are started; setting a mixing ``noise_model`` or ``memory_model`` when constructing an
+        ``Agent`` does this automatically. A promotion in any other process would allocate an array private to it, so
+        it raises an error instead. ``QSystem`` and ``Qubit`` objects obtained before promotion refer to the old state
+        vectors and should be fetched again.
+
+        :param int chunk_size: number of systems to convert at a time; if None, picked to keep the working set near
+                               ``analysis.CHUNK_BYTES``
+        '''
+        if self.use_density_matrix:
+            return
+        if os.getpid() != self._owner:
+            raise RuntimeError("An adaptive stream can only be promoted by the process which allocated it, before "
+                               "agent processes are started; promote it there with qstream.promote()")
+        dim = 2 ** self.system_size
+        array = QStream.shared_hilbert_space(self.system_size, self.num_systems, packed = self.packed)
+        if chunk_size is None:
+            chunk_size = max(1, analysis.CHUNK_BYTES // (4 * dim * dim * array.dtype.itemsize))
+        for window in self._windows(chunk_size):
+            vectors = self.state[window]
+            array[window] = np.einsum("ai,aj->aij", vectors, vectors.conj())
+        for stream in list(self._views):
+            stream.attach(array)
+
+    def attach(self, array):
+        '''
+        Point this stream at a different state array of the same layout, such as a memory-mapped checkpoint, discarding
+        any cached ``QSystem`` views of the previous array
+
+        :param np.array array: the new num_systems x 2^system_size (x 2^system_size) state array
+        '''
+        if self.adaptive:
+            self.use_density_matrix = array.ndim == 3
+        if self.packed and self.use_density_matrix and not isinstance(array, linalg.HermitianPackedArray):
+            array = linalg.HermitianPackedArray(array)
+        self.state = array
+        self.num_systems = array.shape[0]
+        self._systems = weakref.WeakValueDictionary()
+
+    def reset(self):
+        '''
+        Reset every system of the stream to the all-zero state in place, e.g. to reuse its buffer for another run
+        '''
+        self.reformat(self.state, use_density_matrix = self.use_density_matrix)
+
+    def allocate_like(self):
+        '''
+        Allocate a new stream with its own shared buffer and the same layout as this one, in the all-zero state
+
+        :return: the new stream
+        '''
+        array = QStream.shared_hilbert_space(self.system_size, self.num_systems,
+                                             use_density_matrix = self.use_density_matrix, packed = self.packed)
+        return QStream.from_array(array, packed = self.packed,
+                                  use_density_matrix = "auto" if self.adaptive else self.use_density_matrix)
+
     @staticmethod
     def reformat(array, use_density_matrix = True):
         '''
         Reformats a Hilbert space array in-place to the all-zero state
 
-        :param np.array array: a num_systems x 2^system_size x 2^system_size array of np.complex64 values
+        :param np.array array: a num_systems x 2^system_size x 2^system_size array of np.complex64 values, or a
+                               ``linalg.HermitianPackedArray``
         '''
+        if isinstance(array, linalg.HermitianPackedArray):
+            array.packed[...] = 0
+            array.packed[:, 0, 0] = 1
+            return
         num_systems = array.shape[0]
         system_size = int(np.log2(array.shape[1]))
         array[...] = zero_state(system_size, num_systems, use_density_matrix = use_density_matrix)
 
     @staticmethod
-    def shared_hilbert_space(system_size, num_systems, use_density_matrix = True):
+    def shared_hilbert_space(system_size, num_systems, use_density_matrix = True, packed = False):
         '''
         Allocate a portion of shareable c-type memory to create a numpy array that is sharable between processes
 
         :param int system_size: number of entangled qubits in each quantum system; each has dimension 2^system_size
         :param int num_systems: number of small quantum systems in the data stream
-        :return: a blank, sharable, num_systems * 2^system_size * 2^system_size array of np.complex64 values
+        :param bool packed: whether to allocate Hermitian-packed (np.float32) density matrices
+        :return: a blank, sharable, num_systems * 2^system_size * 2^system_size array of np.complex64 values, or a
+                 ``linalg.HermitianPackedArray`` if ``packed``
         '''
         dim = 2 ** system_size
-        if use_density_matrix:
+        if packed and use_density_matrix:
+            mallocced = sharedctypes.RawArray(ctypes.c_float, num_systems * dim * dim)
+            array = linalg.HermitianPackedArray(np.frombuffer(mallocced, dtype = np.float32).reshape((num_systems, dim,
+                                                                                                    dim)))
+        elif use_density_matrix:
             mallocced = sharedctypes.RawArray(ctypes.c_double, num_systems * dim * dim)
             array = np.frombuffer(mallocced, dtype = np.complex64).reshape((num_systems, dim, dim))
         else:
             mallocced = sharedctypes.RawArray(ctypes.c_double, num_systems * dim)
             array = np.frombuffer(mallocced, dtype = np.complex64).reshape((num_systems, dim))
-        QStream.reformat(array)
+        QStream.reformat(array, use_density_matrix = use_density_matrix)
         return array
 
     def system(self, index):
         '''
-        Access the nth quantum system in the quantum datastream object
+        Access the nth quantum system in the quantum datastream object. Views are cached per index, so repeated
+        accesses to a system which is still referenced (e.g. by a qubit in an agent's quantum memory) reuse the same
+        ``QSystem`` object.
 
         :param int index: zero-index of the quantum system to access
         :return: the quantum system
         '''
-        return qubit.QSystem.from_stream(self, index, use_density_matrix = self.use_density_matrix)
+        qsystem = self._systems.get(index)
+        if qsystem is None:
+            if self.packed and self.use_density_matrix:
+                qsystem = qubit.PackedQSystem.from_stream(self, index)
+            else:
+                qsystem = qubit.QSystem.from_stream(self, index, use_density_matrix = self.use_density_matrix)
+            self._systems[index] = qsystem
+        return qsystem
+
+    @property
+    def num_qubits(self):
+        '''
+        The number of qubits in each system; the same as ``system_size``, matching ``QSystem.num_qubits`` so that
+        gates accept stream-level qubits
+        '''
+        return self.system_size
+
+    def qubit(self, index):
+        '''
+        Access a stream-level qubit: a ``Qubit`` whose parent is this stream rather than one system, so that gates
+        applied to it act on that qubit of every system at once (or only the systems selected with ``where=``), e.g.
+        ``X(qstream.qubit(2), where = outcomes)``. No ``QSystem`` objects are created.
+
+        :param int index: the index of the qubit within each system
+        :return: the stream-level qubit
+        '''
+        return qubit.Qubit(self, index)
+
+    def _selections(self, where, chunk_size = None):
+        '''
+        Iterate over the systems selected by a classical-control mask in chunks
+
+        :param np.array where: a num_systems boolean mask or integer (e.g. measurement outcome) array selecting the
+                               systems where it is nonzero; if None, every system is selected
+        :param int chunk_size: number of systems per chunk
+        :return: slices or index arrays into the system axis
+        '''
+        if where is None:
+            yield from self._windows(chunk_size)
+            return
+        selected = np.flatnonzero(np.broadcast_to(np.asarray(where), (self.num_systems,)))
+        if chunk_size is None:
+            chunk_size = max(1, analysis.CHUNK_BYTES // (4 * self.state[0].nbytes))
+        for start in range(0, len(selected), chunk_size):
+            yield selected[start:start + chunk_size]
+
+    def apply(self, operator, where = None, chunk_size = None):
+        '''
+        Apply an N-qubit operator to every system of the stream, or to the systems selected by ``where``, in batched
+        passes. This is the stream-level counterpart of ``QSystem.apply()``.
+
+        :param np.array operator: the unitary N-qubit operator to apply
+        :param np.array where: a num_systems boolean mask or integer outcome array; the operator is applied only to
+                               the systems where it is nonzero. Default: every system
+        :param int chunk_size: number of systems to process at once
+        '''
+        self.apply_local(operator, range(self.system_size), where = where, chunk_size = chunk_size)
+
+    def apply_local(self, operator, qubit_indices, cache_id = None, where = None, chunk_size = None):
+        '''
+        Apply a k-qubit operator to a subset of the qubits of every system, or of the systems selected by ``where``.
+        Selected systems are gathered with one fancy-indexed read per chunk, updated together and written back.
+
+        :param np.array operator: the 2^k x 2^k operator, acting on the qubits in the order given
+        :param [int] qubit_indices: the k qubit indices to act on
+        :param str cache_id: an identifier to cache the noisy gate by, if the stream has a noise model
+        :param np.array where: a num_systems boolean mask or integer outcome array; the operator is applied only to
+                               the systems where it is nonzero. Default: every system
+        :param int chunk_size: number of systems to process at once
+        '''
+        qubit_indices = list(qubit_indices)
+        for selection in self._selections(where, chunk_size):
+            states = self.state[selection]
+            if self.noise_model is not None:
+                states = self.noise_model.apply(states, operator, qubit_indices, self.use_density_matrix, cache_id)
+            else:
+                states = linalg.apply_operator(states, operator, qubit_indices, self.use_density_matrix)
+            self.state[selection] = states
+
+    def apply_controlled(self, unitary, controls, target, cache_id = None, control_states = None, where = None,
+                         chunk_size = None):
+        '''
+        Apply a controlled unitary to every system, or to the systems selected by ``where``; see
+        ``QSystem.apply_controlled()``
+
+        :param np.array unitary: the 2^k x 2^k unitary to apply to the targets
+        :param [int] controls: the indices of the control qubits
+        :param int|[int] target: the index of the target qubit, or a list of k target indices
+        :param str cache_id: an identifier to cache the noisy gate by, if the stream has a noise model
+        :param [int] control_states: the value (0 or 1) each control must have; default: all 1
+        :param np.array where: a num_systems boolean mask or integer outcome array; the gate is applied only to the
+                               systems where it is nonzero. Default: every system
+        :param int chunk_size: number of systems to process at once
+        '''
+        targets = [target] if np.ndim(target) == 0 else list(target)
+        if self.noise_model is not None:
+            local = linalg.controlled_operator(unitary, len(controls), control_states)
+            self.apply_local(local, list(controls) + targets, cache_id = cache_id, where = where,
+                             chunk_size = chunk_size)
+            return
+        for selection in self._selections(where, chunk_size):
+            states = np.ascontiguousarray(self.state[selection])
+            self.state[selection] = linalg.apply_controlled_operator(states, unitary, controls, targets,
+                                                                     self.use_density_matrix, control_states)
+
+    def measure_qubit(self, index, chunk_size = None):
+        '''
+        Measure a qubit of every system in the computational basis, collapsing the states in batch; this is what
+        ``Qubit.measure()`` calls for a stream-level qubit. Outcomes are reported with the noise model's readout error.
+
+        :param int index: the qubit to measure
+        :param int chunk_size: number of systems to process at once
+        :return: a num_systems uint8 array of outcomes
+        '''
+        return self._measure([index], chunk_size)[:, 0]
+
+    def sample(self, qubit_indices, shots, basis = None, chunk_size = None):
+        '''
+        Sample repeated measurements of a subset of qubits for every system in the stream without collapsing any
+        states. Each system's outcome distribution is read once (from the density matrix diagonal or the squared
+        amplitudes) and all of its shots are drawn in one multinomial call.
+
+        :param [int] qubit_indices: the qubits to sample; outcomes use the first index as the most significant bit
+        :param int shots: the number of measurement shots to draw per system
+        :param np.array|[np.array] basis: optional 2x2 basis-change unitary (or list of one per qubit) applied before
+                                          measuring; see ``analysis.probabilities``
+        :param int chunk_size: number of systems to process at once when computing the distributions
+        :return: a num_systems x 2^k array of outcome counts
+        '''
+        probs = analysis.probabilities(self.state, qubit_indices, basis = basis, chunk_size = chunk_size)
+        probs = np.clip(probs, 0, None)
+        probs /= np.sum(probs, axis = 1, keepdims = True)
+        return rng.current_stream().multinomial(shots, probs)
+
+    def _windows(self, chunk_size = None):
+        '''
+        Iterate over the system axis of the stream in chunks, bounding the temporary memory of batched operations
+
+        :param int chunk_size: number of systems per chunk; if None, picked to keep the working set near
+                               ``analysis.CHUNK_BYTES``
+        :return: slices into the system axis
+        '''
+        if chunk_size is None:
+            chunk_size = max(1, analysis.CHUNK_BYTES // (4 * self.state[0].nbytes))
+        for start in range(0, self.num_systems, chunk_size):
+            yield slice(start, min(start + chunk_size, self.num_systems))
+
+    def _apply_paulis(self, qubit_index, x, z, chunk_size = None):
+        '''
+        Apply Z^z X^x to one qubit of every system, with the exponents chosen per system, in one elementwise pass
+
+        :param int qubit_index: the qubit to act on
+        :param np.array x: a num_systems array of X exponents (0 or 1)
+        :param np.array z: a num_systems array of Z exponents (0 or 1)
+        :param int chunk_size: number of systems to process at once
+        '''
+        dim = 2 ** self.system_size
+        left, right = 2 ** qubit_index, dim // 2 ** (qubit_index + 1)
+        x = np.asarray(x, dtype = bool)
+        sign = 1 - 2 * np.asarray(z, dtype = np.int8)
+        for window in self._windows(chunk_size):
+            count = window.stop - window.start
+            if self.use_density_matrix:
+                # Rows and columns both take the (real) Pauli, i.e. P rho P^dagger
+                tensor = self.state[window].reshape((count, left, 2, right, left, 2, right))
+                shape = (count, 1, 1, 1, 1, 1)
+                axes = (2, 5)
+            else:
+                tensor = self.state[window].reshape((count, left, 2, right))
+                shape = (count, 1, 1)
+                axes = (2,)
+            flip, phase = x[window].reshape(shape), sign[window].reshape(shape)
+            for axis in axes:
+                zero, one = np.take(tensor, 0, axis = axis), np.take(tensor, 1, axis = axis)
+                tensor = np.stack([np.where(flip, one, zero), np.where(flip, zero, one) * phase], axis = axis)
+            self.state[window] = tensor.reshape((count,) + self.state.shape[1:])
+
+    def _measure(self, qubit_indices, chunk_size = None):
+        '''
+        Measure a set of qubits of every system in the computational basis, collapsing the states in batch, and report
+        the outcomes with the readout error of the stream's noise model
+
+        :param [int] qubit_indices: the qubits to measure
+        :param int chunk_size: number of systems to process at once
+        :return: a num_systems x k uint8 array of reported outcomes, in the order of ``qubit_indices``
+        '''
+        return self._readout(self._collapse(qubit_indices, chunk_size))
+
+    def _readout(self, outcomes):
+        '''
+        Flip measured values with the readout error probability of the stream's noise model, if any
+
+        :param np.array outcomes: a uint8 array of measured values
+        :return: the reported values
+        '''
+        if self.noise_model is None or self.noise_model.readout <= 0:
+            return outcomes
+        flips = rng.current_stream().random(outcomes.shape) < self.noise_model.readout
+        return outcomes ^ flips.astype(outcomes.dtype)
+
+    def _collapse(self, qubit_indices, chunk_size = None):
+        '''
+        Measure a set of qubits of every system in the computational basis, collapsing the states in batch. Outcome
+        distributions are computed for all systems, and all outcomes are drawn with a single random call. The actual
+        outcomes are returned, without readout error.
+
+        :param [int] qubit_indices: the qubits to measure
+        :param int chunk_size: number of systems to process at once
+        :return: a num_systems x k uint8 array of outcomes, in the order of ``qubit_indices``
+        '''
+        qubit_indices = list(qubit_indices)
+        k = len(qubit_indices)
+        probs = analysis.probabilities(self.state, qubit_indices, chunk_size = chunk_size)
+        cumulative = np.cumsum(probs, axis = 1)
+        draws = rng.current_stream().random(self.num_systems) * cumulative[:, -1]
+        codes = np.minimum(np.sum(cumulative < draws[:, np.newaxis], axis = 1), 2 ** k - 1)
+        probability = probs[np.arange(self.num_systems), codes]
+        # For each outcome code, which basis states of a system are consistent with it
+        basis = np.arange(2 ** self.system_size)
+        bits = [(basis >> (self.system_size - 1 - q)) & 1 for q in qubit_indices]
+        consistent = np.array([np.all([bits[i] == (code >> (k - 1 - i)) & 1 for i in range(k)], axis = 0)
+                               for code in range(2 ** k)])
+        for window in self._windows(chunk_size):
+            keep = consistent[codes[window]]
+            if self.use_density_matrix:
+                # The mask is symmetric, so it applies to packed matrices directly without unpacking them
+                target = self.state.packed if self.packed else self.state
+                scale = probability[window].reshape((-1, 1, 1))
+                target[window] *= (keep[:, :, np.newaxis] & keep[:, np.newaxis, :]) / scale
+            else:
+                self.state[window] *= keep / np.sqrt(probability[window])[:, np.newaxis]
+        outcomes = (codes[:, np.newaxis] >> np.arange(k - 1, -1, -1)) & 1
+        return outcomes.astype(np.uint8)
+
+    def _basis_changes(self, bases):
+        '''
+        Resolve per-system measurement bases to the basis-change unitaries applied before measuring in the
+        computational basis, the convention of ``sample()`` and ``analysis.probabilities()``
+
+        :param str|int|np.array bases: a basis name ("Z", "X" or "Y") or code (0, 1 or 2) for every system, a
+                                       num_systems array of codes, or a 2x2 or num_systems x 2 x 2 array of unitaries
+        :return: a num_systems x 2 x 2 array of unitaries
+        '''
+        bases = _BASES[bases] if isinstance(bases, str) else np.asarray(bases)
+        if np.ndim(bases) < 2:
+            bases = _BASIS_CHANGES[bases]
+        return np.broadcast_to(bases, (self.num_systems, 2, 2))
+
+    def _apply_per_system(self, qubit_index, operators, chunk_size = None):
+        '''
+        Apply a different single-qubit operator to one qubit of each system, in one batched pass over the stream
+
+        :param int qubit_index: the qubit to act on
+        :param np.array operators: a num_systems x 2 x 2 array of operators
+        :param int chunk_size: number of systems to process at once
+        '''
+        left, right = 2 ** qubit_index, 2 ** (self.system_size - qubit_index - 1)
+        for window in self._windows(chunk_size):
+            ops = operators[window]
+            count = len(ops)
+            if self.use_density_matrix:
+                rho = self.state[window].reshape((count, left, 2, right, left, 2, right))
+                rho = np.einsum("aij,aljrmks->alirmks", ops, rho)
+                rho = np.einsum("ank,alirmks->alirmns", ops.conj(), rho)
+                self.state[window] = rho.reshape((count,) + self.state.shape[1:])
+            else:
+                psi = self.state[window].reshape((count, left, 2, right))
+                self.state[window] = np.einsum("aij,aljr->alir", ops, psi).reshape((count, -1))
+
+    def measure_in_basis(self, qubit_index, bases, chunk_size = None):
+        '''
+        Measure one qubit of every system, each in its own basis, in one pass. Outcome probabilities are computed
+        analytically from the qubit's reduced density matrices in the chosen bases, all outcomes are drawn with a
+        single random call, and every state is collapsed onto the observed basis state with one batched projection.
+        Outcomes are reported with the noise model's readout error.
+
+        :param int qubit_index: the qubit to measure
+        :param str|int|np.array bases: a basis name ("Z", "X" or "Y") or code (0, 1 or 2) for every system, a
+                                       num_systems array of codes, or a 2x2 or num_systems x 2 x 2 array of
+                                       basis-change unitaries applied before measuring, as for ``sample()``
+        :param int chunk_size: number of systems to process at once
+        :return: a num_systems uint8 array of outcomes
+        '''
+        changes = self._basis_changes(bases)
+        rho = analysis.partial_trace(self, [qubit_index], chunk_size = chunk_size)
+        # Outcome b reads the basis state U^dagger|b>, the conjugate of row b of the basis change
+        one = changes[:, 1, :]
+        p1 = np.clip(np.real(np.einsum("ai,aij,aj->a", one, rho, one.conj())), 0, 1)
+        outcomes = (rng.current_stream().random(self.num_systems) < p1).astype(np.uint8)
+        probability = np.where(outcomes == 1, p1, 1 - p1)
+        # Project onto the observed basis state |v><v|, renormalizing in the same pass
+        v = changes[np.arange(self.num_systems), outcomes, :].conj()
+        projectors = np.einsum("ai,aj->aij", v, v.conj())
+        projectors /= np.sqrt(probability)[:, np.newaxis, np.newaxis]
+        self._apply_per_system(qubit_index, projectors, chunk_size)
+        return self._readout(outcomes)
+
+    def prepare(self, qubit_index, bits, bases, chunk_size = None):
+        '''
+        Encode one bit into one qubit of every system, each in its own basis (e.g. the sender side of BB84), in one
+        batched pass. The qubit must be in |0>, as it is after ``reformat()``; it is left in the basis state for its
+        bit, i.e. the state that ``measure_in_basis()`` in the same basis reads as that bit.
+
+        :param int qubit_index: the qubit to prepare
+        :param np.array bits: a num_systems array of bits to encode
+        :param str|int|np.array bases: the basis of each system, as for ``measure_in_basis()``
+        :param int chunk_size: number of systems to process at once
+        '''
+        changes = self._basis_changes(bases)
+        bits = np.broadcast_to(np.asarray(bits, dtype = np.int64), (self.num_systems,))
+        # U^dagger X^bit maps |0> to the basis state U^dagger|bit>
+        flips = np.array([[[1, 0], [0, 1]], [[0, 1], [1, 0]]])[bits]
+        self._apply_per_system(qubit_index, np.matmul(np.conj(np.swapaxes(changes, 1, 2)), flips), chunk_size)
+
+    def prepare_bell(self, i, j, which = "phi+", chunk_size = None):
+        '''
+        Apply the Bell-pair preparation circuit CNOT(i, j) H(i) to qubits i and j of every system, preparing a Bell
+        state from |00>. The fused two-qubit circuit is applied to the whole stream in one vectorized pass.
+
+        :param int i: the first qubit of the pair (the control)
+        :param int j: the second qubit of the pair (the target)
+        :param str|int|np.array which: the Bell state to prepare: "phi+", "psi+", "phi-" or "psi-", or the codes
+                                       0-3 (2x + y for |beta_xy>), or a num_systems array of codes to prepare a
+                                       different Bell state in each system
+        :param int chunk_size: number of systems to process at once
+        '''
+        codes = _BELL_STATES.get(which, which) if isinstance(which, str) else which
+        for window in self._windows(chunk_size):
+            self.state[window] = linalg.apply_operator(self.state[window], _BELL_CIRCUIT, [i, j],
+                                                       self.use_density_matrix)
+        codes = np.broadcast_to(np.asarray(codes), (self.num_systems,))
+        if np.any(codes != 0):
+            # |beta_xy> = (I x X^y Z^x) |beta_00>
+            self._apply_paulis(j, codes & 1, codes >> 1, chunk_size)
+
+    def bell_measure(self, i, j, chunk_size = None):
+        '''
+        Measure qubits i and j of every system in the Bell basis, by undoing the preparation circuit and measuring
+        both qubits in the computational basis. Outcomes (m1, m2) identify the Bell state |beta_{m1 m2}>, and are the
+        (Z, X) correction bits used by teleportation and entanglement swapping. Outcomes are reported with the noise
+        model's readout error.
+
+        :param int i: the first qubit
+        :param int j: the second qubit
+        :param int chunk_size: number of systems to process at once
+        :return: a num_systems x 2 uint8 array of outcomes (m1, m2)
+        '''
+        inverse = _BELL_CIRCUIT.conj().T
+        for window in self._windows(chunk_size):
+            self.state[window] = linalg.apply_operator(self.state[window], inverse, [i, j], self.use_density_matrix)
+        return self._measure([i, j], chunk_size)
+
+    def apply_pauli_correction(self, k, outcomes, chunk_size = None):
+        '''
+        Apply the Pauli correction Z^m1 X^m2 to qubit k of every system, with (m1, m2) taken per system from an
+        outcome array, e.g. to complete teleportation after ``bell_measure()``
+
+        :param int k: the qubit to correct
+        :param np.array outcomes: a num_systems x 2 array of (m1, m2) outcomes
+        :param int chunk_size: number of systems to process at once
+        '''
+        outcomes = np.asarray(outcomes)
+        self._apply_paulis(k, outcomes[:, 1], outcomes[:, 0], chunk_size)
 
     def next(self):
         '''
@@ -140,3 +670,477 @@ class QStream:
         sys = self.system(self.index)
         self.index += 1
         return sys
+
+
+class _RaggedState:
+    '''
+    Indexable view of the states of a ``RaggedQStream``: an integer index gives the state of that system (a view into
+    the shared buffer), and an array, mask or slice of systems of one size gives their stacked states
+    '''
+
+    __slots__ = ("stream",)
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    @property
+    def shape(self):
+        return (self.stream.num_systems,)
+
+    @property
+    def buffer(self):
+        '''The flat shared buffer holding every system's state'''
+        return self.stream.buffer
+
+    def _locate(self, item):
+        '''Resolve an index into (size class state array, index into it)'''
+        stream = self.stream
+        if np.ndim(item) == 0 and not isinstance(item, slice):
+            item = int(item)
+            return stream.classes[stream.system_sizes[item]].state, stream.positions[item]
+        indices = np.arange(stream.num_systems)[item]
+        sizes = np.unique(stream.system_sizes[indices])
+        if len(sizes) > 1:
+            raise IndexError("Systems of different sizes cannot be accessed together")
+        size = sizes[0] if len(sizes) else stream.sizes[0]
+        return stream.classes[size].state, stream.positions[indices]
+
+    def __getitem__(self, item):
+        array, position = self._locate(item)
+        return array[position]
+
+    def __setitem__(self, item, value):
+        array, position = self._locate(item)
+        array[position] = value
+
+
+class RaggedQStream:
+    '''
+    A stream of separable quantum systems of different sizes, e.g. single-qubit signals mixed with three-qubit
+    teleportation blocks, stored without padding every system to the largest size. All states live in one flat shared
+    buffer, grouped by size: the systems of each size form a contiguous size class, exposed as a regular ``QStream``
+    in ``classes[size]``, so every batched stream kernel runs on each size class at once. ``system_sizes`` and
+    ``offsets`` index each system's size and location in the buffer.
+
+    Systems keep their position in the stream, so ``system(i)``, iteration, ``next()``, agents and channels work as
+    with a ``QStream``. Stream-level gates and measurements act on every (selected) system at once, one size class
+    at a time, as do the batched measurement and preparation methods and the ``squanch.analysis`` helpers; every
+    selected system must have the qubits involved. An adaptive stream (``use_density_matrix = "auto"``) starts with
+    state vectors and is promoted to density matrices as a whole, one size class at a time, as a ``QStream`` is.
+    '''
+
+    def __init__(self, system_sizes, buffer = None, agent = None, use_density_matrix = True):
+        '''
+        Instantiate the ragged stream
+
+        :param [int] system_sizes: the number of qubits of each system, in stream order
+        :param np.array buffer: pre-allocated flat np.complex64 buffer for the states, for purposes of sharing streams
+                                in multiprocessing; default: a new shared buffer in the all-zero state
+        :param Agent agent: optional reference to the Agent owning the stream
+        :param bool|str use_density_matrix: whether systems are density matrices or state vectors, or "auto" to start
+                                            with state vectors and ``promote()`` the stream to density matrices only
+                                            once a mixing noise or memory model is set on it
+        '''
+        self.system_sizes = np.asarray(system_sizes, dtype = np.int64)
+        self.num_systems = len(self.system_sizes)
+        self.system_size = int(np.max(self.system_sizes)) if self.num_systems else 0  # largest system
+        self.agent = agent
+        self.adaptive = use_density_matrix == "auto"
+        if self.adaptive:
+            use_density_matrix = buffer is not None and buffer.size > np.sum(2 ** self.system_sizes)
+        self.use_density_matrix = use_density_matrix
+        self.packed = False
+        self._noise_model = None
+        # Streams sharing this stream's buffer (including itself) and the process which allocated it, as for QStream
+        self._views = weakref.WeakSet([self])
+        self._owner = os.getpid()
+        # Size classes are stored in increasing size order; positions index each system within its class
+        self.sizes, self._counts = np.unique(self.system_sizes, return_counts = True)
+        self.positions = np.empty(self.num_systems, dtype = np.int64)
+        for size in self.sizes:
+            members = self.system_sizes == size
+            self.positions[members] = np.arange(np.count_nonzero(members))
+        if buffer is None:
+            buffer = RaggedQStream.shared_buffer(self.system_sizes, use_density_matrix = use_density_matrix)
+        self.attach(buffer)
+        self.index = 0
+
+    def __getstate__(self):
+        '''
+        Streams are pickled without their caches of views and systems
+        '''
+        state = self.__dict__.copy()
+        state.update(_views = None, _systems = None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._views = weakref.WeakSet([self])
+        self._systems = weakref.WeakValueDictionary()
+
+    def __iter__(self):
+        '''
+        Iterates over the ``QSystem``s in this stream, in stream order, starting from the stream head ``self.index``
+        and advancing it. A loop which runs to completion rewinds the head to 0.
+
+        :return: each system in the stream
+        '''
+        while self.index < self.num_systems:
+            i = self.index
+            if self.agent: self.agent.update_progress(i)
+            self.index = i + 1
+            yield self.system(i)
+        self.index = 0
+
+    def __len__(self):
+        '''
+        The number of systems in the stream
+        '''
+        return self.num_systems
+
+    @staticmethod
+    def shared_buffer(system_sizes, use_density_matrix = True):
+        '''
+        Allocate a flat shared buffer for the states of a ragged stream, with each system in the all-zero state
+
+        :param [int] system_sizes: the number of qubits of each system
+        :param bool use_density_matrix: whether systems are density matrices or state vectors
+        :return: the np.complex64 buffer
+        '''
+        sizes = np.asarray(system_sizes, dtype = np.int64)
+        elements = 4 ** sizes if use_density_matrix else 2 ** sizes
+        mallocced = sharedctypes.RawArray(ctypes.c_double, int(np.sum(elements)))
+        buffer = np.frombuffer(mallocced, dtype = np.complex64)
+        # |0...0> (or its density matrix) has a single nonzero first element; systems are grouped by size
+        starts = np.concatenate([[0], np.cumsum(np.sort(elements))[:-1]])
+        buffer[starts.astype(np.int64)] = 1
+        return buffer
+
+    def reset(self):
+        '''
+        Reset every system of the stream to the all-zero state in place
+        '''
+        for stream in self.classes.values():
+            stream.reset()
+
+    def allocate_like(self):
+        '''
+        Allocate a new ragged stream with its own shared buffer and the same layout as this one, in the all-zero state
+
+        :return: the new stream
+        '''
+        buffer = RaggedQStream.shared_buffer(self.system_sizes, use_density_matrix = self.use_density_matrix)
+        return RaggedQStream(self.system_sizes, buffer = buffer,
+                             use_density_matrix = "auto" if self.adaptive else self.use_density_matrix)
+
+    @property
+    def noise_model(self):
+        '''
+        The gate-level noise model applied to gates on this stream's systems, shared by every size class. Setting a
+        mixing model on an adaptive stream promotes it to density matrices.
+        '''
+        return self._noise_model
+
+    @noise_model.setter
+    def noise_model(self, model):
+        self._noise_model = model
+        if self.adaptive and model is not None and model.is_mixing:
+            self.promote()
+        for stream in self.classes.values():
+            stream.noise_model = model
+
+    def promote(self, chunk_size = None):
+        '''
+        Convert an adaptive stream from state vectors to density matrices; see ``QStream.promote()``. A new flat
+        shared buffer is allocated and each size class is filled with the outer products of its state vectors, then
+        every view of the stream is pointed at the new buffer. This does nothing if the stream already holds density
+        matrices.
+
+        :param int chunk_size: number of systems to convert at a time; if None, picked to keep the working set near
+                               ``analysis.CHUNK_BYTES``
+        '''
+        if self.use_density_matrix:
+            return
+        if os.getpid() != self._owner:
+            raise RuntimeError("An adaptive stream can only be promoted by the process which allocated it, before "
+                               "agent processes are started; promote it there with qstream.promote()")
+        buffer = RaggedQStream.shared_buffer(self.system_sizes, use_density_matrix = True)
+        offsets = self._layout(True)[0]
+        for (size, stream), start, stop in zip(self.classes.items(), offsets[:-1], offsets[1:]):
+            dim = 2 ** size
+            matrices = buffer[start:stop].reshape((-1, dim, dim))
+            step = chunk_size or max(1, analysis.CHUNK_BYTES // (4 * dim * dim * buffer.itemsize))
+            for window in stream._windows(step):
+                vectors = stream.state[window]
+                matrices[window] = np.einsum("ai,aj->aij", vectors, vectors.conj())
+        for view in list(self._views):
+            view.attach(buffer)
+
+    @property
+    def num_qubits(self):
+        '''
+        The number of qubits of the largest system, so that gates accept stream-level qubits
+        '''
+        return self.system_size
+
+    def _layout(self, use_density_matrix):
+        '''
+        Locate the size classes and systems in a flat buffer of state vectors or density matrices
+
+        :param bool use_density_matrix: whether the buffer holds density matrices
+        :return: tuple of (offsets of the size classes followed by the buffer length, offset of each system)
+        '''
+        elements = 4 ** self.sizes if use_density_matrix else 2 ** self.sizes
+        class_offsets = np.concatenate([[0], np.cumsum(self._counts * elements)])
+        class_index = np.searchsorted(self.sizes, self.system_sizes)
+        return class_offsets, class_offsets[class_index] + self.positions * elements[class_index]
+
+    def attach(self, buffer):
+        '''
+        Point this stream at a different flat buffer of the same layout, such as a memory-mapped checkpoint, discarding
+        any cached ``QSystem`` views of the previous buffer. An adaptive stream takes the representation of the buffer.
+
+        :param np.array buffer: the new flat buffer
+        '''
+        if self.adaptive:
+            self.use_density_matrix = buffer.size > np.sum(2 ** self.system_sizes)
+        self._class_offsets, self.offsets = self._layout(self.use_density_matrix)
+        self.buffer = buffer
+        self.classes = {}
+        for size, start, stop in zip(self.sizes, self._class_offsets[:-1], self._class_offsets[1:]):
+            dim = 2 ** int(size)
+            shape = (-1, dim, dim) if self.use_density_matrix else (-1, dim)
+            stream = QStream.from_array(buffer[start:stop].reshape(shape), use_density_matrix = self.use_density_matrix)
+            stream.noise_model = self._noise_model
+            self.classes[int(size)] = stream
+        self.state = _RaggedState(self)
+        self._systems = weakref.WeakValueDictionary()
+
+    def view(self, agent = None):
+        '''
+        Instantiate another stream object sharing this stream's buffer, e.g. for an agent's own copy
+
+        :param Agent agent: optional reference to the Agent owning the new stream object
+        :return: the new stream object
+        '''
+        stream = RaggedQStream(self.system_sizes, buffer = self.buffer, agent = agent,
+                               use_density_matrix = "auto" if self.adaptive else self.use_density_matrix)
+        stream._views = self._views
+        stream._owner = self._owner
+        self._views.add(stream)
+        stream.noise_model = self.noise_model
+        return stream
+
+    def system(self, index):
+        '''
+        Access the nth quantum system in the stream. The system keeps its stream index, so its qubits can be sent
+        through channels and stored in quantum memories as usual.
+
+        :param int index: zero-index of the quantum system to access
+        :return: the quantum system
+        '''
+        qsystem = self._systems.get(index)
+        if qsystem is None:
+            qsystem = qubit.QSystem(int(self.system_sizes[index]), index = index, state = self.state[index],
+                                    use_density_matrix = self.use_density_matrix, noise_model = self.noise_model)
+            self._systems[index] = qsystem
+        return qsystem
+
+    def qubit(self, index):
+        '''
+        Access a stream-level qubit, so that gates applied to it act on that qubit of every system (or of the
+        systems selected with ``where=``) at once
+
+        :param int index: the index of the qubit within each system
+        :return: the stream-level qubit
+        '''
+        return qubit.Qubit(self, index)
+
+    def _class_selections(self, qubit_indices, where):
+        '''
+        Split a selection of systems into the size classes, checking that every selected system has the qubits
+
+        :param [int] qubit_indices: the qubits an operation acts on
+        :param np.array where: a num_systems boolean mask or integer outcome array, or None for every system
+        :return: (size class stream, class-level ``where``) pairs for each class with selected systems
+        '''
+        needed = max(qubit_indices) + 1 if len(qubit_indices) else 0
+        selected = np.ones(self.num_systems, dtype = bool) if where is None else \
+            np.broadcast_to(np.asarray(where), (self.num_systems,)) != 0
+        for size, stream in self.classes.items():
+            members = selected[self.system_sizes == size]
+            if not np.any(members):
+                continue
+            if size < needed:
+                raise ValueError("Selected systems of size " + str(size) + " have no qubit " + str(needed - 1))
+            yield stream, None if where is None else members
+
+    def apply_local(self, operator, qubit_indices, cache_id = None, where = None, chunk_size = None):
+        '''
+        Apply a k-qubit operator to a subset of the qubits of every system, or of the systems selected by ``where``,
+        one size class at a time; see ``QStream.apply_local()``
+
+        :param np.array operator: the 2^k x 2^k operator, acting on the qubits in the order given
+        :param [int] qubit_indices: the k qubit indices to act on
+        :param str cache_id: an identifier to cache the noisy gate by, if the stream has a noise model
+        :param np.array where: a num_systems boolean mask or integer outcome array. Default: every system
+        :param int chunk_size: number of systems to process at once
+        '''
+        qubit_indices = list(qubit_indices)
+        for stream, members in self._class_selections(qubit_indices, where):
+            stream.apply_local(operator, qubit_indices, cache_id = cache_id, where = members, chunk_size = chunk_size)
+
+    def apply_controlled(self, unitary, controls, target, cache_id = None, control_states = None, where = None,
+                         chunk_size = None):
+        '''
+        Apply a controlled unitary to every system, or to the systems selected by ``where``, one size class at a time;
+        see ``QStream.apply_controlled()``
+
+        :param np.array unitary: the 2^k x 2^k unitary to apply to the targets
+        :param [int] controls: the indices of the control qubits
+        :param int|[int] target: the index of the target qubit, or a list of k target indices
+        :param str cache_id: an identifier to cache the noisy gate by, if the stream has a noise model
+        :param [int] control_states: the value (0 or 1) each control must have; default: all 1
+        :param np.array where: a num_systems boolean mask or integer outcome array. Default: every system
+        :param int chunk_size: number of systems to process at once
+        '''
+        targets = [target] if np.ndim(target) == 0 else list(target)
+        for stream, members in self._class_selections(list(controls) + targets, where):
+            stream.apply_controlled(unitary, controls, target, cache_id = cache_id, control_states = control_states,
+                                    where = members, chunk_size = chunk_size)
+
+    def measure_qubit(self, index, chunk_size = None):
+        '''
+        Measure a qubit of every system in the computational basis, one size class at a time; every system must have
+        the qubit
+
+        :param int index: the qubit to measure
+        :param int chunk_size: number of systems to process at once
+        :return: a num_systems uint8 array of outcomes, in stream order
+        '''
+        outcomes = np.empty(self.num_systems, dtype = np.uint8)
+        for stream, _ in self._class_selections([index], None):
+            outcomes[self.system_sizes == stream.system_size] = stream.measure_qubit(index, chunk_size)
+        return outcomes
+
+    def sample(self, qubit_indices, shots, basis = None, chunk_size = None):
+        '''
+        Sample repeated measurements of a subset of qubits for every system without collapsing any states, one size
+        class at a time; see ``QStream.sample()``
+
+        :param [int] qubit_indices: the qubits to sample; outcomes use the first index as the most significant bit
+        :param int shots: the number of measurement shots to draw per system
+        :param np.array|[np.array] basis: optional 2x2 basis-change unitary (or list of one per qubit) applied before
+                                          measuring
+        :param int chunk_size: number of systems to process at once when computing the distributions
+        :return: a num_systems x 2^k array of outcome counts, in stream order
+        '''
+        qubit_indices = list(qubit_indices)
+        counts = np.empty((self.num_systems, 2 ** len(qubit_indices)), dtype = np.int64)
+        for stream, _ in self._class_selections(qubit_indices, None):
+            counts[self.system_sizes == stream.system_size] = stream.sample(qubit_indices, shots, basis = basis,
+                                                                            chunk_size = chunk_size)
+        return counts
+
+    def _measure(self, qubit_indices, chunk_size = None):
+        '''
+        Measure a set of qubits of every system in the computational basis, one size class at a time; see
+        ``QStream._measure()``
+
+        :param [int] qubit_indices: the qubits to measure
+        :param int chunk_size: number of systems to process at once
+        :return: a num_systems x k uint8 array of outcomes, in stream order
+        '''
+        qubit_indices = list(qubit_indices)
+        outcomes = np.empty((self.num_systems, len(qubit_indices)), dtype = np.uint8)
+        for stream, _ in self._class_selections(qubit_indices, None):
+            outcomes[self.system_sizes == stream.system_size] = stream._measure(qubit_indices, chunk_size)
+        return outcomes
+
+    def measure_in_basis(self, qubit_index, bases, chunk_size = None):
+        '''
+        Measure one qubit of every system, each in its own basis, one size class at a time; see
+        ``QStream.measure_in_basis()``
+
+        :param int qubit_index: the qubit to measure
+        :param str|int|np.array bases: a basis name ("Z", "X" or "Y") or code (0, 1 or 2) for every system, a
+                                       num_systems array of codes, or a 2x2 or num_systems x 2 x 2 array of unitaries
+        :param int chunk_size: number of systems to process at once
+        :return: a num_systems uint8 array of outcomes, in stream order
+        '''
+        changes = QStream._basis_changes(self, bases)
+        outcomes = np.empty(self.num_systems, dtype = np.uint8)
+        for stream, _ in self._class_selections([qubit_index], None):
+            members = self.system_sizes == stream.system_size
+            outcomes[members] = stream.measure_in_basis(qubit_index, changes[members], chunk_size)
+        return outcomes
+
+    def prepare(self, qubit_index, bits, bases, chunk_size = None):
+        '''
+        Encode one bit into one qubit of every system, each in its own basis, one size class at a time; see
+        ``QStream.prepare()``
+
+        :param int qubit_index: the qubit to prepare
+        :param np.array bits: a num_systems array of bits to encode
+        :param str|int|np.array bases: the basis of each system, as for ``measure_in_basis()``
+        :param int chunk_size: number of systems to process at once
+        '''
+        changes = QStream._basis_changes(self, bases)
+        bits = np.broadcast_to(np.asarray(bits, dtype = np.int64), (self.num_systems,))
+        for stream, _ in self._class_selections([qubit_index], None):
+            members = self.system_sizes == stream.system_size
+            stream.prepare(qubit_index, bits[members], changes[members], chunk_size)
+
+    def prepare_bell(self, i, j, which = "phi+", chunk_size = None):
+        '''
+        Prepare a Bell state on qubits i and j of every system, one size class at a time; see
+        ``QStream.prepare_bell()``
+
+        :param int i: the first qubit of the pair (the control)
+        :param int j: the second qubit of the pair (the target)
+        :param str|int|np.array which: the Bell state to prepare: "phi+", "psi+", "phi-" or "psi-", or the codes
+                                       0-3, or a num_systems array of codes
+        :param int chunk_size: number of systems to process at once
+        '''
+        codes = _BELL_STATES.get(which, which) if isinstance(which, str) else which
+        codes = np.broadcast_to(np.asarray(codes), (self.num_systems,))
+        for stream, _ in self._class_selections([i, j], None):
+            stream.prepare_bell(i, j, codes[self.system_sizes == stream.system_size], chunk_size)
+
+    def bell_measure(self, i, j, chunk_size = None):
+        '''
+        Measure qubits i and j of every system in the Bell basis, one size class at a time; see
+        ``QStream.bell_measure()``
+
+        :param int i: the first qubit
+        :param int j: the second qubit
+        :param int chunk_size: number of systems to process at once
+        :return: a num_systems x 2 uint8 array of outcomes (m1, m2), in stream order
+        '''
+        outcomes = np.empty((self.num_systems, 2), dtype = np.uint8)
+        for stream, _ in self._class_selections([i, j], None):
+            outcomes[self.system_sizes == stream.system_size] = stream.bell_measure(i, j, chunk_size)
+        return outcomes
+
+    def apply_pauli_correction(self, k, outcomes, chunk_size = None):
+        '''
+        Apply the Pauli correction Z^m1 X^m2 to qubit k of every system, one size class at a time; see
+        ``QStream.apply_pauli_correction()``
+
+        :param int k: the qubit to correct
+        :param np.array outcomes: a num_systems x 2 array of (m1, m2) outcomes, in stream order
+        :param int chunk_size: number of systems to process at once
+        '''
+        outcomes = np.asarray(outcomes)
+        for stream, _ in self._class_selections([k], None):
+            stream.apply_pauli_correction(k, outcomes[self.system_sizes == stream.system_size], chunk_size)
+
+    def next(self):
+        '''
+        Access the next element in the stream, returning it as a QSystem object, and increment the head by 1
+
+        :return: a QSystem for the "head" system
+        '''
+        sys = self.system(self.index)
+        self.index += 1
+        return sys
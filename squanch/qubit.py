@@ -1,8 +1,8 @@
 import numpy as np
 
-from squanch import linalg, gates
+from squanch import analysis, linalg, gates, rng
 
-__all__ = ["QSystem", "Qubit"]
+__all__ = ["QSystem", "PackedQSystem", "Qubit"]
 
 # Computational basis and projection operators
 _0 = np.array([1, 0], dtype = np.complex64)
@@ -17,18 +17,21 @@ class QSystem:
     (if applicable) its parent ``QStream``. Quantum state is represented as a density matrix in the computational basis.
     '''
 
-    def __init__(self, num_qubits, index = None, state = None, use_density_matrix = True):
+    __slots__ = ("num_qubits", "index", "use_density_matrix", "state", "noise_model", "__weakref__")
+
+    def __init__(self, num_qubits, index = None, state = None, use_density_matrix = True, noise_model = None):
         '''
         Instatiate the quantum state for an n-qubit system
 
         :param int num_qubits: number of qubits in the system, treated as maximally entangled
         :param int index: index of the QSystem within the parent QStream
         :param np.array state: density matrix representing the quantum state. By default, |000...0><0...000| is used
+        :param NoiseModel noise_model: optional gate-level noise model applied to gates and measurements on the system
         '''
         self.num_qubits = num_qubits
-        self.qubits = (Qubit(self, i) for i in range(num_qubits))  # this is a generator, not a list
         self.index = index
         self.use_density_matrix = use_density_matrix
+        self.noise_model = noise_model
         # Register the state or generate a new one
         if state is not None:
             self.state = state  # density matrix should be passed by reference and will modify the QStream.state
@@ -56,7 +59,17 @@ class QSystem:
         :return: the QSystem object
         '''
         return cls(qstream.system_size, index = index, state = qstream.state[index],
-                   use_density_matrix = use_density_matrix)
+                   use_density_matrix = use_density_matrix, noise_model = qstream.noise_model)
+
+    @property
+    def qubits(self):
+        '''
+        A generator over the constituent qubits of this system. Qubit views are created on demand, so iterating is
+        only paid for when the qubits are actually used.
+
+        :return: a generator of ``Qubit`` instances, one per qubit index
+        '''
+        return (Qubit(self, i) for i in range(self.num_qubits))
 
     def qubit(self, index):
         '''
@@ -76,47 +89,187 @@ class QSystem:
         :param int index: the qubit to measure
         :return: the measured qubit value
         '''
-        state = self.state if self.use_density_matrix else np.outer(self.state, self.state.conj())
-        measure0 = gates.expand(_M0, index, self.num_qubits, "0" + str(index) + str(self.num_qubits))
-        prob0 = np.trace(np.dot(measure0, state))
+        # Probability of |0>, read from the diagonal of the state
+        if self.use_density_matrix:
+            diagonal = np.real(np.diagonal(self.state))
+        else:
+            diagonal = np.abs(self.state) ** 2
+        prob0 = np.sum(diagonal.reshape((2 ** index, 2, -1))[:, 0, :])
         # Determine if qubit collapses to |0> or |1>
-        if np.random.rand() <= prob0:
-            # qubit collapses to |0>
-            if self.use_density_matrix:
-                self.state[...] = np.linalg.multi_dot([measure0, self.state, measure0.conj().T]) / prob0
-            else:
-                self.state[...] = np.dot(measure0, self.state) / np.sqrt(prob0)
-            return 0
+        if rng.current_stream().rand() <= prob0:
+            outcome, probability = 0, prob0
         else:
-            # qubit collapses to |1>
-            measure1 = gates.expand(_M1, index, self.num_qubits, "1" + str(self.num_qubits))
-            if self.use_density_matrix:
-                self.state[...] = np.linalg.multi_dot([measure1, self.state, measure1.conj().T]) / (1.0 - prob0)
-            else:
-                self.state[...] = np.dot(measure1, self.state) / np.sqrt(1.0 - prob0)
-            return 1
+            outcome, probability = 1, 1.0 - prob0
+        # Project by zeroing the amplitudes (rows and columns) where the qubit has the other value; this is
+        # equivalent to applying the expanded projector, without building it
+        other = 1 - outcome
+        if self.use_density_matrix:
+            rest = 2 ** (self.num_qubits - index - 1)
+            rho = self.state.reshape((2 ** index, 2, rest, 2 ** index, 2, rest))
+            rho[:, other] = 0
+            rho[:, :, :, :, other] = 0
+            self.state[...] /= probability
+        else:
+            self.state.reshape((2 ** index, 2, -1))[:, other] = 0
+            self.state[...] /= np.sqrt(probability)
+        if self.noise_model is not None:
+            outcome = self.noise_model.readout_error(outcome)
+        return outcome
+
+    def sample(self, qubit_indices, shots, basis = None):
+        '''
+        Sample repeated measurements of a subset of qubits without collapsing the state. The outcome distribution is
+        computed once and all shots are drawn with a single multinomial call.
+
+        :param [int] qubit_indices: the qubits to sample; outcomes use the first index as the most significant bit
+        :param int shots: the number of measurement shots to draw
+        :param np.array|[np.array] basis: optional 2x2 basis-change unitary (or list of one per qubit) applied before
+                                          measuring; see ``analysis.probabilities``
+        :return: a length 2^k array of outcome counts
+        '''
+        probs = analysis.probabilities(self.state[np.newaxis], qubit_indices, basis = basis)[0]
+        probs = np.clip(probs, 0, None)
+        return rng.current_stream().multinomial(shots, probs / np.sum(probs))
 
     def apply(self, operator):
         '''
         Apply an N-qubit unitary operator to this system's N-qubit quantum state
 
-        :param np.array operator: the unitary N-qubit operator to apply
+        :param np.array|linalg.SparseOperator operator: the unitary N-qubit operator to apply
         :return: nothing, the qsystem state is mutated
         '''
         # Apply the operator
         # assert linalg.isHermitian(operator), "Qubit operators must be Hermitian"
-        if self.use_density_matrix:
+        if isinstance(operator, linalg.SparseOperator):
+            self.state[...] = operator.apply(self.state, self.use_density_matrix)
+        elif self.use_density_matrix:
             self.state[...] = np.linalg.multi_dot([operator, self.state, operator.conj().T])
         else:
             self.state[...] = np.dot(operator, self.state)
         # self.state[...] = np.linalg.multi_dot([operator, self.state, operator])
 
+    def apply_local(self, operator, qubit_indices, cache_id = None):
+        '''
+        Apply a k-qubit operator to a subset of the qubits in this system. Single-qubit operators with a ``cache_id``
+        are expanded with ``gates.expand`` and cached; other operators are contracted directly with the corresponding
+        axes of the state.
+
+        :param np.array operator: the 2^k x 2^k operator, acting on the qubits in the order given
+        :param [int] qubit_indices: the k qubit indices to act on
+        :param str cache_id: a character or string to cache the expanded operator by
+        :return: nothing, the qsystem state is mutated
+        '''
+        if self.noise_model is not None:
+            self.state[...] = self.noise_model.apply(self.state, operator, qubit_indices, self.use_density_matrix,
+                                                     cache_id)
+        elif len(qubit_indices) == 1 and cache_id is not None:
+            self.apply(gates.expand(operator, qubit_indices[0], self.num_qubits, cache_id))
+        else:
+            self.state[...] = linalg.apply_operator(self.state, operator, qubit_indices, self.use_density_matrix)
+
+    def apply_controlled(self, unitary, controls, target, cache_id = None, control_states = None):
+        '''
+        Apply a unitary to one or more target qubits, conditioned on the control qubits being |1> (or the states given
+        by ``control_states``). Only the slice of the state where the controls match is updated; see
+        ``linalg.apply_controlled_operator``.
+
+        :param np.array unitary: the 2^k x 2^k unitary to apply to the targets
+        :param [int] controls: the indices of the control qubits
+        :param int|[int] target: the index of the target qubit, or a list of k target indices
+        :param str cache_id: a string to cache the noisy gate by, if the system has a noise model
+        :param [int] control_states: the value (0 or 1) each control must have; default: all 1
+        :return: nothing, the qsystem state is mutated
+        '''
+        targets = [target] if np.ndim(target) == 0 else list(target)
+        if self.noise_model is not None:
+            # Fuse the gate with its noise on just the qubits involved, with the targets last
+            local = linalg.controlled_operator(unitary, len(controls), control_states)
+            self.apply_local(local, list(controls) + targets, cache_id = cache_id)
+            return
+        linalg.apply_controlled_operator(self.state, unitary, controls, targets, self.use_density_matrix,
+                                         control_states)
+
+
+class PackedQSystem(QSystem):
+    '''
+    A ``QSystem`` whose density matrix lives in a Hermitian-packed stream (see ``linalg.HermitianPackedArray``). The
+    ``state`` property unpacks the matrix into a complex copy and assigning it packs it back; each state-mutating
+    operation unpacks once, runs the ``QSystem`` implementation on the copy, and packs the result.
+    '''
+
+    __slots__ = ("packed",)
+
+    def __init__(self, num_qubits, packed, index = None, noise_model = None):
+        '''
+        Instantiate the system from a view of its packed density matrix
+
+        :param int num_qubits: number of qubits in the system
+        :param np.array packed: the 2^n x 2^n real view of the packed density matrix in the parent stream
+        :param int index: index of the QSystem within the parent QStream
+        :param NoiseModel noise_model: optional gate-level noise model applied to gates and measurements on the system
+        '''
+        self.num_qubits = num_qubits
+        self.index = index
+        self.use_density_matrix = True
+        self.noise_model = noise_model
+        self.packed = packed
+
+    @classmethod
+    def from_stream(cls, qstream, index, use_density_matrix = True):
+        '''
+        Instantiate a PackedQSystem from a given index in a parent packed QStream
+
+        :param QStream qstream: the parent stream
+        :param int index: the index in the parent stream corresponding to this system
+        :return: the PackedQSystem object
+        '''
+        return cls(qstream.system_size, qstream.state.packed[index], index = index, noise_model = qstream.noise_model)
+
+    @property
+    def state(self):
+        '''
+        An unpacked complex copy of the system's density matrix; assign to this property to update the system
+        '''
+        return linalg.unpack_hermitian(self.packed)
+
+    @state.setter
+    def state(self, value):
+        self.packed[...] = linalg.pack_hermitian(value)
+
+    def _dense(self):
+        '''Unpack the state into a dense ``QSystem`` sharing this system's settings'''
+        return QSystem(self.num_qubits, index = self.index, state = self.state, noise_model = self.noise_model)
+
+    def measure_qubit(self, index):
+        dense = self._dense()
+        outcome = dense.measure_qubit(index)
+        self.state = dense.state
+        return outcome
+
+    def apply(self, operator):
+        dense = self._dense()
+        dense.apply(operator)
+        self.state = dense.state
+
+    def apply_local(self, operator, qubit_indices, cache_id = None):
+        dense = self._dense()
+        dense.apply_local(operator, qubit_indices, cache_id = cache_id)
+        self.state = dense.state
+
+    def apply_controlled(self, unitary, controls, target, cache_id = None, control_states = None):
+        dense = self._dense()
+        dense.apply_controlled(unitary, controls, target, cache_id = cache_id, control_states = control_states)
+        self.state = dense.state
+
 
 class Qubit:
     '''
-    A wrapper class representing a single qubit in an existing quantum system.
+    A wrapper class representing a single qubit in an existing quantum system. The parent may also be a ``QStream``
+    (see ``QStream.qubit()``), in which case operations act on that qubit of every system in the stream.
     '''
 
+    __slots__ = ("index", "qsystem")
+
     def __init__(self, qsystem, index):
         '''
         Instantiate the qubit from an existing QSystem and index
@@ -147,14 +300,15 @@ class Qubit:
         '''
         return self.qsystem.measure_qubit(self.index)
 
-    def apply(self, operator, id = None):
+    def apply(self, operator, id = None, where = None):
         '''
         Apply a single-qubit operator to this qubit, tensoring with I and passing to the qsystem.apply() method
 
         :param np.array operator: a single qubit (2x2) complex-valued matrix
         :param str cacheID: a character or string to cache the expanded operator by (e.g. Hadamard qubit 2 -> "IHII...")
+        :param np.array where: for a stream-level qubit, a mask or outcome array selecting the systems to act on
         '''
-        self.qsystem.apply(gates.expand(operator, self.index, self.qsystem.num_qubits, id))
+        self.qsystem.apply_local(operator, (self.index,), cache_id = id, **gates._where(where))
 
     def serialize(self):
         '''
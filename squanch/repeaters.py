@@ -0,0 +1,298 @@
+import numpy as np
+
+from squanch import analysis, errors, rng
+from squanch.agent import Agent
+from squanch.channels import CChannel, FiberOpticQChannel
+from squanch.gates import CNOT, H, RX
+from squanch.noise import NoiseModel
+from squanch.qstream import QStream
+
+__all__ = ["RepeaterNode", "RepeaterChain"]
+
+# The Bell states |phi+>, |psi+>, |phi->, |psi->, indexed by the codes used in QStream.prepare_bell()
+_BELL_VECTORS = np.array([[1, 0, 0, 1], [0, 1, 1, 0], [1, 0, 0, -1], [0, 1, -1, 0]]) / np.sqrt(2)
+
+
+def _join(first, second, is_density):
+    '''
+    Tensor two batches of two-qubit states together into a batch of four-qubit states
+
+    :param np.array first: the batch of states of qubits 0 and 1
+    :param np.array second: the batch of states of qubits 2 and 3
+    :param bool is_density: whether the states are density matrices
+    :return: the batch of joint states
+    '''
+    if is_density:
+        return np.einsum("aij,akl->aikjl", first, second).reshape((len(first), 16, 16))
+    return np.einsum("ai,aj->aij", first, second).reshape((len(first), 16))
+
+
+def _select(states, qubits, is_density):
+    '''
+    Extract the state of the unmeasured qubits of a batch of four-qubit states in which some qubits were measured.
+    The measurement leaves a single nonzero block per system, which summing (or tracing) over the measured qubits
+    picks out.
+
+    :param np.array states: the batch of four-qubit states, collapsed and renormalized by the measurement
+    :param [int] qubits: the two measured qubits
+    :param bool is_density: whether the states are density matrices
+    :return: the batch of two-qubit states of the other qubits, in order
+    '''
+    others = [q for q in range(4) if q not in qubits]
+    if is_density:
+        return analysis.partial_trace(states, others)
+    return states.reshape((-1,) + (2,) * 4).sum(axis = tuple(1 + q for q in qubits)).reshape((-1, 4))
+
+
+def _fidelity(states, is_density):
+    '''
+    Fidelity of a batch of two-qubit states with |phi+>
+
+    :param np.array states: the batch of states
+    :param bool is_density: whether the states are density matrices
+    :return: the array of fidelities
+    '''
+    phi = _BELL_VECTORS[0]
+    if is_density:
+        return np.real(np.einsum("i,aij,j->a", phi, states, phi))
+    return np.abs(np.dot(states, phi)) ** 2
+
+
+def _twirl(states, is_density):
+    '''
+    Depolarize a batch of two-qubit states into Werner states of the same fidelity with |phi+>, as in the BBPSSW
+    protocol. State vectors are replaced by a Bell state sampled from the Werner mixture.
+
+    :param np.array states: the batch of states
+    :param bool is_density: whether the states are density matrices
+    :return: the twirled batch
+    '''
+    fidelity = _fidelity(states, is_density)
+    if is_density:
+        phi = np.outer(_BELL_VECTORS[0], _BELL_VECTORS[0])
+        other = (np.eye(4) - phi) / 3
+        werner = fidelity[:, None, None] * phi + (1 - fidelity)[:, None, None] * other
+        return werner.astype(states.dtype)
+    stream = rng.current_stream()
+    codes = np.where(stream.random(len(states)) < fidelity, 0, stream.integers(1, 4, len(states)))
+    return _BELL_VECTORS[codes].astype(states.dtype)
+
+
+class RepeaterNode(Agent):
+    '''
+    A node of a ``RepeaterChain``. Nodes are connected to their neighbours by fiber optic quantum channels and
+    classical channels; the chain reads the hop geometry and loss from those channels, and each node's
+    ``memory_model`` and ``noise_model`` from the node.
+    '''
+
+
+class RepeaterChain:
+    '''
+    An N-hop quantum repeater chain, built from ``RepeaterNode`` agents linked by ``FiberOpticQChannel`` and
+    ``CChannel`` connections. Elementary links are generated by heralded attempts over each hop, optionally purified
+    with the DEJMPS or BBPSSW protocols, and joined end-to-end by entanglement swapping at every intermediate node.
+
+    Each hop's pairs occupy one slice of a single two-qubit ``QStream``, so generation, memory decoherence,
+    purification and swapping are applied to whole slices at once: a swap or purification step joins two slices into
+    a temporary four-qubit stream and runs the gates and measurements on it with stream-level qubits. Swaps commute,
+    so they are simulated from left to right; the timing model runs the hops and swaps in parallel. No agent
+    processes or per-qubit messages are needed.
+    '''
+
+    def __init__(self, num_hops, num_pairs, length, fidelity = 1.0, memory_model = None, noise_model = None,
+                 use_density_matrix = True):
+        '''
+        Build the chain
+
+        :param int num_hops: the number of hops, i.e. elementary links; the chain has num_hops + 1 nodes
+        :param int num_pairs: the number of elementary pairs generated per hop
+        :param float length: the length of each hop in km
+        :param float fidelity: the fidelity with |phi+> of each heralded elementary pair (a Werner state)
+        :param DecoherenceModel memory_model: decoherence of qubits waiting in each node's memory
+        :param NoiseModel noise_model: gate and readout noise of each node's swap and purification operations
+        :param bool use_density_matrix: whether to simulate density matrices or sampled state vectors
+        '''
+        self.num_hops = num_hops
+        self.num_pairs = num_pairs
+        self.fidelity = fidelity
+        self.use_density_matrix = use_density_matrix
+        self.qstream = QStream(2, num_hops * num_pairs, use_density_matrix = use_density_matrix)
+        self.nodes = [RepeaterNode(self.qstream, name = "Node" + str(i), memory_model = memory_model,
+                                   noise_model = noise_model) for i in range(num_hops + 1)]
+        for left, right in zip(self.nodes, self.nodes[1:]):
+            left.qconnect(right, FiberOpticQChannel, length = length)
+            left.cconnect(right, CChannel, length = length)
+        self.states = None
+
+    def _hop(self, i):
+        '''The slice of the stream holding the pairs of hop i'''
+        return slice(i * self.num_pairs, (i + 1) * self.num_pairs)
+
+    def _channel(self, i):
+        '''The quantum channel of hop i'''
+        return self.nodes[i].qchannels_out[self.nodes[i + 1]]
+
+    def _transmission(self, i):
+        '''The probability that a photon sent over hop i arrives'''
+        attenuation = [e.attenuation for e in self._channel(i).errors if isinstance(e, errors.AttenuationError)]
+        return float(np.prod(attenuation))
+
+    def _delay(self, i):
+        '''The one-way signal delay of hop i'''
+        channel = self._channel(i)
+        return channel.length / channel.signal_speed
+
+    def _decohere(self, states, node, qubit_index, elapsed):
+        '''Apply a node's memory decoherence to one qubit of a batch of pairs'''
+        model = node.memory_model
+        if model is None or not np.any(elapsed > 0):
+            return states
+        return model.apply(states, qubit_index, elapsed, self.use_density_matrix).astype(states.dtype)
+
+    def generate(self):
+        '''
+        Run heralded generation on every hop. Each slot prepares |phi+> on its hop, degraded to the chain's elementary
+        pair fidelity, and the number of attempts until a photon survives the hop is sampled from the hop's
+        transmission. An attempt takes a round trip of the hop (photon out, herald back).
+
+        :return: a num_hops x num_pairs array of generation times
+        '''
+        QStream.reformat(self.qstream.state, use_density_matrix = self.use_density_matrix)
+        self.qstream.prepare_bell(0, 1)
+        if self.fidelity < 1:
+            # A two-qubit depolarizing channel with probability p leaves |phi+> with fidelity 1 - 3p/4
+            werner = NoiseModel(two_qubit = 4 * (1 - self.fidelity) / 3)
+            for window in self.qstream._windows():
+                self.qstream.state[window] = werner.apply(self.qstream.state[window], np.eye(4), [0, 1],
+                                                          self.use_density_matrix, cache_id = "werner")
+        times = np.empty((self.num_hops, self.num_pairs))
+        for i in range(self.num_hops):
+            attempts = rng.current_stream().geometric(self._transmission(i), size = self.num_pairs)
+            times[i] = attempts * 2 * self._delay(i)
+        return times
+
+    def purify(self, states, times, i, method = "dejmps"):
+        '''
+        Run one round of entanglement purification on consecutive pairs of a hop (or of any two nodes' pairs): pairs
+        2k and 2k + 1 are combined, the second is measured, and the first is kept if the outcomes agree. A pair's
+        time is the time it took to generate both inputs plus the classical round of comparing outcomes; the time of
+        failed rounds is carried over to the next successful one.
+
+        :param np.array states: the batch of pairs, held by node i (qubit 0) and node i + 1 (qubit 1)
+        :param np.array times: the time taken to produce each pair
+        :param int i: the index of the left node
+        :param str method: "dejmps" or "bbpssw"
+        :return: tuple of (surviving pairs, their times)
+        '''
+        left, right = self.nodes[i], self.nodes[i + 1]
+        count = len(states) // 2
+        if count == 0:
+            return states[:0], times[:0]
+        first, second = states[0:2 * count:2], states[1:2 * count:2]
+        t_first, t_second = times[0:2 * count:2], times[1:2 * count:2]
+        # The first pair waits in memory while the second is generated
+        for node, qubit_index in ((left, 0), (right, 1)):
+            first = self._decohere(first, node, qubit_index, t_second)
+        if method == "bbpssw":
+            first, second = _twirl(first, self.use_density_matrix), _twirl(second, self.use_density_matrix)
+        joint = QStream.from_array(_join(first, second, self.use_density_matrix),
+                                   use_density_matrix = self.use_density_matrix)
+        qubits = [joint.qubit(q) for q in range(4)]
+        # Qubits 0 and 2 are held by the left node, 1 and 3 by the right node
+        for node, (source, target), angle in ((left, (0, 2), np.pi / 2), (right, (1, 3), -np.pi / 2)):
+            joint.noise_model = node.qstream.noise_model
+            if method == "dejmps":
+                RX(qubits[source], angle)
+                RX(qubits[target], angle)
+            CNOT(qubits[source], qubits[target])
+        # Each node measures its target qubit, reporting the outcome with its own readout error
+        joint.noise_model = left.qstream.noise_model
+        reported_left = joint._measure([2])[:, 0]
+        joint.noise_model = right.qstream.noise_model
+        reported_right = joint._measure([3])[:, 0]
+        joint.noise_model = None
+        success = reported_left == reported_right
+        kept = _select(joint.state, [2, 3], self.use_density_matrix)[success]
+        if method == "bbpssw":
+            kept = _twirl(kept, self.use_density_matrix)
+        spent = np.cumsum(t_first + t_second + 2 * self._delay(i))
+        ends = spent[success]
+        return kept, np.diff(ends, prepend = 0.0)
+
+    def swap(self, first, second, i):
+        '''
+        Entanglement swapping at node i: a Bell measurement of its halves of the pairs (node a, node i) and (node i,
+        node b), with the Pauli correction applied at node b, leaving pairs between nodes a and b
+
+        :param np.array first: the batch of pairs ending at node i (its qubit 1)
+        :param np.array second: the batch of pairs starting at node i (its qubit 0)
+        :param int i: the index of the swapping node
+        :return: the batch of joined pairs
+        '''
+        node = self.nodes[i]
+        joint = QStream.from_array(_join(first, second, self.use_density_matrix),
+                                   use_density_matrix = self.use_density_matrix)
+        joint.noise_model = node.qstream.noise_model
+        CNOT(joint.qubit(1), joint.qubit(2))
+        H(joint.qubit(1))
+        reported = joint._measure([1, 2])
+        joint.noise_model = None
+        # The outcomes (m1, m2) of the Bell measurement call for the correction Z^m1 X^m2 on qubit 3
+        joint.apply_pauli_correction(3, reported)
+        return _select(joint.state, [1, 2], self.use_density_matrix)
+
+    def run(self, purification_rounds = 0, method = "dejmps"):
+        '''
+        Generate end-to-end pairs across the chain: heralded generation on every hop, a number of purification
+        rounds on each hop's pairs, then entanglement swapping at every intermediate node. The k-th surviving pair of
+        every hop is used for the k-th end-to-end pair, which is ready once the slowest hop has delivered and the
+        swap outcomes have reached the end nodes; qubits decohere in memory while waiting for the other hops.
+
+        :param int purification_rounds: the number of purification rounds applied to the pairs of each hop
+        :param str method: the purification protocol, "dejmps" or "bbpssw"
+        :return: a structured array with one record per end-to-end pair, with fields ``fidelity`` (with |phi+>) and
+                 ``time`` (the time taken to deliver it); the pairs themselves are stored in ``self.states``
+        '''
+        times = self.generate()
+        hops = []
+        for i in range(self.num_hops):
+            states, hop_times = self.qstream.state[self._hop(i)], times[i]
+            for _ in range(purification_rounds):
+                states, hop_times = self.purify(states, hop_times, i, method = method)
+            hops.append((states, hop_times))
+        count = min(len(states) for states, _ in hops)
+        ready = np.max([hop_times[:count] for _, hop_times in hops], axis = 0) if count else np.zeros(0)
+        states = None
+        for i, (hop_states, hop_times) in enumerate(hops):
+            # Both ends of each pair wait in memory until every hop has delivered
+            idle = ready - hop_times[:count]
+            hop_states = self._decohere(hop_states[:count], self.nodes[i], 0, idle)
+            hop_states = self._decohere(hop_states, self.nodes[i + 1], 1, idle)
+            states = hop_states if states is None else self._swap_chunked(states, hop_states, i)
+        total_delay = sum(self._delay(i) for i in range(self.num_hops))
+        elapsed = ready + (total_delay if self.num_hops > 1 else 0.0)
+        for node in self.nodes:
+            node.time = float(np.sum(elapsed))
+        self.states = states
+        result = np.zeros(count, dtype = [("fidelity", np.float64), ("time", np.float64)])
+        result["fidelity"] = _fidelity(states, self.use_density_matrix)
+        result["time"] = elapsed
+        return result
+
+    def _swap_chunked(self, first, second, i):
+        '''Swap at node i in chunks, bounding the memory of the temporary four-qubit states'''
+        per_system = 16 ** (2 if self.use_density_matrix else 1) * 8 * 4
+        chunk_size = max(1, analysis.CHUNK_BYTES // per_system)
+        return np.concatenate([self.swap(first[start:start + chunk_size], second[start:start + chunk_size], i)
+                               for start in range(0, len(first), chunk_size)] or [first[:0]])
+
+    @staticmethod
+    def rate(result):
+        '''
+        The end-to-end pair rate of a run
+
+        :param np.array result: the structured array returned by ``run()``
+        :return: the number of end-to-end pairs delivered per second
+        '''
+        total = np.sum(result["time"])
+        return len(result) / total if total > 0 else 0.0
@@ -0,0 +1,184 @@
+import contextlib
+
+import numpy as np
+
+__all__ = ["RandomStream", "current_stream", "set_stream", "use_stream", "spawn_streams"]
+
+# Number of random values drawn at once by a buffered stream
+DEFAULT_BLOCK_SIZE = 4096
+
+
+class RandomStream:
+    '''
+    A source of random numbers for the simulation. A stream wraps a ``np.random.Generator`` and draws uniform and
+    standard normal values in blocks of ``block_size``, so a scalar sample (one per measurement or per channel error)
+    is an array read rather than a call into the generator. Array samples are drawn from the generator directly.
+
+    The default stream wraps the legacy global ``np.random`` state without buffering, so that ``np.random.seed()``
+    still makes serial simulations reproducible. ``Simulation(..., seed = seed)`` gives every agent and channel its
+    own independent buffered stream, spawned from one ``np.random.SeedSequence``.
+    '''
+
+    def __init__(self, generator = None, block_size = DEFAULT_BLOCK_SIZE):
+        '''
+        Instantiate the stream
+
+        :param np.random.Generator|int generator: the generator to draw from, or a seed for a new one; if None, the
+                                                  legacy global ``np.random`` state is used, unbuffered
+        :param int block_size: the number of values to draw at once
+        '''
+        if generator is None:
+            self.generator = np.random.mtrand._rand
+            self.block_size = 0
+        else:
+            if not isinstance(generator, np.random.Generator):
+                generator = np.random.default_rng(generator)
+            self.generator = generator
+            self.block_size = block_size
+        self._uniform = np.zeros(0)
+        self._uniform_position = 0
+        self._normal = np.zeros(0)
+        self._normal_position = 0
+
+    def rand(self):
+        '''
+        Draw a uniform random number in [0, 1)
+
+        :return: the number
+        '''
+        if self.block_size == 0:
+            return self.generator.random_sample()
+        position = self._uniform_position
+        if position == len(self._uniform):
+            self._uniform = self.generator.random(self.block_size)
+            position = 0
+        self._uniform_position = position + 1
+        return self._uniform[position]
+
+    def random(self, size = None):
+        '''
+        Draw uniform random numbers in [0, 1)
+
+        :param int|tuple size: the output shape; if None, a single number is drawn
+        :return: the number or array of numbers
+        '''
+        if size is None:
+            return self.rand()
+        if self.block_size == 0:
+            return self.generator.random_sample(size)
+        return self.generator.random(size)
+
+    def normal(self, loc = 0.0, scale = 1.0, size = None):
+        '''
+        Draw normally distributed random numbers. Samples of up to ``block_size`` values are read from the buffer.
+
+        :param float loc: the mean
+        :param float scale: the standard deviation
+        :param int size: the number of values to draw; if None, a single number is drawn
+        :return: the number or array of numbers
+        '''
+        if self.block_size == 0 or (size is not None and np.prod(size) > self.block_size):
+            return self.generator.normal(loc, scale, size)
+        count = 1 if size is None else int(np.prod(size))
+        position = self._normal_position
+        if position + count > len(self._normal):
+            self._normal = self.generator.standard_normal(self.block_size)
+            position = 0
+        self._normal_position = position + count
+        values = loc + scale * self._normal[position:position + count]
+        return values[0] if size is None else values.reshape(size)
+
+    def integers(self, low, high, size = None, dtype = np.int64):
+        '''
+        Draw random integers from [low, high)
+
+        :param int low: the lowest value
+        :param int high: one above the highest value
+        :param int|tuple size: the output shape; if None, a single number is drawn
+        :param np.dtype dtype: the integer type of the result, e.g. ``np.uint64`` to draw full 64-bit words
+        :return: the number or array of numbers
+        '''
+        if self.block_size == 0:
+            return self.generator.randint(low, high, size, dtype = dtype)
+        return self.generator.integers(low, high, size, dtype = dtype)
+
+    def geometric(self, p, size = None):
+        '''
+        Draw the number of Bernoulli trials up to and including the first success
+
+        :param float p: the success probability of each trial
+        :param int|tuple size: the output shape; if None, a single number is drawn
+        :return: the number or array of numbers
+        '''
+        return self.generator.geometric(p, size)
+
+    def multinomial(self, n, pvals, size = None):
+        '''
+        Draw counts of outcomes from a multinomial distribution
+
+        :param int n: the number of trials
+        :param np.array pvals: the outcome probabilities; a (...) x k array draws one set of counts per row
+        :param int|tuple size: the number of independent draws; if None, one draw
+        :return: the array of counts
+        '''
+        pvals = np.asarray(pvals)
+        if self.block_size == 0 and pvals.ndim > 1:
+            # The legacy global state only accepts one distribution per call
+            rows = pvals.reshape((-1, pvals.shape[-1]))
+            counts = np.array([self.generator.multinomial(n, row, size) for row in rows])
+            return counts.reshape(pvals.shape[:-1] + counts.shape[1:])
+        return self.generator.multinomial(n, pvals, size)
+
+
+# The stream used by the running process; replaced in each agent process by the stream assigned to its agent
+_current = RandomStream()
+
+
+def current_stream():
+    '''
+    The random stream of the running process
+
+    :return: the ``RandomStream``
+    '''
+    return _current
+
+
+def set_stream(stream):
+    '''
+    Replace the random stream of the running process, e.g. ``set_stream(RandomStream(seed))`` to make a serial
+    simulation reproducible with buffered draws
+
+    :param RandomStream stream: the new stream
+    '''
+    global _current
+    _current = stream
+
+
+@contextlib.contextmanager
+def use_stream(stream):
+    '''
+    Context manager which makes a stream the random stream of the running process for the duration of the block.
+    Processes forked inside the block keep the stream.
+
+    :param RandomStream stream: the stream to use
+    '''
+    previous = _current
+    set_stream(stream)
+    try:
+        yield stream
+    finally:
+        set_stream(previous)
+
+
+def spawn_streams(seed, count, block_size = DEFAULT_BLOCK_SIZE):
+    '''
+    Spawn statistically independent random streams from a single seed with ``np.random.SeedSequence``
+
+    :param int seed: the root seed; if None, fresh entropy is used, so the streams are independent but not
+                     reproducible
+    :param int count: the number of streams
+    :param int block_size: the number of values each stream draws at once
+    :return: a list of ``RandomStream`` objects
+    '''
+    return [RandomStream(np.random.default_rng(sequence), block_size = block_size)
+            for sequence in np.random.SeedSequence(seed).spawn(count)]
@@ -1,9 +1,24 @@
+import ctypes
+import itertools
+import multiprocessing
+import os
+import pickle
+import shutil
+import tempfile
 import threading
 import time
+import traceback
+from multiprocessing import sharedctypes
 
+import numpy as np
 import tqdm
 
-__all__ = ["Simulation"]
+from squanch import rng
+from squanch.agent import Agent, SharedOutputArray
+from squanch.network import Network
+from squanch.transport import Mailbox, MailboxQueue
+
+__all__ = ["Simulation", "Sweep"]
 
 
 def is_notebook():
@@ -19,6 +34,111 @@ def is_notebook():
         return False  # Probably standard Python interpreter
 
 
+def _root_buffer(array):
+    '''
+    Find the object that ultimately owns the memory of a (possibly reshaped or sliced) array
+
+    :param np.array array: the array view
+    :return: the owning object
+    '''
+    while isinstance(array, np.ndarray) and array.base is not None:
+        array = array.base
+    return array
+
+
+def _write_array(filename, array, chunk_size):
+    '''
+    Write an array to an ``.npy`` file in chunks along its first axis, so no full in-memory copy is made
+
+    :param str filename: the file to write
+    :param np.array array: the C-contiguous array to write
+    :param int chunk_size: number of rows of the array to write at a time
+    '''
+    with open(filename + ".tmp", "wb") as f:
+        np.lib.format.write_array_header_1_0(f, np.lib.format.header_data_from_array_1_0(array))
+        for start in range(0, array.shape[0], chunk_size):
+            np.ascontiguousarray(array[start:start + chunk_size]).tofile(f)
+    os.replace(filename + ".tmp", filename)
+
+
+def _map_copy(filename):
+    '''
+    Copy an ``.npy`` file and memory-map the copy read-write. The mapping is shared (``MAP_SHARED``), so agent processes
+    forked afterwards share it without the array being loaded into memory, and the original file is left unchanged.
+    The copy is unlinked once it is mapped, so it is removed when the last mapping of it is closed.
+
+    :param str filename: the file to copy
+    :return: the memory-mapped copy
+    '''
+    handle, copy = tempfile.mkstemp(suffix = ".npy", dir = os.path.dirname(filename) or None)
+    os.close(handle)
+    shutil.copyfile(filename, copy)
+    array = np.load(copy, mmap_mode = "r+")
+    try:
+        os.remove(copy)
+    except OSError:
+        pass  # the file is still mapped on platforms which do not allow unlinking it
+    return array
+
+
+class _Checkpoints:
+    '''
+    Coordinates a checkpoint of running agents. The agents report each stream index they reach; a checkpoint picks an
+    index that none of them has reached yet, and each agent pauses there, saves its classical state and waits at a
+    barrier while the parent process writes the shared streams.
+    '''
+
+    def __init__(self, agents):
+        '''
+        Instantiate the coordinator
+
+        :param list agents: the agents of the simulation
+        '''
+        self.slots = {agent.name: i for i, agent in enumerate(agents)}
+        self.lock = multiprocessing.Lock()
+        self.positions = sharedctypes.RawArray(ctypes.c_long, len(agents))
+        self.target = sharedctypes.RawValue(ctypes.c_long, -1)
+        self.path = sharedctypes.RawArray(ctypes.c_char, 4096)
+        self.barrier = multiprocessing.Barrier(len(agents) + 1)
+
+    def reached(self, agent, index):
+        '''
+        Record that an agent is about to process a system, pausing it there if a checkpoint is requested at that index
+
+        :param Agent agent: the agent, in its own process
+        :param int index: the stream index of the system
+        '''
+        with self.lock:
+            self.positions[self.slots[agent.name]] = index
+            pause = index == self.target.value
+        if pause:
+            agent.save_state(self.path.value.decode())
+            try:
+                self.barrier.wait()  # every agent has saved its state; the parent writes the streams
+                self.barrier.wait()  # the streams are written
+            except threading.BrokenBarrierError:
+                pass  # the checkpoint was abandoned by the parent
+
+    def request(self, path, num_systems):
+        '''
+        Request a checkpoint at the next stream index that no agent has reached yet
+
+        :param str path: the checkpoint directory
+        :param int num_systems: the number of systems in the shortest stream of the agents
+        :return: the stream index at which the agents pause
+        '''
+        path = os.path.abspath(path).encode()
+        if len(path) >= len(self.path):
+            raise ValueError("Checkpoint path is too long")
+        with self.lock:
+            index = max(self.positions) + 1
+            if index >= num_systems:
+                raise RuntimeError("Agents are too close to the end of their streams to be checkpointed")
+            self.path.value = path
+            self.target.value = index
+        return index
+
+
 class Simulation:
     '''
     Simulation class for easily creating and running agent-based simulations.
@@ -26,16 +146,24 @@ class Simulation:
     '''
 
     # noinspection PyUnresolvedReferences
-    def __init__(self, *args):
+    def __init__(self, *args, seed = None):
         '''
         Initialize the simulation
 
         :param args: unpacked list of agents, e.g. Simulation(alice, bob, charlie). All agents must share the same
                      output dictionary using Agent.shared_output()
+        :param int seed: root seed of the random streams given to each agent process and each channel when the
+                         simulation is run. The streams are independent either way; with a seed, runs are
+                         reproducible. Default: None (fresh entropy)
         '''
         self.out = args[0].out
         self.agents = args
+        self.seed = seed
         self.is_notebook = is_notebook()
+        # Shared-memory output arrays allocated by the agents, available after run(); see Agent.output_array()
+        self.arrays = {}
+        # Coordinator of checkpoints taken while the agents run
+        self._checkpoints = None
 
     def progress_monitor(self, poison_pill):
         '''
@@ -66,6 +194,89 @@ class Simulation:
             pbars[agent.name].n = pbars[agent.name].total
             pbars[agent.name].close()
 
+    def checkpoint(self, path, chunk_size = 1024, timeout = None):
+        '''
+        Save the simulation to a checkpoint directory. Each distinct stream buffer used by the agents is written in
+        chunks to a raw ``.npy`` file, and the classical state of each agent is saved with ``Agent.save_state()``.
+
+        Before ``run()``, the agents are saved from this process. While the simulation runs (e.g. when called from
+        another thread of this process), the checkpoint is coordinated with the agents: each agent pauses before the
+        first stream index that none of them has reached yet and saves its own state, and the streams are written
+        while all of them are paused. Every agent must therefore be iterating over its stream, and no messages may be
+        in flight between agents across that system boundary, since channel contents are not saved. An agent which has
+        finished cannot be checkpointed, so neither can a simulation after ``run()`` has returned.
+
+        :param str path: the directory to write the checkpoint to; created if it does not exist
+        :param int chunk_size: number of quantum systems to write at a time
+        :param float timeout: seconds to wait for running agents to pause before giving up with a ``RuntimeError``.
+                              Default: None (wait indefinitely)
+        '''
+        os.makedirs(path, exist_ok = True)
+        if all(agent.pid is None for agent in self.agents):
+            self._write_streams(path, chunk_size)
+            for agent in self.agents:
+                agent.save_state(path)
+            return
+        finished = [agent.name for agent in self.agents if agent.pid is None or not agent.is_alive()]
+        if finished or self._checkpoints is None:
+            raise RuntimeError("Cannot checkpoint agents which are not running: {}".format(finished))
+        self._checkpoints.request(path, min(len(agent.qstream) for agent in self.agents))
+        try:
+            self._checkpoints.barrier.wait(timeout)
+        except threading.BrokenBarrierError:
+            raise RuntimeError("Agents did not pause for the checkpoint; every agent must iterate over its stream")
+        try:
+            self._write_streams(path, chunk_size)
+        finally:
+            with self._checkpoints.lock:
+                self._checkpoints.target.value = -1
+            self._checkpoints.barrier.wait()
+
+    def _write_streams(self, path, chunk_size):
+        '''
+        Write each distinct stream buffer of the agents, and which one each agent uses, to a checkpoint directory
+
+        :param str path: the checkpoint directory
+        :param int chunk_size: number of quantum systems to write at a time
+        '''
+        buffers, stream_of_agent = [], {}
+        for agent in self.agents:
+            # Packed streams are saved in their packed form and ragged streams as their flat buffer, and re-wrapped by
+            # ``attach()`` on resume
+            state = agent.qstream.state
+            state = getattr(state, "packed", getattr(state, "buffer", state))
+            root = _root_buffer(state)
+            for i, buffer in enumerate(buffers):
+                if buffer is root:
+                    break
+            else:
+                i = len(buffers)
+                buffers.append(root)
+                _write_array(os.path.join(path, "stream{}.npy".format(i)), state, chunk_size)
+            stream_of_agent[agent.name] = i
+        with open(os.path.join(path, "simulation.pkl"), "wb") as f:
+            pickle.dump({"streams": stream_of_agent}, f)
+
+    def resume(self, path):
+        '''
+        Restore the simulation from a checkpoint directory written by ``Simulation.checkpoint()``, before ``run()``.
+        Each stream file is copied and the copy is memory-mapped to replace the agents' stream buffers, so agent
+        processes forked afterwards share it without it being loaded into memory, and the checkpoint itself is never
+        modified and can be resumed again. Agent classical state, including each agent's stream head, is restored with
+        ``Agent.load_state()``, so iterating over an agent's stream continues from where the agent was checkpointed.
+
+        :param str path: the checkpoint directory
+        '''
+        with open(os.path.join(path, "simulation.pkl"), "rb") as f:
+            stream_of_agent = pickle.load(f)["streams"]
+        arrays = {}
+        for agent in self.agents:
+            i = stream_of_agent[agent.name]
+            if i not in arrays:
+                arrays[i] = _map_copy(os.path.join(path, "stream{}.npy".format(i)))
+            agent.qstream.attach(arrays[i])
+            agent.load_state(path)
+
     # noinspection PyUnboundLocalVariable
     def run(self, monitor_progress = True):
         '''
@@ -73,18 +284,246 @@ class Simulation:
 
         :param monitor_progress: whether to display a progress bar for each agent
         '''
+        # Spawn a random stream per agent and per channel; each agent process installs its own stream in ``run()``
+        channels = _channels(self.agents)
+        streams = rng.spawn_streams(self.seed, len(self.agents) + len(channels))
+        for key, stream in zip(sorted(channels), streams[len(self.agents):]):
+            channels[key].rng = stream
+        self._checkpoints = _Checkpoints(self.agents)
+        try:
+            for agent, stream in zip(self.agents, streams):
+                agent.rng = stream
+                agent._checkpoints = self._checkpoints
+                agent.start()
 
-        for agent in self.agents:
-            agent.start()
+            if monitor_progress:
+                poison_pill = threading.Event()
+                progress_monitor = threading.Thread(target = self.progress_monitor, args = (poison_pill,))
+                progress_monitor.start()
 
-        if monitor_progress:
-            poison_pill = threading.Event()
-            progress_monitor = threading.Thread(target = self.progress_monitor, args = (poison_pill,))
-            progress_monitor.start()
+            for agent in self.agents:
+                agent.join()
 
-        for agent in self.agents:
-            agent.join()
+            if monitor_progress:
+                poison_pill.set()
+                progress_monitor.join()
+        finally:
+            # Map the agents' output arrays, then remove their shared memory blocks even if an agent failed; the
+            # mapped arrays stay valid
+            self.arrays = Agent.shared_output_arrays(self.out)
+            for handle in list(self.out.values()):
+                if isinstance(handle, SharedOutputArray):
+                    handle.unlink()
+
+
+def _grid(parameters):
+    '''
+    Expand sweep parameters into a list of points
+
+    :param dict|list parameters: a dict mapping each parameter name to a list of values (swept over the full
+                                 Cartesian product), or a list of dicts, one per point
+    :return: list of dicts mapping parameter names to values
+    '''
+    if isinstance(parameters, dict):
+        names = list(parameters)
+        return [dict(zip(names, values)) for values in itertools.product(*(parameters[n] for n in names))]
+    return [dict(point) for point in parameters]
+
+
+def _channels(agents):
+    '''
+    Find the channels connecting a set of agents
+
+    :param [Agent] agents: the connected agents
+    :return: dict mapping (kind, from name, to name) to the channel, with kind "q" or "c"
+    '''
+    found = {}
+    for agent in agents:
+        for other, channel in agent.qchannels_out.items():
+            found[("q", agent.name, other.name)] = channel
+        for other, channel in agent.cchannels_out.items():
+            found[("c", agent.name, other.name)] = channel
+    return found
+
+
+class _Group:
+    '''
+    One set of persistent sweep workers: a stream buffer, a mailbox per agent and one worker process per agent
+    '''
+
+    def __init__(self, qstream, names):
+        self.qstream = qstream
+        self.mailboxes = {name: Mailbox() for name in names}
+        self.tasks = {name: multiprocessing.Queue() for name in names}
+        self.workers = []
+
+
+class Sweep:
+    '''
+    Runs an agent protocol over a grid of parameters while reusing processes, stream buffers and agent mailboxes
+    between points. Worker processes (one per agent, per group of concurrently running points) are forked once; for
+    each point, the stream buffer is reset with ``qstream.reset()`` and every worker rebuilds the agents with the new
+    parameters by calling ``setup``, then runs its own agent. Agents built by ``setup`` join a ``Network`` over the
+    group's persistent mailboxes, so their channels deliver to the mailboxes and no queue is allocated per point;
+    messages are tagged by point, so any left unread by one point are never received at the next.
+    The outputs of each point are collected into a structured result array.
+
+    Channels given another network or queue by ``setup`` are rerouted through the mailboxes once it returns. An
+    adaptive stream (``use_density_matrix = "auto"``) is promoted before the workers are started if any point of the
+    first ``run()`` needs density matrices; a later run needing promotion fails, so promote the stream beforehand.
+    '''
+
+    def __init__(self, setup, qstream, concurrency = 1, seed = None):
+        '''
+        Instantiate the sweep. No processes are started until ``run()`` is first called.
+
+        :param callable setup: function ``setup(qstream, out, **point)`` which instantiates and connects the agents of
+                               the protocol for one parameter point and returns them as a list
+        :param QStream qstream: the stream the agents operate on; its buffer is reused for every point. Any stream
+                                type may be used (e.g. ``MPSQStream`` or ``RaggedQStream``); additional concurrent
+                                points allocate their buffers with ``qstream.allocate_like()``
+        :param int concurrency: number of points to run at once; each additional concurrent point allocates its own
+                                stream buffer and set of worker processes
+        :param int seed: root seed of the random streams given to each worker process. Default: None (fresh entropy)
+        '''
+        self.setup = setup
+        self.qstream = qstream
+        self.concurrency = concurrency
+        self.seed = seed
+        self._groups = []
+        self._names = None
+        self._results = multiprocessing.Queue()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _start(self, points):
+        '''
+        Discover the agents and channels from the first point, then fork the workers of each group. An adaptive stream
+        which any of the points promotes to density matrices is promoted here, since the workers cannot replace the
+        shared buffer.
+        '''
+        agents = self.setup(self.qstream, {}, **points[0])
+        if getattr(self.qstream, "adaptive", False):
+            for point in points[1:]:
+                if self.qstream.use_density_matrix:
+                    break
+                self.setup(self.qstream, {}, **point)
+        self._names = [agent.name for agent in agents]
+        streams = iter(rng.spawn_streams(self.seed, self.concurrency * len(self._names)))
+        for g in range(self.concurrency):
+            qstream = self.qstream if g == 0 else self.qstream.allocate_like()
+            group = _Group(qstream, self._names)
+            self._groups.append(group)
+            for name in self._names:
+                worker = multiprocessing.Process(target = self._work, args = (g, name, next(streams)), daemon = True)
+                worker.start()
+                group.workers.append(worker)
+
+    def _work(self, g, name, stream):
+        '''
+        Worker process loop: rebuild the protocol for each dispatched point and run one agent of it
 
-        if monitor_progress:
-            poison_pill.set()
-            progress_monitor.join()
+        :param int g: the index of the worker's group
+        :param str name: the name of the agent this worker runs
+        :param RandomStream stream: the worker's random stream, used by the agents it builds
+        '''
+        rng.set_stream(stream)
+        group = self._groups[g]
+        while True:
+            task = group.tasks[name].get()
+            if task is None:
+                return
+            index, point = task
+            try:
+                out = {}
+                group.mailboxes[name].clear()
+                # Channels built by setup deliver to the persistent mailboxes, tagged by point
+                with Network(mailboxes = group.mailboxes, tag = index).as_default():
+                    agents = self.setup(group.qstream, out, **point)
+                for (kind, source, target), channel in _channels(agents).items():
+                    mailbox = group.mailboxes[target]
+                    if not (isinstance(channel.queue, MailboxQueue) and channel.queue.mailbox is mailbox):
+                        channel.queue = mailbox.endpoint((kind, source, index))
+                agent = next(agent for agent in agents if agent.name == name)
+                agent.run()
+                self._results.put((g, index, name, out.get(name), None))
+            except Exception:
+                self._results.put((g, index, name, None, traceback.format_exc()))
+            finally:
+                # Output arrays are not collected from sweep points, so their shared memory is removed right away
+                for handle in out.values():
+                    if isinstance(handle, SharedOutputArray):
+                        handle.unlink()
+
+    def run(self, parameters):
+        '''
+        Run the protocol at every point of a parameter sweep
+
+        :param dict|list parameters: a dict mapping each parameter name to a list of values (swept over the full
+                                     Cartesian product), or a list of dicts, one per point
+        :return: a structured array with one record per point, holding the parameter values and each agent's output
+                 (``self.out[agent.name]``) in a field named after the agent
+        '''
+        points = _grid(parameters)
+        if not points:
+            return None
+        if not self._groups:
+            self._start(points)
+        names = sorted(points[0])
+        fields = [(n, np.asarray([p[n] for p in points]).dtype) for n in names]
+        result = np.zeros(len(points), dtype = fields + [(name, object) for name in self._names])
+        for i, point in enumerate(points):
+            for n in names:
+                result[i][n] = point[n]
+        pending = iter(enumerate(points))
+        remaining = {}  # group index -> number of agents still running its current point
+        for g in range(len(self._groups)):
+            self._dispatch(g, pending, remaining)
+        while remaining:
+            g, index, name, output, error = self._results.get()
+            if error is not None:
+                # Other agents of the point may be blocked waiting on the failed one, so the workers are discarded
+                self.terminate()
+                raise RuntimeError("agent " + name + " failed at sweep point " + str(points[index]) + ":\n" + error)
+            result[index][name] = output
+            remaining[g] -= 1
+            if remaining[g] == 0:
+                del remaining[g]
+                self._dispatch(g, pending, remaining)
+        return result
+
+    def _dispatch(self, g, pending, remaining):
+        '''Reset a group's stream and send it the next point, if any'''
+        task = next(pending, None)
+        if task is None:
+            return
+        group = self._groups[g]
+        group.qstream.reset()
+        for name in self._names:
+            group.tasks[name].put(task)
+        remaining[g] = len(self._names)
+
+    def close(self):
+        '''
+        Stop and join the worker processes
+        '''
+        for group in self._groups:
+            for name in self._names:
+                group.tasks[name].put(None)
+            for worker in group.workers:
+                worker.join()
+        self._groups = []
+
+    def terminate(self):
+        '''
+        Terminate the worker processes immediately, e.g. after an agent has failed
+        '''
+        for group in self._groups:
+            for worker in group.workers:
+                worker.terminate()
+                worker.join()
+        self._groups = []
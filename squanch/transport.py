@@ -0,0 +1,261 @@
+import collections
+import multiprocessing
+import os
+import pickle
+import socket
+import struct
+import time
+import weakref
+
+__all__ = ["SocketQueue", "Mailbox", "MailboxQueue"]
+
+# Frame header: payload length in bytes and number of messages in the frame
+_HEADER = struct.Struct("!II")
+
+# Socket queues in this process with messages waiting to be sent
+_unflushed = weakref.WeakSet()
+
+
+def _flush_all():
+    '''
+    Flush every socket queue in this process with pending messages. Called before blocking on a receive, so an agent
+    waiting for a reply never holds back the request that the reply depends on.
+    '''
+    for queue in list(_unflushed):
+        queue.flush()
+
+
+def _recv_exactly(sock, num_bytes):
+    '''
+    Read exactly num_bytes from a stream socket
+
+    :param socket.socket sock: the connected socket
+    :param int num_bytes: the number of bytes to read
+    :return: the bytes read
+    '''
+    buffer = bytearray(num_bytes)
+    view = memoryview(buffer)
+    received = 0
+    while received < num_bytes:
+        count = sock.recv_into(view[received:])
+        if count == 0:
+            raise EOFError("socket closed by the sending agent")
+        received += count
+    return buffer
+
+
+class SocketQueue:
+    '''
+    A one-directional, queue-like transport over a TCP or Unix domain socket, usable in place of a
+    ``multiprocessing.Queue`` for channels between agents in different processes or on different hosts. The
+    receiving end listens on the address and the sending end connects to it, retrying until the receiver is up.
+    Messages are pickled and sent in length-prefixed frames holding up to ``batch_size`` messages each.
+    '''
+
+    def __init__(self, address, batch_size = 1, connect_timeout = 30.0):
+        '''
+        Instantiate the socket queue. No socket is opened until ``listen()``, ``put()`` or ``get()`` is called.
+
+        :param str|tuple address: a filesystem path for a Unix domain socket, or a (host, port) tuple for TCP
+        :param int batch_size: number of messages to buffer before sending a frame. Pending messages are also sent
+                               by ``flush()``, and before any socket queue in the same process blocks on a receive.
+        :param float connect_timeout: seconds for the sending end to keep retrying to connect to the receiving end
+        '''
+        self.address = address
+        self.batch_size = batch_size
+        self.connect_timeout = connect_timeout
+        self.family = socket.AF_UNIX if isinstance(address, str) else socket.AF_INET
+        self._sock = None
+        self._listener = None
+        self._outbox = []
+        self._inbox = collections.deque()
+
+    def __getstate__(self):
+        '''
+        Socket queues are pickled without their open sockets or buffered messages
+        '''
+        state = self.__dict__.copy()
+        state.update(_sock = None, _listener = None, _outbox = [], _inbox = collections.deque())
+        return state
+
+    def put(self, message):
+        '''
+        Queue a picklable message to be sent to the receiving end
+
+        :param any message: the message to send
+        '''
+        self._outbox.append(message)
+        if len(self._outbox) >= self.batch_size:
+            self.flush()
+        else:
+            _unflushed.add(self)
+
+    def flush(self):
+        '''
+        Send all buffered messages as a single frame
+        '''
+        _unflushed.discard(self)
+        if not self._outbox:
+            return
+        if self._sock is None:
+            self._connect()
+        payload = pickle.dumps(self._outbox, protocol = pickle.HIGHEST_PROTOCOL)
+        self._sock.sendall(_HEADER.pack(len(payload), len(self._outbox)) + payload)
+        self._outbox = []
+
+    def get(self):
+        '''
+        Retrieve the next message, blocking until a frame arrives if none are buffered
+
+        :return: the message
+        '''
+        if not self._inbox:
+            _flush_all()
+            if self._sock is None:
+                self.listen()
+                self._sock, _ = self._listener.accept()
+            length, _ = _HEADER.unpack(_recv_exactly(self._sock, _HEADER.size))
+            self._inbox.extend(pickle.loads(_recv_exactly(self._sock, length)))
+        return self._inbox.popleft()
+
+    def close(self):
+        '''
+        Flush any pending messages and close the sockets
+        '''
+        if self._outbox:
+            self.flush()
+        for sock in (self._sock, self._listener):
+            if sock is not None:
+                sock.close()
+        self._sock = self._listener = None
+
+    def listen(self):
+        '''
+        Bind the receiving end to the address and start listening, if this has not already been done. Calling this
+        in a parent process before agent processes are forked lets senders connect before the receiver first calls
+        ``get()``.
+        '''
+        if self._listener is not None:
+            return
+        listener = socket.socket(self.family, socket.SOCK_STREAM)
+        if self.family == socket.AF_UNIX:
+            if os.path.exists(self.address):
+                os.remove(self.address)
+        else:
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind(self.address)
+        listener.listen(1)
+        self._listener = listener
+
+    def _connect(self):
+        '''Connect the sending end, retrying until the receiving end is listening or the timeout expires'''
+        deadline = time.time() + self.connect_timeout
+        while True:
+            sock = socket.socket(self.family, socket.SOCK_STREAM)
+            try:
+                sock.connect(self.address)
+                break
+            except (ConnectionRefusedError, FileNotFoundError):
+                sock.close()
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.01)
+        if self.family == socket.AF_INET:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._sock = sock
+
+
+class Mailbox:
+    '''
+    The single inbound queue of an agent, shared by every channel leading to it. Senders tag each message with the
+    key of its channel; the receiving agent sorts the messages it reads into a buffer per key, so that receiving on one
+    channel never consumes a message meant for another. A network of N agents then needs N queues (and each sending
+    process one feeder thread per agent it sends to), rather than a queue per channel direction.
+    '''
+
+    def __init__(self, queue = None):
+        '''
+        Instantiate the mailbox
+
+        :param queue: the underlying transport with ``put()`` and ``get()`` methods, which must accept messages from
+                      any number of senders; default: a new ``multiprocessing.Queue``
+        '''
+        self.queue = queue if queue is not None else multiprocessing.Queue()
+        self._pending = collections.defaultdict(collections.deque)
+
+    def __getstate__(self):
+        '''
+        Mailboxes are pickled without the messages buffered by the receiving process
+        '''
+        state = self.__dict__.copy()
+        state["_pending"] = collections.defaultdict(collections.deque)
+        return state
+
+    def put(self, key, message):
+        '''
+        Send a message to the mailbox
+
+        :param key: the (hashable, picklable) key of the channel the message is sent on
+        :param any message: the message
+        '''
+        self.queue.put((key, message))
+
+    def get(self, key):
+        '''
+        Retrieve the next message sent on a channel, buffering any messages for other channels read in the meantime
+
+        :param key: the key of the channel to receive from
+        :return: the message
+        '''
+        pending = self._pending[key]
+        while not pending:
+            tag, message = self.queue.get()
+            self._pending[tag].append(message)
+        return pending.popleft()
+
+    def clear(self):
+        '''
+        Discard the messages buffered by the receiving process, e.g. those left unread by a finished protocol
+        '''
+        self._pending.clear()
+
+    def endpoint(self, key):
+        '''
+        A queue-like view of one channel's messages, to use as the ``queue`` of a channel
+
+        :param key: the key of the channel
+        :return: the ``MailboxQueue``
+        '''
+        return MailboxQueue(self, key)
+
+
+class MailboxQueue:
+    '''
+    One channel's view of a ``Mailbox``, with the ``put()`` and ``get()`` methods of a queue
+    '''
+
+    def __init__(self, mailbox, key):
+        '''
+        Instantiate the view
+
+        :param Mailbox mailbox: the receiving agent's mailbox
+        :param key: the key tagging this channel's messages
+        '''
+        self.mailbox = mailbox
+        self.key = key
+
+    def put(self, message):
+        '''
+        Send a message on the channel
+
+        :param any message: the message
+        '''
+        self.mailbox.put(self.key, message)
+
+    def get(self):
+        '''
+        Receive the next message on the channel
+
+        :return: the message
+        '''
+        return self.mailbox.get(self.key)
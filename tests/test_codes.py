@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from squanch import analysis, codes, gates
+from squanch.mps import MPSQStream
+from squanch.qstream import QStream, RaggedQStream
+
+# Each code with the single-qubit Pauli errors it is designed to correct
+CODES = [(codes.BitFlipCode, "X"), (codes.PhaseFlipCode, "Z"), (codes.ShorCode, "XYZ"), (codes.SteaneCode, "XYZ")]
+
+
+def _round_trip(code, pauli, qubit):
+    '''Encode a generic state, apply a Pauli error, correct it and decode; return the reduced data state before/after'''
+    stream = QStream(code.num_qubits, 1)
+    data = stream.system(0).qubit(0)
+    gates.RY(data, 1.1)
+    gates.RZ(data, 0.7)
+    before = analysis.partial_trace(stream, [0])[0]
+    code.encode(stream)
+    error = "I" * qubit + pauli + "I" * (code.num_qubits - qubit - 1)
+    x, z = codes._symplectic(error)
+    state = stream.state[0].reshape((1, -1))
+    state = codes._apply_pauli(state, x, z, range(code.num_qubits))
+    state = codes._apply_pauli(state, x, z, range(code.num_qubits, 2 * code.num_qubits), transpose = True)
+    stream.state[0] = state.reshape(stream.state[0].shape)
+    code.correct(stream, code.syndrome(stream))
+    code.decode(stream)
+    return before, analysis.partial_trace(stream, [0])[0]
+
+
+@pytest.mark.parametrize("code_class, paulis", CODES)
+def test_single_qubit_errors_are_corrected(code_class, paulis):
+    code = code_class()
+    for pauli in paulis:
+        for qubit in range(code.num_qubits):
+            before, after = _round_trip(code, pauli, qubit)
+            assert np.allclose(before, after, atol = 1e-4), (pauli, qubit)
+
+
+def _protect(stream, code, flipped):
+    '''Encode RY-rotated data qubits, flip one code qubit of some systems, correct and decode; return before/after'''
+    for i in range(stream.num_systems):
+        gates.RY(stream.system(i).qubit(0), 0.4 * (i + 1))
+    before = analysis.partial_trace(stream, [0])
+    code.encode(stream)
+    for i in flipped:
+        gates.X(stream.system(i).qubit(1))
+    code.correct(stream, code.syndrome(stream))
+    code.decode(stream)
+    return before, analysis.partial_trace(stream, [0])
+
+
+def test_packed_streams_are_corrected():
+    code = codes.BitFlipCode()
+    before, after = _protect(QStream(3, 4, use_density_matrix = True, packed = True), code, [0, 3])
+    assert np.allclose(before, after, atol = 1e-4)
+
+
+def test_ragged_streams_are_corrected_per_size_class():
+    code = codes.BitFlipCode()
+    stream = RaggedQStream([3, 4, 3, 5])
+    before, after = _protect(stream, code, [1, 2])
+    assert np.allclose(before, after, atol = 1e-4)
+    with pytest.raises(ValueError):
+        code.encode(RaggedQStream([2, 3]))
+
+
+def test_mps_streams_are_rejected():
+    with pytest.raises(TypeError):
+        codes.BitFlipCode().encode(MPSQStream(3, 2))
@@ -0,0 +1,37 @@
+import numpy as np
+
+from squanch import gates, rng
+from squanch.frames import PauliFrameSampler
+from squanch.noise import NoiseModel
+from squanch.qstream import QStream
+
+
+def _circuit(qubits):
+    gates.H(qubits[0])
+    gates.CNOT(qubits[0], qubits[1])
+    gates.PHASE(qubits[1], np.pi / 2)
+    gates.CNOT(qubits[1], qubits[2])
+    gates.H(qubits[2])
+    gates.X(qubits[0])
+    gates.SWAP(qubits[0], qubits[2])
+
+
+def test_frame_statistics_match_stream_sampling():
+    model = NoiseModel(one_qubit = 0.05, two_qubit = 0.08)
+    shots = 40000
+    sampler = PauliFrameSampler(3, noise_model = model)
+    qubits = list(sampler.qubits)
+    _circuit(qubits)
+    for qubit in qubits:
+        qubit.measure()
+    with rng.use_stream(rng.RandomStream(1)):
+        records = sampler.sample(shots)
+    assert np.array_equal(records, sampler.sample(shots, stream = rng.RandomStream(1)))
+    frames = np.bincount(records[:, 0] * 4 + records[:, 1] * 2 + records[:, 2], minlength = 8) / shots
+
+    stream = QStream(3, 1)
+    stream.noise_model = model
+    _circuit(list(stream.system(0).qubits))
+    with rng.use_stream(rng.RandomStream(2)):
+        exact = stream.sample([0, 1, 2], shots)[0] / shots
+    assert np.allclose(frames, exact, atol = 0.015)
@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+from squanch import gates, linalg
+from squanch.noise import NoiseModel
+from squanch.qstream import QStream
+
+
+def _random_hermitian(batch, dim, seed):
+    rng = np.random.default_rng(seed)
+    matrices = rng.normal(size = (batch, dim, dim)) + 1j * rng.normal(size = (batch, dim, dim))
+    return matrices + np.conj(np.swapaxes(matrices, -1, -2))
+
+
+@pytest.mark.parametrize("dim", [1, 2, 8])
+def test_pack_unpack_round_trip(dim):
+    matrices = _random_hermitian(16, dim, dim)
+    packed = linalg.pack_hermitian(matrices)
+    assert packed.dtype.kind == "f" and packed.shape == matrices.shape
+    assert np.allclose(linalg.unpack_hermitian(packed, dtype = np.complex128), matrices)
+    wrapped = linalg.HermitianPackedArray(packed)
+    assert np.allclose(wrapped[3:5], matrices[3:5])
+    wrapped[[1, 7]] = matrices[[7, 1]]
+    assert np.allclose(wrapped[1], matrices[7]) and np.allclose(wrapped[7], matrices[1])
+
+
+def _circuit(stream):
+    gates.H(stream.qubit(0))
+    gates.RY(stream.qubit(1), 0.7)
+    gates.CNOT(stream.qubit(0), stream.qubit(2))
+    gates.TOFFOLI(stream.qubit(1), stream.qubit(2), stream.qubit(0))
+    gates.PHASE(stream.qubit(2), np.pi / 2)
+    gates.CU(stream.qubit(2), stream.qubit(1), np.array([[0, -1j], [1j, 0]]))
+
+
+@pytest.mark.parametrize("noisy", [False, True])
+def test_packed_and_unpacked_streams_agree(noisy):
+    streams = [QStream(3, 5, use_density_matrix = True, packed = packed) for packed in (False, True)]
+    for stream in streams:
+        if noisy:
+            stream.noise_model = NoiseModel(one_qubit = 0.05, two_qubit = 0.1, damping = 0.02)
+        _circuit(stream)
+    unpacked, packed = streams
+    assert isinstance(packed.state, linalg.HermitianPackedArray)
+    assert np.allclose(packed.state[:], unpacked.state, atol = 1e-5)
+
+
+def _random_states(batch, num_qubits, is_density, seed):
+    rng = np.random.default_rng(seed)
+    vectors = rng.normal(size = (batch, 2 ** num_qubits)) + 1j * rng.normal(size = (batch, 2 ** num_qubits))
+    vectors /= np.linalg.norm(vectors, axis = -1, keepdims = True)
+    if not is_density:
+        return vectors
+    return np.einsum("bi,bj->bij", vectors, np.conj(vectors))
+
+
+@pytest.mark.parametrize("is_density", [False, True])
+@pytest.mark.parametrize("controls, targets, control_states", [
+    ([0], [3], [0]),
+    ([3, 1], [0], [0, 1]),
+    ([0, 3], [2], [1, 0]),
+    ([2], [0, 3], [0]),
+    ([1, 3], [2, 0], None),
+])
+def test_controlled_slice_kernel_matches_dense(is_density, controls, targets, control_states):
+    states = _random_states(6, 4, is_density, len(controls) + len(targets))
+    operator = np.linalg.qr(_random_hermitian(1, 2 ** len(targets), 1)[0] + 3j * np.eye(2 ** len(targets)))[0]
+    dense = linalg.controlled_operator(operator, len(controls), control_states)
+    expected = linalg.apply_operator(states, dense, controls + targets, is_density)
+    result = linalg.apply_controlled_operator(states.copy(), operator, controls, targets, is_density, control_states)
+    assert np.allclose(result, expected)
+
+    stream = QStream(4, 6, use_density_matrix = is_density)
+    stream.state[:] = states
+    stream.apply_controlled(operator, controls, targets, control_states = control_states)
+    assert np.allclose(stream.state, expected)
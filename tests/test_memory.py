@@ -0,0 +1,23 @@
+import numpy as np
+
+from squanch import gates
+from squanch.memory import QuantumMemory
+from squanch.qstream import QStream
+
+
+def test_qubits_of_the_parent_stream_are_stored_as_references():
+    stream = QStream(1, 2)
+    memory = QuantumMemory(stream)
+    memory.append(stream.system(1).qubit(0))
+    assert tuple(memory.references[0]) == (1, 0)
+
+
+def test_qubits_of_another_stream_keep_their_state():
+    stream_a = QStream(1, 2)
+    stream_b = QStream(1, 2)
+    qubit = stream_b.system(0).qubit(0)
+    gates.X(qubit)
+    memory = QuantumMemory(stream_a)
+    memory.append(qubit)
+    assert memory[0].measure() == 1
+    assert np.allclose(stream_a.state[0], [[1, 0], [0, 0]])
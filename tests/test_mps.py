@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from squanch import gates
+from squanch.mps import MPSQStream, MPSQSystem
+from squanch.qubit import QSystem
+
+
+def _ghz(qsystem):
+    qubits = list(qsystem.qubits)
+    gates.H(qubits[0])
+    for control, target in zip(qubits, qubits[1:]):
+        gates.CNOT(control, target)
+
+
+def _cluster(qsystem):
+    qubits = list(qsystem.qubits)
+    for qubit in qubits:
+        gates.H(qubit)
+    for control, target in zip(qubits, qubits[1:]):
+        gates.CPHASE(control, target, np.pi)
+    gates.CNOT(qubits[0], qubits[-1])  # a non-adjacent gate, routed with swaps
+    gates.RY(qubits[2], 0.4)
+
+
+@pytest.mark.parametrize("circuit", [_ghz, _cluster])
+def test_mps_matches_dense(circuit):
+    dense = QSystem(6, use_density_matrix = False)
+    mps = MPSQSystem(6, max_bond_dimension = 8)
+    circuit(dense)
+    circuit(mps)
+    assert np.allclose(mps.to_statevector(), dense.state, atol = 1e-5)
+    for qubits in ([0], [2, 5], [4, 1, 3]):
+        dense_probabilities = np.abs(dense.state.reshape((2,) * 6).transpose(
+            qubits + [q for q in range(6) if q not in qubits]).reshape((2 ** len(qubits), -1))) ** 2
+        assert np.allclose(mps.probabilities(qubits), dense_probabilities.sum(axis = 1), atol = 1e-5)
+
+
+def test_truncation_keeps_the_state_normalized():
+    mps = MPSQSystem(8, max_bond_dimension = 2)
+    rng = np.random.default_rng(1)
+    for _ in range(40):
+        i, j = rng.choice(8, size = 2, replace = False)
+        gates.RY(mps.qubit(i), rng.uniform(0, np.pi))
+        gates.CNOT(mps.qubit(i), mps.qubit(j))
+    assert mps.truncation_error > 0
+    assert max(mps.bond_dimensions) <= 2
+    assert np.isclose(np.linalg.norm(mps.to_statevector()), 1, atol = 1e-4)
+
+
+def test_mps_streams_cannot_be_promoted():
+    with pytest.raises(TypeError):
+        MPSQStream(2, 2).promote()
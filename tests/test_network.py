@@ -0,0 +1,49 @@
+from squanch.agent import Agent
+from squanch.channels import CChannel, QChannel, SocketCChannel, SocketQChannel
+from squanch.network import accepts_queue
+from squanch.qstream import QStream
+from squanch.simulate import Simulation
+from squanch.transport import MailboxQueue
+
+
+class Relay(Agent):
+    def run(self):
+        peers = sorted(self.qchannels_out, key = lambda agent: agent.name)
+        index = int(self.name[-1])
+        received = []
+        for peer in peers:
+            self.csend(peer, index)
+        for peer in peers:
+            received.append(self.crecv(peer))
+        self.output(sorted(received))
+
+
+def test_agents_without_a_network_share_one_mailbox_each():
+    qstream = QStream(1, 6)
+    out = Agent.shared_output()
+    agents = [Relay(qstream, out, name = "Node" + str(i)) for i in range(1, 4)]
+    for i, agent in enumerate(agents):
+        for other in agents[i + 1:]:
+            agent.qconnect(other)
+            agent.cconnect(other)
+    network = agents[0].network
+    assert network.implicit and all(agent.network is network for agent in agents)
+    assert len(network.mailboxes) == len(agents)
+    channels = [c for agent in agents for c in list(agent.qchannels_out.values()) + list(agent.cchannels_out.values())]
+    assert all(isinstance(channel.queue, MailboxQueue) for channel in channels)
+    Simulation(*agents).run(monitor_progress = False)
+    assert [out[agent.name] for agent in agents] == [[2, 3], [1, 3], [1, 2]]
+
+
+def test_per_channel_queues_on_request():
+    qstream = QStream(1, 2)
+    alice, bob = Agent(qstream, name = "Alice", network = False), Agent(qstream, name = "Bob")
+    assert alice.network is None
+    alice.qconnect(bob)
+    assert not isinstance(alice.qchannels_out[bob].queue, MailboxQueue)
+    carol, dave = Agent(qstream, name = "Carol"), Agent(qstream, name = "Dave")
+    carol.qconnect(dave, QChannel, queue = None)
+    assert not isinstance(carol.qchannels_out[dave].queue, MailboxQueue)
+    assert carol.network is not dave.network
+    assert accepts_queue(QChannel) and accepts_queue(CChannel)
+    assert not accepts_queue(SocketQChannel) and not accepts_queue(SocketCChannel)
@@ -0,0 +1,34 @@
+import numpy as np
+
+from squanch import gates
+from squanch.noise import NoiseModel
+from squanch.qstream import QStream, RaggedQStream
+
+
+def test_readout_error_applies_to_every_stream_measurement():
+    stream = QStream(2, 8)
+    stream.noise_model = NoiseModel(readout = 1.0)
+    assert np.all(stream.measure_qubit(0) == 1)
+    assert np.all(stream.measure_in_basis(1, "Z") == 1)
+    stream.reset()
+    stream.prepare_bell(0, 1)
+    assert np.all(stream.bell_measure(0, 1) == 1)
+
+
+def test_readout_error_applies_to_ragged_streams():
+    stream = RaggedQStream([1, 2, 2, 3])
+    stream.noise_model = NoiseModel(readout = 1.0)
+    assert np.all(stream.measure_qubit(0) == 1)
+    assert np.all(stream.measure_in_basis(0, "Z") == 1)
+
+
+def test_gates_without_cache_id_are_cached_by_operator():
+    model = NoiseModel(one_qubit = 0.1)
+    stream = QStream(1, 4, use_density_matrix = True)
+    stream.noise_model = model
+    rotation = np.array([[np.cos(0.3), -np.sin(0.3)], [np.sin(0.3), np.cos(0.3)]])
+    stream.apply_local(rotation, [0])
+    stream.apply_local(rotation.copy(), [0])
+    assert len(model._superoperators) == 1
+    stream.apply_local(rotation.T, [0])
+    assert len(model._superoperators) == 2
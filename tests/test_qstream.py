@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+
+from squanch import analysis, gates
+from squanch.agent import Agent
+from squanch.memory import DecoherenceModel
+from squanch.mps import MPSQStream
+from squanch.noise import NoiseModel
+from squanch.qstream import QStream, RaggedQStream
+
+# Measuring in Y: the basis change H S^dagger, which maps |+i> to |0> and |-i> to |1>
+Y_BASIS = np.array([[1, -1j], [1, 1j]]) / np.sqrt(2)
+X_BASIS = np.array([[1, 1], [1, -1]]) / np.sqrt(2)
+
+
+def _streams():
+    return [QStream(2, 8, use_density_matrix = False), QStream(2, 8, use_density_matrix = True), MPSQStream(2, 8)]
+
+
+@pytest.mark.parametrize("index", range(3))
+@pytest.mark.parametrize("bit", [0, 1])
+def test_y_basis_agrees_between_sample_and_measure_in_basis(index, bit):
+    stream = _streams()[index]
+    if bit:
+        gates.X(stream.qubit(0))
+    gates.H(stream.qubit(0))
+    gates.PHASE(stream.qubit(0), np.pi / 2)
+    counts = stream.sample([0], 50, basis = Y_BASIS)
+    assert np.all(counts[:, bit] == 50)
+    assert np.all(stream.measure_in_basis(0, "Y") == bit)
+    assert np.all(stream.measure_in_basis(0, Y_BASIS) == bit)
+
+
+@pytest.mark.parametrize("index", range(3))
+@pytest.mark.parametrize("basis", ["X", "Y"])
+def test_prepare_reads_back_through_sample(index, basis):
+    stream = _streams()[index]
+    bits = np.arange(8) % 2
+    stream.prepare(0, bits, basis)
+    change = Y_BASIS if basis == "Y" else np.array([[1, 1], [1, -1]]) / np.sqrt(2)
+    counts = stream.sample([0], 20, basis = change)
+    assert np.all(counts[np.arange(8), bits] == 20)
+
+
+SIZES = np.array([1, 3, 2, 1, 3, 2])
+
+
+def _mixed_circuit(stream, sizes):
+    gates.H(stream.qubit(0))
+    stream.apply_controlled(np.array([[0, 1], [1, 0]]), [0], 1, where = sizes >= 2)
+    stream.apply_local(np.array([[np.cos(0.4), -np.sin(0.4)], [np.sin(0.4), np.cos(0.4)]]), [2], where = sizes >= 3)
+    stream.apply_controlled(np.diag([1, 1j]), [2], 0, where = sizes >= 3)
+
+
+@pytest.mark.parametrize("use_density_matrix", [False, True])
+def test_ragged_stream_matches_streams_of_each_size(use_density_matrix):
+    ragged = RaggedQStream(SIZES, use_density_matrix = use_density_matrix)
+    _mixed_circuit(ragged, SIZES)
+    for i, size in enumerate(SIZES):
+        single = QStream(int(size), 1, use_density_matrix = use_density_matrix)
+        _mixed_circuit(single, np.array([size]))
+        assert np.allclose(ragged.state[i], single.state[0], atol = 1e-6)
+
+    probabilities = analysis.probabilities(ragged, [0])
+    counts = ragged.sample([0], 20000)
+    assert counts.shape == (len(SIZES), 2) and np.all(counts.sum(axis = 1) == 20000)
+    assert np.allclose(counts / 20000, probabilities, atol = 0.03)
+
+    outcomes = ragged.measure_qubit(0)
+    assert np.allclose(analysis.probabilities(ragged, [0])[np.arange(len(SIZES)), outcomes], 1, atol = 1e-5)
+    bits = ragged.measure_in_basis(0, "X")
+    assert np.allclose(analysis.probabilities(ragged, [0], basis = X_BASIS)[np.arange(len(SIZES)), bits], 1,
+                       atol = 1e-5)
+
+
+def test_adaptive_ragged_stream_is_promoted_by_mixing_models():
+    ragged = RaggedQStream(SIZES, use_density_matrix = "auto")
+    assert not ragged.use_density_matrix and ragged.buffer.size == np.sum(2 ** SIZES)
+    _mixed_circuit(ragged, SIZES)
+    vectors = [ragged.state[i].copy() for i in range(len(SIZES))]
+    agent = Agent(ragged, memory_model = DecoherenceModel(t1 = 1.0, t2 = 1.0))
+    assert ragged.use_density_matrix and agent.qstream.use_density_matrix
+    assert agent.qstream.buffer is ragged.buffer
+    for i, vector in enumerate(vectors):
+        assert np.allclose(ragged.state[i], np.outer(vector, vector.conj()), atol = 1e-6)
+
+    other = RaggedQStream(SIZES, use_density_matrix = "auto")
+    other.noise_model = NoiseModel(one_qubit = 0.1)
+    assert other.use_density_matrix and all(stream.use_density_matrix for stream in other.classes.values())
+    gates.H(other.qubit(0))
+    assert np.all(analysis.purity(other, [0]) < 0.99)
@@ -0,0 +1,193 @@
+import multiprocessing
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+import pytest
+
+from squanch import gates
+from squanch.agent import Agent
+from squanch.errors import RandomUnitaryError
+from squanch.noise import NoiseModel
+from squanch.qstream import QStream
+from squanch.simulate import Simulation, Sweep
+
+NUM_SYSTEMS = 40
+
+
+class Alice(Agent):
+    def run(self):
+        bob = next(iter(self.qchannels_out))
+        for qsys in self.qstream:
+            if qsys.index % 3 == 0:
+                gates.X(qsys.qubit(0))
+            self.qsend(bob, qsys.qubit(0))
+            time.sleep(0.01)
+
+
+class Bob(Agent):
+    def run(self):
+        alice = next(iter(self.qchannels_in))
+        results = self.cmem.setdefault("results", [])
+        for _ in self.qstream:
+            results.append(self.qrecv(alice).measure())
+        self.output(results)
+
+
+def _simulation():
+    '''Build a fresh Alice -> Bob simulation on its own stream'''
+    out = Agent.shared_output()
+    qstream = QStream(1, NUM_SYSTEMS)
+    alice = Alice(qstream, out)
+    bob = Bob(qstream, out)
+    alice.qconnect(bob)
+    return Simulation(alice, bob), out
+
+
+def test_checkpoint_mid_run_resumes_where_it_left_off(tmp_path):
+    simulation, out = _simulation()
+    simulation.run(monitor_progress = False)
+    expected = list(out["Bob"])
+    assert expected == [int(i % 3 == 0) for i in range(NUM_SYSTEMS)]
+
+    simulation, out = _simulation()
+    runner = threading.Thread(target = simulation.run, kwargs = {"monitor_progress": False})
+    runner.start()
+    while out["Bob:progress"] < 5:
+        time.sleep(0.01)
+    simulation.checkpoint(str(tmp_path), timeout = 30)
+    runner.join()
+
+    simulation, out = _simulation()
+    simulation.resume(str(tmp_path))
+    bob = simulation.agents[1]
+    assert 5 <= bob.qstream.index < NUM_SYSTEMS
+    assert len(bob.cmem["results"]) == bob.qstream.index
+    simulation.run(monitor_progress = False)
+    assert list(out["Bob"]) == expected
+
+
+class Sender(Agent):
+    def run(self):
+        receiver = next(iter(self.cchannels_out))
+        for _ in range(self.data):
+            self.csend(receiver, ("data", self.data))
+        # Left unread by the receiver; must not reach the next point run by the same workers
+        self.csend(receiver, ("stale", self.data))
+        qsys = self.qstream.system(0)
+        if self.data % 2:
+            gates.X(qsys.qubit(0))
+        self.qsend(receiver, qsys.qubit(0))
+
+
+class Receiver(Agent):
+    def run(self):
+        sender = next(iter(self.cchannels_in))
+        messages = [self.crecv(sender) for _ in range(self.data)]
+        self.output((messages, self.qrecv(sender).measure()))
+
+
+def _setup(qstream, out, n):
+    sender = Sender(qstream, out, data = n)
+    receiver = Receiver(qstream, out, data = n)
+    sender.qconnect(receiver)
+    sender.cconnect(receiver)
+    return [sender, receiver]
+
+
+def test_concurrent_sweep_keeps_points_apart():
+    points = [1, 2, 3, 4, 5, 6]
+    with Sweep(_setup, QStream(1, 1), concurrency = 2, seed = 1) as sweep:
+        result = sweep.run({"n": points})
+    assert list(result["n"]) == points
+    for n, (messages, bit) in zip(result["n"], result["Receiver"]):
+        assert messages == [("data", n)] * n
+        assert bit == n % 2
+
+
+class Crasher(Agent):
+    def run(self):
+        self.output_array("partial", (16,))[:] = 1
+        raise RuntimeError("agent failure")
+
+
+def test_output_arrays_of_failed_agents_are_removed():
+    out = Agent.shared_output()
+    simulation = Simulation(Crasher(QStream(1, 1), out))
+    simulation.run(monitor_progress = False)
+    handle = out["Crasher:partial"]
+    assert np.all(simulation.arrays["Crasher:partial"] == 1)
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name = handle.block_name)
+
+
+class NoisyFlipper(Agent):
+    def run(self):
+        qubit = self.qstream.system(0).qubit(0)
+        gates.X(qubit)
+        self.output((self.qstream.use_density_matrix, qubit.measure()))
+
+
+def _noisy_setup(qstream, out, damping):
+    return [NoisyFlipper(qstream, out, noise_model = NoiseModel(damping = damping))]
+
+
+def test_sweep_promotes_adaptive_streams_before_forking():
+    qstream = QStream(1, 1, use_density_matrix = "auto")
+    with Sweep(_noisy_setup, qstream, concurrency = 2) as sweep:
+        result = sweep.run({"damping": [0.0, 0.1]})
+    assert qstream.use_density_matrix
+    assert all(is_density for is_density, _ in result["NoisyFlipper"])
+
+
+def _promote(qstream, results):
+    try:
+        qstream.promote()
+        results.put(None)
+    except RuntimeError as error:
+        results.put(str(error))
+
+
+def test_promotion_outside_the_allocating_process_fails():
+    qstream = QStream(1, 2, use_density_matrix = "auto")
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target = _promote, args = (qstream, results))
+    process.start()
+    assert results.get(timeout = 30) is not None
+    process.join()
+    assert not qstream.use_density_matrix
+
+
+class Preparer(Agent):
+    def run(self):
+        receiver = next(iter(self.qchannels_out))
+        bases = self.rng.random(self.qstream.num_systems) < 0.5
+        for qsys in self.qstream:
+            if bases[qsys.index]:
+                gates.H(qsys.qubit(0))
+            self.qsend(receiver, qsys.qubit(0))
+        self.output(bases.tolist())
+
+
+class Measurer(Agent):
+    def run(self):
+        sender = next(iter(self.qchannels_in))
+        self.output([self.qrecv(sender).measure() for _ in self.qstream])
+
+
+def _seeded_run(seed):
+    out = Agent.shared_output()
+    qstream = QStream(1, NUM_SYSTEMS)
+    preparer, measurer = Preparer(qstream, out), Measurer(qstream, out)
+    preparer.qconnect(measurer)
+    channel = preparer.qchannels_out[measurer]
+    channel.errors = [RandomUnitaryError(channel, 0.5)]
+    Simulation(preparer, measurer, seed = seed).run(monitor_progress = False)
+    return out["Preparer"], out["Measurer"]
+
+
+def test_seeded_simulations_are_reproducible():
+    first = _seeded_run(7)
+    assert _seeded_run(7) == first
+    assert _seeded_run(8) != first